@@ -41,6 +41,7 @@ urlpatterns = [
     path("", core.home, name="home"),
     path("contact/", core.contact, name="contact"),
     path("healthz", core.healthz, name="healthz"),
+    path("readyz", copilot.readyz, name="readyz"),  # copilot warm-up status
 
     # auth & profile
     path("accounts/", include("django.contrib.auth.urls")),  # login/logout/password*
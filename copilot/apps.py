@@ -1,6 +1,15 @@
+import sys
+
 from django.apps import AppConfig
 
 
 class CopilotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'copilot'
+
+    def ready(self):
+        from . import signals, warmup  # noqa: F401 (signals registers the Paragraph change-log receivers)
+        # management commands (migrate, collectstatic, ...) don't need a warm retriever
+        is_command = len(sys.argv) > 1 and sys.argv[0].endswith("manage.py") and sys.argv[1] != "runserver"
+        if warmup.ENABLED and not is_command:
+            warmup.start()
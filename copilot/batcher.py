@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-text encode calls into one batched call.
+
+    Callers block in submit(); a daemon thread takes the first queued text,
+    keeps collecting until `max_batch` items or `max_wait_ms` have passed,
+    encodes them together and hands each caller its own row back.
+    The thread is (re)started lazily per process, so it is fork-safe.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch: int = 32, max_wait_ms: float = 3.0):
+        self.encode_fn = encode_fn
+        self.max_batch = int(max(1, max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._q: "queue.Queue[tuple[str, Future, float]]" = queue.Queue()
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self._stats = {"batches": 0, "items": 0, "errors": 0, "encode_s": 0.0,
+                       "queue_s": 0.0, "queue_max_s": 0.0, "max_batch_seen": 0}
+        self._started = time.monotonic()
+
+    def _ensure_thread(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._q = queue.Queue()
+            self._reset_stats()
+            threading.Thread(target=self._run, name="copilot-encode-batcher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, text: str, timeout: float | None = None) -> np.ndarray:
+        self._ensure_thread()
+        fut: Future = Future()
+        self._q.put((text, fut, time.monotonic()))
+        return fut.result(timeout=timeout)
+
+    def _collect(self) -> list:
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            t0 = time.monotonic()
+            try:
+                vecs = np.asarray(self.encode_fn([text for text, _, _ in batch]), dtype=np.float32)
+                for i, (_, fut, _) in enumerate(batch):
+                    fut.set_result(vecs[i])
+            except Exception as e:
+                self._stats["errors"] += 1
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            t1 = time.monotonic()
+
+            st = self._stats
+            st["batches"] += 1
+            st["items"] += len(batch)
+            st["encode_s"] += t1 - t0
+            st["max_batch_seen"] = max(st["max_batch_seen"], len(batch))
+            for _, _, t_enq in batch:
+                waited = t0 - t_enq
+                st["queue_s"] += waited
+                st["queue_max_s"] = max(st["queue_max_s"], waited)
+
+    def stats(self) -> Dict[str, Any]:
+        st = dict(self._stats)
+        items, batches = st["items"], st["batches"]
+        elapsed = max(1e-9, time.monotonic() - self._started)
+        return {
+            "batches": batches,
+            "items": items,
+            "errors": st["errors"],
+            "avg_batch": round(items / batches, 2) if batches else 0.0,
+            "max_batch_seen": st["max_batch_seen"],
+            "encode_items_per_s": round(items / st["encode_s"], 1) if st["encode_s"] else 0.0,
+            "items_per_s": round(items / elapsed, 2),
+            "queue_ms_avg": round(1000 * st["queue_s"] / items, 3) if items else 0.0,
+            "queue_ms_max": round(1000 * st["queue_max_s"], 3),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
@@ -0,0 +1,169 @@
+"""
+Retrieval benchmark: replays Q/A pairs (JSONL lines {"q", "a"[, "url"]}) through
+each retriever mode and reports recall@k and MRR next to latency percentiles
+and memory, as JSON comparable across commits (`manage.py copilot_bench`).
+
+A hit is relevant when its URL equals the pair's "url", or — without one — when
+it contains at least `match` of the answer's tokens.
+"""
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from copilot import dense, retrieval
+from copilot.dense import search_dense
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _bm25(q: str, k: int) -> List[Dict]:
+    hits = retrieval._search_bm25(q, k)
+    if hits is None:
+        return []
+    return [{"url": retrieval._paras[int(i)].url, "text": retrieval._paras[int(i)].text} for i in hits[0]]
+
+
+def _dense(q: str, k: int) -> List[Dict]:
+    return [payload for payload, _ in search_dense(q, k=k)]
+
+
+def _hybrid(q: str, k: int) -> List[Dict]:
+    return retrieval.hybrid_search(q, k=k)
+
+
+RUNNERS: Dict[str, Callable[[str, int], List[Dict]]] = {"bm25": _bm25, "dense": _dense, "hybrid": _hybrid}
+MODES = tuple(RUNNERS)
+
+
+def load_pairs(paths: Iterable[Path]) -> List[Dict]:
+    pairs = []
+    for path in paths:
+        with Path(path).open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    if row.get("q") and (row.get("a") or row.get("url")):
+                        pairs.append(row)
+    return pairs
+
+
+def is_relevant(hit: Dict, pair: Dict, match: float = 0.6) -> bool:
+    if pair.get("url"):
+        return (hit.get("url") or "").rstrip("/") == pair["url"].rstrip("/")
+    want = set(retrieval._tok(pair.get("a") or ""))
+    if not want:
+        return False
+    return len(want & set(retrieval._tok(hit.get("text") or ""))) / len(want) >= match
+
+
+def _ms(values: Sequence[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if len(values) else 0.0
+
+
+def bench_mode(run: Callable[[str, int], List[Dict]], pairs: List[Dict], k: int = 5,
+               repeat: int = 1, match: float = 0.6) -> Dict:
+    """Quality and latency of one retriever over `pairs` (first query untimed: model/index load)."""
+    try:
+        run(pairs[0]["q"], k)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+    latencies, ranks = [], []
+    for pair in pairs:
+        hits: List[Dict] = []
+        for _ in range(max(1, repeat)):
+            t0 = time.perf_counter()
+            hits = run(pair["q"], k)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+        ranks.append(next((r for r, hit in enumerate(hits[:k], 1) if is_relevant(hit, pair, match)), 0))
+
+    # separate pass: tracing slows every allocation down, so it stays out of the latency numbers
+    tracemalloc.start()
+    try:
+        for pair in pairs:
+            run(pair["q"], k)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    r = np.asarray(ranks, dtype=np.float64)
+    return {
+        "queries": len(pairs),
+        "recall_at_k": round(float((r > 0).mean()), 4),
+        "mrr": round(float(np.where(r > 0, 1.0 / np.maximum(r, 1), 0.0).mean()), 4),
+        "p50_ms": _ms(latencies, 50),
+        "p95_ms": _ms(latencies, 95),
+        "p99_ms": _ms(latencies, 99),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "peak_alloc_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+@contextmanager
+def _cold() -> Iterator[None]:
+    """
+    No query-vector LRU, disk query cache or semantic cache while inside, so
+    every timed query pays for the encoder and the retrievers (all restored on exit).
+    """
+    saved = {name: getattr(dense, name) for name in ("QCACHE_SIZE", "QCACHE_DISK", "_qcache", "_qcache_disk")}
+    semcache = retrieval._semcache
+    dense.QCACHE_SIZE, dense.QCACHE_DISK, dense._qcache, dense._qcache_disk = 0, False, OrderedDict(), None
+    retrieval._semcache = None
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(dense, name, value)
+        retrieval._semcache = semcache
+
+
+def _commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run(pairs: List[Dict], modes: Sequence[str] = MODES, k: int = 5, repeat: int = 1,
+        match: float = 0.6, warm: bool = False) -> Dict:
+    """
+    Benchmark every mode in `modes`. The query-vector caches and the semantic
+    cache are off unless `warm` is set, so repeats and paraphrases measure the
+    full pipeline rather than cache lookups.
+    """
+    if not pairs:
+        raise ValueError("no Q/A pairs to replay")
+    retrieval._build_index()
+    with _cold() if not warm else nullcontext():
+        results = {mode: bench_mode(RUNNERS[mode], pairs, k=k, repeat=repeat, match=match) for mode in modes}
+
+    report = {
+        "commit": _commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "k": k,
+        "repeat": repeat,
+        "match": match,
+        "caches": "warm" if warm else "cold",
+        "queries": len(pairs),
+        "modes": results,
+    }
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux, bytes on macOS
+        report["peak_rss_mb"] = round(rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+    return report
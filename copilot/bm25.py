@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+class SparseBM25:
+    """
+    BM25Okapi (rank_bm25 scoring: ATIRE idf with an epsilon floor) over a
+    SciPy CSR term × document matrix whose cells already hold
+    idf · tf·(k1+1) / (tf + k1·(1 − b + b·len/avgdl)).
+
+    A query only reads the posting rows of its own terms, so scoring costs
+    O(postings of the query terms) instead of O(terms × documents) in Python.
+
+    add()/remove() apply deltas without a rebuild: added documents go into a
+    small second matrix weighted with the *frozen* idf/avgdl of the base
+    corpus (unseen terms get the idf of a df=1 term), removed ones are masked.
+    Rebuilding from scratch restores exact statistics.
+    """
+
+    def __init__(self, corpus: Iterable[Sequence[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 positions: bool = False):
+        """
+        `corpus` is read once, so a generator streams documents in without
+        keeping their token lists. With `positions`, the term id of every token
+        is kept as a forward index: token_terms[token_ptr[d]:token_ptr[d + 1]]
+        are the terms of document d, in order.
+        """
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.vocab: Dict[str, int] = {}
+        terms = array("q")  # term id of every token, documents back to back
+        lens = array("q")
+        setdefault = self.vocab.setdefault
+        for tokens in corpus:
+            terms.extend([setdefault(t, len(self.vocab)) for t in tokens])
+            lens.append(len(tokens))
+        self.corpus_size = len(lens)
+        doc_len = np.frombuffer(lens, dtype=np.int64) if lens else np.empty(0, dtype=np.int64)
+        self.doc_len = doc_len.astype(np.float64)
+        self.avgdl = float(self.doc_len.sum() / self.corpus_size) if self.corpus_size else 0.0
+
+        term_ids = np.frombuffer(terms, dtype=np.int64) if terms else np.empty(0, dtype=np.int64)
+        docs = np.repeat(np.arange(self.corpus_size, dtype=np.int64), doc_len)
+        tf = sparse.csr_matrix((np.ones(len(term_ids), dtype=np.float64), (term_ids, docs)),
+                               shape=(len(self.vocab), self.corpus_size))
+        self.token_terms = term_ids.astype(np.int32) if positions else None
+        self.token_ptr = np.concatenate([[0], np.cumsum(doc_len)]).astype(np.int64) if positions else None
+        del terms, term_ids, docs
+        tf.sum_duplicates()
+        tf.sort_indices()
+
+        df = np.diff(tf.indptr).astype(np.float64)
+        idf = np.log(self.corpus_size - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * float(idf.mean())
+        self.idf_vec = idf
+
+        norm = k1 * (1 - b + b * self.doc_len / self.avgdl) if self.avgdl else np.ones(self.corpus_size)
+        row_of = np.repeat(np.arange(len(self.vocab)), np.diff(tf.indptr))
+        tf.data = idf[row_of] * (tf.data * (k1 + 1) / (tf.data + norm[tf.indices]))
+        self.matrix = tf  # term-major: row t = posting list of term t
+        self._init_deltas()
+
+    @classmethod
+    def from_arrays(cls, vocab, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                    doc_len: np.ndarray, idf: np.ndarray, avgdl: float,
+                    k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                    token_terms: Optional[np.ndarray] = None) -> "SparseBM25":
+        """Wrap prebuilt (e.g. mem-mapped) CSR arrays without copying them; `vocab` maps term → row."""
+        self = cls.__new__(cls)
+        self.token_terms = token_terms
+        self.token_ptr = np.concatenate([[0], np.cumsum(doc_len, dtype=np.int64)]) if token_terms is not None else None
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.vocab = vocab
+        self.corpus_size = len(doc_len)
+        self.doc_len = doc_len
+        self.avgdl = float(avgdl)
+        self.idf_vec = idf
+        self.matrix = sparse.csr_matrix((weights, indices, indptr), shape=(len(indptr) - 1, len(doc_len)), copy=False)
+        self._init_deltas()
+        return self
+
+    def _init_deltas(self) -> None:
+        self.base_terms = int(self.matrix.shape[0])
+        self.n_docs = self.corpus_size
+        self.alive = np.ones(self.corpus_size, dtype=bool)
+        self._new_idf = float(np.log(max(self.corpus_size - 1, 0) + 0.5) - np.log(1.5))
+        self._delta_tf: List[Counter] = []
+        self.delta = sparse.csr_matrix((self.base_terms, self.corpus_size), dtype=np.float64)
+
+    @property
+    def n_delta(self) -> int:
+        return len(self._delta_tf)
+
+    def add(self, docs: Sequence[Sequence[str]]) -> np.ndarray:
+        """
+        Append documents; returns their doc ids. Readers may run concurrently:
+        `alive` grows before the matrix that can return the new ids is swapped in.
+        """
+        first = self.n_docs
+        delta_tf = self._delta_tf + [Counter(tokens) for tokens in docs]
+        for tokens in docs:
+            for t in tokens:
+                self.vocab.setdefault(t, len(self.vocab))
+        n_docs = first + len(docs)
+
+        rows, cols, vals = [], [], []
+        for j, tf in enumerate(delta_tf):
+            dl = sum(tf.values())
+            norm = self.k1 * (1 - self.b + self.b * dl / self.avgdl) if self.avgdl else 1.0
+            for t, f in tf.items():
+                r = self.vocab.get(t)
+                idf = self.idf_vec[r] if r < self.base_terms else self._new_idf
+                rows.append(r)
+                cols.append(self.corpus_size + j)
+                vals.append(idf * (f * (self.k1 + 1) / (f + norm)))
+        delta = sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.vocab), n_docs))
+        delta.sort_indices()
+
+        self.alive = np.concatenate([self.alive, np.ones(len(docs), dtype=bool)])
+        self.delta, self._delta_tf, self.n_docs = delta, delta_tf, n_docs
+        return np.arange(first, n_docs)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        """Drop documents from all future results (ids stay allocated)."""
+        self.alive[np.asarray(ids, dtype=np.int64)] = False
+
+    def _postings(self, query: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc ids, weights) of every posting of the query terms (repeated terms count repeatedly)."""
+        ids, weights = [], []
+        for t, c in Counter(query).items():
+            row = self.vocab.get(t)
+            if row is None:
+                continue
+            for m in (self.matrix, self.delta):
+                if row < m.shape[0]:
+                    s, e = m.indptr[row], m.indptr[row + 1]
+                    ids.append(m.indices[s:e])
+                    weights.append(m.data[s:e] * c)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return np.concatenate(ids), np.concatenate(weights)
+
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """Scores for every document, same as BM25Okapi.get_scores."""
+        ids, weights = self._postings(query)
+        alive = self.alive
+        scores = np.bincount(ids, weights=weights, minlength=len(alive))
+        scores[~alive] = 0.0
+        return scores
+
+    def _top(self, docs: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.alive.all():
+            keep = self.alive[docs]
+            docs, scores = docs[keep], scores[keep]
+        if len(docs) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[part], scores[part]
+        order = np.lexsort((docs, -scores))  # ties → lower doc id first
+        return docs[order], scores[order]
+
+    def top_k(self, query: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k (doc ids, scores) among documents containing a query term, best first."""
+        ids, weights = self._postings(query)
+        if not len(ids) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        docs, inv = np.unique(ids, return_inverse=True)
+        return self._top(docs, np.bincount(inv, weights=weights), k)
+
+    def top_k_many(self, queries: Sequence[Sequence[str]], k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """top_k for a batch: one sparse (query × term) @ (term × doc) product, rows stay sparse."""
+        delta = self.delta  # one consistent (terms, docs) view even if add() runs meanwhile
+        n_terms = delta.shape[0]
+        rows, cols, vals = [], [], []
+        for i, query in enumerate(queries):
+            for t, c in Counter(query).items():
+                j = self.vocab.get(t)
+                if j is not None and j < n_terms:
+                    rows.append(i)
+                    cols.append(j)
+                    vals.append(float(c))
+        q = sparse.csr_matrix((vals, (rows, cols)), shape=(len(queries), n_terms))
+        res = q[:, :self.base_terms] @ self.matrix
+        if delta.shape[1] > self.corpus_size:
+            pad = sparse.csr_matrix((len(queries), delta.shape[1] - self.corpus_size))
+            res = sparse.hstack([res, pad]) + q @ delta
+        res = res.tocsr()
+        out = []
+        for i in range(len(queries)):
+            s, e = res.indptr[i], res.indptr[i + 1]
+            if e == s or k <= 0:
+                out.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)))
+            else:
+                out.append(self._top(res.indices[s:e].astype(np.int64), res.data[s:e], k))
+        return out
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import List
+
+TARGET = 600  # characters per chunk
+OVERLAP = 0
+MIN_LEN = 40
+
+_tag = re.compile(r"<[^>]+>")
+_breaks = re.compile(r"(?:</p>|<br\s*/?>|\n)+", re.I)
+_sentence_end = re.compile(r"[.!?…](?=\s)")
+
+
+def _units(html_or_text: str, max_len: int) -> List[str]:
+    """Lines / HTML paragraphs, tags stripped, whitespace collapsed; longer ones cut at sentence ends (or spaces)."""
+    out: List[str] = []
+    for part in _breaks.split(html_or_text):
+        txt = " ".join(_tag.sub(" ", part).split())
+        while len(txt) > max_len:
+            ends = [m.end() for m in _sentence_end.finditer(txt, 0, max_len)]
+            cut = ends[-1] if ends else txt.rfind(" ", 0, max_len)
+            if cut <= 0:
+                cut = max_len
+            out.append(txt[:cut].strip())
+            txt = txt[cut:].strip()
+        if txt:
+            out.append(txt)
+    return out
+
+
+def _tail(text: str, size: int) -> str:
+    """Last whole words of `text` within `size` characters."""
+    if len(text) <= size:
+        return text
+    cut = text.find(" ", len(text) - size)
+    return text[cut + 1:] if cut >= 0 else ""
+
+
+def chunk_text(html_or_text: str, target: int = TARGET, overlap: int = OVERLAP, min_len: int = MIN_LEN) -> List[str]:
+    """
+    Pack the lines/paragraphs of a document into chunks of about `target`
+    characters (never splitting a sentence that fits), each starting with
+    up to `overlap` characters of the previous chunk's end. Chunks shorter
+    than `min_len` are dropped unless they are all the document has.
+    """
+    if not html_or_text:
+        return []
+    target = max(target, 1)
+    overlap = max(0, min(overlap, target // 2))
+    chunks: List[str] = []
+    cur = ""
+    for unit in _units(html_or_text, target - overlap):  # so a carried tail always fits next to a unit
+        if cur and len(cur) + 1 + len(unit) > target:
+            chunks.append(cur)
+            carry = _tail(cur, overlap - 1) if overlap > 1 else ""
+            cur = f"{carry} {unit}" if carry else unit
+        else:
+            cur = f"{cur} {unit}" if cur else unit
+    if cur:
+        chunks.append(cur)
+    kept = [c for c in chunks if len(c) >= min_len]
+    return kept or chunks[:1]
+
+
+def content_hash(title: str, url: str, text: str, target: int, overlap: int, min_len: int) -> str:
+    """Changes whenever a re-chunk would produce different Paragraph rows."""
+    h = hashlib.sha1(f"{target}:{overlap}:{min_len}\0{title}\0{url}\0".encode("utf-8"))
+    h.update((text or "").encode("utf-8"))
+    return h.hexdigest()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.json as pa_json
+except Exception:
+    pa = None
+
+ARROW_NAME = "corpus.arrow"
+
+
+class ArrowCorpus(Sequence):
+    """
+    corpus.arrow (uncompressed Feather v2 / Arrow IPC) mem-mapped read-only.
+    Opening it only reads the schema and batch offsets; a row's strings are
+    turned into Python objects only when that row is asked for.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._source = pa.memory_map(str(self.path), "r")
+        self.table = pa.ipc.open_file(self._source).read_all()  # zero-copy views into the map
+
+    def __len__(self) -> int:
+        return int(self.table.num_rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.rows(range(*i.indices(len(self))))
+        return self.rows([i])[0]
+
+    def rows(self, ids: Iterable[int]) -> List[Dict]:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        out = self.table.take(pa.array(ids, type=pa.int64())).to_pylist()
+        return [{k: v for k, v in row.items() if v is not None} for row in out]
+
+    def column(self, name: str):
+        """A whole column as a pyarrow ChunkedArray (None if the corpus has no such field)."""
+        return self.table.column(name) if name in self.table.column_names else None
+
+
+def meta_columns(corpus: Sequence, names: Sequence[str]) -> Dict[str, List]:
+    """
+    Fields `names` of every row as lists, without materializing the others
+    (text): straight from corpus.arrow's columns, from the raw JSONL bytes of a
+    shared corpus (PackedCorpus) with pyarrow's JSON reader, else one pass over the rows.
+    """
+    if hasattr(corpus, "column"):
+        cols = {n: corpus.column(n) for n in names}
+        return {n: c.to_pylist() if c is not None else [None] * len(corpus) for n, c in cols.items()}
+    blob = getattr(corpus, "blob", None)
+    if pa is not None and blob is not None and len(corpus):
+        schema = pa.schema([(n, pa.string()) for n in names])
+        opts = pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+        try:
+            table = pa_json.read_json(pa.BufferReader(pa.py_buffer(blob)), parse_options=opts)
+        except pa.ArrowInvalid:
+            table = None  # e.g. numeric pids: not strings, parse the rows instead
+        if table is not None and table.num_rows == len(corpus):
+            return {n: table.column(n).to_pylist() for n in names}
+    out: Dict[str, List] = {n: [] for n in names}
+    for i in range(len(corpus)):
+        row = corpus[i]
+        for n in names:
+            out[n].append(row.get(n))
+    return out
+
+
+def rows_of(corpus: Sequence, ids: Iterable[int]) -> List[Dict]:
+    """Payload dicts for `ids`, in order, from any corpus sequence."""
+    if hasattr(corpus, "rows"):
+        return corpus.rows(ids)
+    return [corpus[int(i)] for i in ids]
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def open_corpus(path: Path) -> ArrowCorpus | None:
+    p = Path(path) / ARROW_NAME
+    if pa is None or not p.exists():
+        return None
+    return ArrowCorpus(p)
+
+
+def write_arrow(dest: Path, table) -> Path:
+    """Write `table` as uncompressed Feather (so readers can mem-map it) via tmp + replace."""
+    tmp = dest.with_name(dest.name + ".tmp")
+    feather.write_feather(table, str(tmp), compression="uncompressed")
+    os.replace(tmp, dest)
+    return dest
+
+
+def jsonl_to_arrow(src: Path, dest: Path) -> int:
+    """Convert corpus.jsonl to corpus.arrow with pyarrow's streaming JSON reader; returns rows."""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+    table = pa_json.read_json(str(src))
+    write_arrow(dest, table)
+    return int(table.num_rows)
+
+
+def read_texts(path: Path) -> List[str]:
+    """The `text` field of every row of an index dir's corpus, in row order."""
+    arrow = open_corpus(path)
+    if arrow is not None:
+        col = arrow.column("text")
+        return [t or "" for t in col.to_pylist()] if col is not None else [""] * len(arrow)
+    with (Path(path) / "corpus.jsonl").open("r", encoding="utf-8") as f:
+        return [json.loads(line).get("text") or "" for line in f if line.strip()]
+
+
+def count_rows(path: Path) -> int | None:
+    """Rows in the corpus of an index dir (arrow preferred, jsonl otherwise); None if neither exists."""
+    arrow = Path(path) / ARROW_NAME
+    if pa is not None and arrow.exists():
+        with pa.memory_map(str(arrow), "r") as src:
+            reader = pa.ipc.open_file(src)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    jsonl = Path(path) / "corpus.jsonl"
+    if jsonl.exists():
+        with jsonl.open("rb") as f:
+            return sum(1 for line in f if line.strip())
+    return None
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import zlib
+from functools import lru_cache
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+SHINGLE = 3  # words per shingle
+NUM_PERM = 64  # MinHash functions
+BANDS = 8  # LSH bands of NUM_PERM // BANDS rows: ~99% of pairs at 0.9 Jaccard become candidates, ~77% at 0.8
+
+_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+
+class NearDuplicates:
+    """
+    Streaming near-duplicate filter: MinHash signatures of word shingles,
+    banded LSH to find candidates, and the signature agreement (an estimate
+    of the Jaccard similarity) to confirm them. Hashes are seeded constants
+    and crc32, so every process makes the same decisions for the same rows.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = NUM_PERM, bands: int = BANDS, shingle: int = SHINGLE):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = float(threshold)
+        self.bands, self.rows = bands, num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(0x5EED)
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        # band → one uint64 (a band is `rows` uint32 values); a rare collision only adds a candidate to verify
+        self._band_mix = rng.integers(1, 2 ** 63, size=(bands, self.rows), dtype=np.uint64) | np.uint64(1)
+        self._word = lru_cache(maxsize=None)(lambda t: zlib.crc32(t.encode("utf-8")))
+        self._buckets: Dict[int, List[Hashable]] = {}
+        self._sigs: Dict[Hashable, np.ndarray] = {}
+
+    def signature(self, tokens: Sequence[str]) -> np.ndarray:
+        """MinHash signature (num_perm uint32 values) of the word shingles of `tokens`."""
+        h = np.fromiter(map(self._word, tokens), dtype=np.uint64, count=len(tokens))
+        n = max(1, len(h) - self.shingle + 1)
+        x = np.zeros(n, dtype=np.uint64)
+        for j in range(min(self.shingle, len(h))):  # order-sensitive mix of each window's word hashes
+            x = x * _MIX[j] + h[j:j + n]
+        return ((self.a[:, None] * x[None, :] + self.b[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def check(self, key: Hashable, tokens: Sequence[str]) -> Optional[Hashable]:
+        """
+        The key of an earlier row `tokens` is a near-duplicate of (similarity
+        >= threshold), or None — then this row is remembered under `key`.
+        A row without tokens has no shingles to compare: it is kept, not remembered.
+        """
+        if not tokens:
+            return None
+        sig = self.signature(tokens)
+        bands = (sig.reshape(self.bands, self.rows).astype(np.uint64) * self._band_mix).sum(axis=1)
+        bands = (bands + np.arange(self.bands, dtype=np.uint64)).tolist()  # same values in two bands stay apart
+        seen = set()
+        for band in bands:
+            for other in self._buckets.get(band, ()):
+                if other not in seen:
+                    seen.add(other)
+                    if float(np.mean(self._sigs[other] == sig)) >= self.threshold:
+                        return other
+        self._sigs[key] = sig
+        for band in bands:
+            self._buckets.setdefault(band, []).append(key)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._sigs)
@@ -1,13 +1,28 @@
 from __future__ import annotations
 
 import json
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
-from types import NoneType
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Sequence, Tuple
 
 import numpy as np
 
+from copilot import reduce, shm, snapshot
+from copilot.batcher import MicroBatcher
+from copilot.corpus import meta_columns, open_corpus, rows_of
+from copilot.filters import RowFilters, Values
+from copilot.ivf import IVFIndex
+from copilot.qcache import DiskQueryCache
+from copilot.quant import VectorStore, load_store, vec_file
+from copilot.reduce import Projection
+
+log = logging.getLogger("app")
+
 # Make tiny boxes happy
 os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 os.environ.setdefault("OMP_NUM_THREADS", "1")
@@ -26,69 +41,508 @@ if os.getenv("COPILOT_DISABLE_FAISS", "0") == "1":
 BASE = Path(os.environ.get("COPILOT_INDEX_DIR", "copilot_index"))
 MODEL_PATH = os.environ.get("COPILOT_EMBED_MODEL", "models/copilot-embed")
 USE_MEMMAP = os.getenv("COPILOT_MEMMAP", "1") != "0"
+# float32 | float16 | int8 (quantized files built by `manage.py copilot_quantize`)
+VEC_DTYPE = (os.getenv("COPILOT_VEC_DTYPE", "float32") or "float32").lower()
+# Query-vector cache: in-process LRU (0 disables) + optional mem-mapped tier shared by workers
+QCACHE_SIZE = int(os.getenv("COPILOT_QCACHE_SIZE", "1024") or 0)
+QCACHE_DISK = os.getenv("COPILOT_QCACHE_DISK", "0") == "1"
+QCACHE_DISK_SLOTS = int(os.getenv("COPILOT_QCACHE_DISK_SLOTS", "8192") or 8192)
+# Micro-batch concurrent encoder calls (useful with threaded workers)
+MICROBATCH = os.getenv("COPILOT_MICROBATCH", "0") == "1"
+BATCH_SIZE = int(os.getenv("COPILOT_BATCH_SIZE", "32") or 32)
+BATCH_WAIT_MS = float(os.getenv("COPILOT_BATCH_WAIT_MS", "3") or 0)
+
+# Pure-numpy IVF index (`manage.py copilot_ivf`), used when FAISS is unavailable
+USE_IVF = os.getenv("COPILOT_DISABLE_IVF", "0") != "1"
+IVF_NPROBE = int(os.getenv("COPILOT_IVF_NPROBE", "8") or 8)
+
+# Reduced-dim vectors (`manage.py copilot_reduce`): score at low dim, then rescore
+# RESCORE*k candidates at full dim (0 = low-dim scores only)
+USE_REDUCED = os.getenv("COPILOT_REDUCED", "1") != "0"
+RESCORE = int(os.getenv("COPILOT_RESCORE", "4") or 0)
+
+# Versioned snapshots: how often queries look at CURRENT, and whether to also sha256 every file on load
+# (sizes and row counts are always checked; `manage.py copilot_snapshot --verify` re-hashes offline)
+SNAPSHOT_POLL = float(os.getenv("COPILOT_SNAPSHOT_POLL", "5") or 0)
+VERIFY_CHECKSUMS = os.getenv("COPILOT_VERIFY_CHECKSUMS", "0") == "1"
+# One copy of vectors + corpus payload per host (multiprocessing.shared_memory), not per worker
+SHARED = os.getenv("COPILOT_SHARED", "0") == "1"
+# search_dense_many: queries scored per (block × rows) matrix product
+QUERY_BLOCK = int(os.getenv("COPILOT_QUERY_BLOCK", "256") or 256)
+
+
+@dataclass
+class _Snapshot:
+    """Everything one index version needs; swapped as a single object."""
+    version: str
+    path: Path
+    corpus: Sequence[Dict]
+    index: Any = None  # FAISS index
+    vecs: Optional[VectorStore] = None
+    ivf: Optional[IVFIndex] = None
+    proj: Optional[Projection] = None  # set when `vecs` are reduced-dim
+    full: Optional[VectorStore] = None  # full-dim vectors for the rescore stage
+    filters: Optional[RowFilters] = None  # kind / lang / URL-prefix → row ids
+    pids: Optional[np.ndarray] = None  # Paragraph id of each row (-1: no numeric pid)
+    shm_keys: tuple = ()
+
+
+@dataclass
+class DenseHits:
+    """One query's hits as arrays, best first; payload dicts only on request."""
+    rows: np.ndarray  # corpus rows
+    scores: np.ndarray
+    pids: np.ndarray  # Paragraph id of each hit (-1: the corpus row has none)
+    corpus: Sequence[Dict]  # of the snapshot that answered, so a swap can't shift the rows
+
+    def payloads(self, which: Optional[Sequence[int]] = None) -> List[Dict]:
+        return rows_of(self.corpus, self.rows if which is None else self.rows[np.asarray(which, dtype=np.int64)])
+
+    def pairs(self) -> List[Tuple[Dict, float]]:
+        return list(zip(self.payloads(), (float(s) for s in self.scores)))
+
 
 # Lazy singletons
 _model = None  # SentenceTransformer
-_index = None  # FAISS index
-_corpus: Optional[List[Dict]] = None
-_vecs: Optional[np.ndarray] = None
+_snap: Optional[_Snapshot] = None
+_snap_lock = threading.Lock()
+_snap_checked_at = 0.0
+_snap_reloading = False
 
+_qcache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_qcache_lock = threading.Lock()
+_qcache_disk: Optional[DiskQueryCache] = None
+_qstats = {"hits": 0, "disk_hits": 0, "misses": 0}
+_batcher: Optional[MicroBatcher] = None
 
-def _load() -> None:
-    """Lazy-load model, corpus, and either FAISS index or mem-mapped numpy."""
-    global _model, _index, _corpus, _vecs
 
+def _load_model():
+    global _model
     if _model is None:
         from sentence_transformers import SentenceTransformer
         _model = SentenceTransformer(MODEL_PATH)
+    return _model
+
+
+def _pid_array(values: Sequence) -> np.ndarray:
+    """The corpus "pid" field as int64 (copilot_build writes Paragraph pks), -1 where missing or not numeric."""
+    out = np.full(len(values), -1, dtype=np.int64)
+    for i, v in enumerate(values):
+        if isinstance(v, int) or (isinstance(v, str) and v.isdigit()):
+            out[i] = int(v)
+    return out
 
-    if _corpus is None:
-        corpus_path = BASE / "corpus.jsonl"
+
+def _open_snapshot(path: Path, version: str) -> _Snapshot:
+    """Load and cross-check one index version without touching the live one."""
+    manifest = snapshot.read_manifest(path)
+    if manifest is not None:
+        snapshot.validate(path, manifest, checksums=VERIFY_CHECKSUMS)
+
+    corpus_path = path / "corpus.jsonl"
+    keys: list[str] = []
+    # corpus.arrow is mem-mapped (already shared through the page cache); rows materialize per hit
+    corpus = open_corpus(path)
+    if corpus is None:
         if not corpus_path.exists():
             raise FileNotFoundError(f"Corpus not found at {corpus_path}. Build your index.")
-        with corpus_path.open("r", encoding="utf-8") as f:
-            _corpus = [json.loads(line) for line in f if line.strip()]
+        if SHARED and corpus_path.stat().st_size:
+            corpus = _shared_corpus(corpus_path, version, keys)
+        else:
+            with corpus_path.open("r", encoding="utf-8") as f:
+                corpus = [json.loads(line) for line in f if line.strip()]
+
+    snap = _Snapshot(version=version, path=path, corpus=corpus)
+    if faiss and (path / "faiss.index").exists():
+        snap.index = _read_faiss(path / "faiss.index")
+        rows = int(snap.index.ntotal)
+    else:
+        snap.vecs = load_store(path, mode=VEC_DTYPE, mmap=USE_MEMMAP or SHARED)
+        if snap.vecs is None:
+            raise FileNotFoundError(f"Embeddings not found at {path / 'embeddings.npy'}. Build your index.")
+        if SHARED:
+            snap.vecs = _shared_store(snap.vecs, vec_file(path, snap.vecs.mode), version, keys)
+        if USE_REDUCED:
+            _attach_reduced(snap, path, version, keys)
+        if USE_IVF:
+            snap.ivf = IVFIndex.load(path, mmap=USE_MEMMAP)
+        rows = len(snap.vecs)
+
+    if rows != len(corpus):
+        raise snapshot.SnapshotError(f"{path}: corpus has {len(corpus)} rows but the vectors have {rows}")
+    if manifest and manifest.get("rows") not in (None, len(corpus)):
+        raise snapshot.SnapshotError(f"{path}: manifest says {manifest['rows']} rows, corpus has {len(corpus)}")
+    meta = meta_columns(corpus, ("kind", "lang", "url", "pid"))  # one pass over the rows' metadata, not their text
+    snap.filters = RowFilters(meta["kind"], meta["lang"], meta["url"])
+    snap.pids = _pid_array(meta["pid"])
+    snap.shm_keys = tuple(keys)
+    return snap
+
+
+def _shm_key(path: Path, version: str, name: str) -> str:
+    st = path.stat()
+    return f"{path.resolve()}|{version}|{name}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def _shared_corpus(corpus_path: Path, version: str, keys: list) -> Sequence[Dict]:
+    """corpus.jsonl bytes + line offsets in shared memory; rows are parsed per hit."""
+    blob = np.memmap(corpus_path, dtype=np.uint8, mode="r")
+    spans = shm.line_offsets(blob)
+    key = _shm_key(corpus_path, version, "corpus")
+    shared = shm.share(key, {"blob": blob, "spans": spans})
+    if shared is None:
+        return shm.PackedCorpus(blob, spans)  # still a read-only mmap shared via the page cache
+    keys.append(key)
+    return shm.PackedCorpus(shared["blob"], shared["spans"])
+
+
+def _attach_reduced(snap: _Snapshot, path: Path, version: str, keys: list) -> None:
+    """Score against embeddings.reduced.npy when the snapshot has one; keep full dims for rescoring."""
+    proj, red = Projection.load(path), reduce.load_reduced(path, mmap=USE_MEMMAP or SHARED)
+    if proj is None or red is None:
+        return
+    if len(red) != len(snap.vecs) or red.dim != proj.dim:
+        raise snapshot.SnapshotError(f"{path}: reduced vectors don't match the projection / corpus")
+    if SHARED:
+        red = _shared_store(red, path / reduce.REDUCED_NAME, version, keys)
+    snap.full = snap.vecs if RESCORE > 0 else None
+    snap.vecs, snap.proj = red, proj
+
+
+def _shared_store(store: VectorStore, src: Path, version: str, keys: list) -> VectorStore:
+    key = _shm_key(src, version, f"vecs-{store.mode}-{store.dim}")
+    shared = shm.share(key, {"vecs": store.vecs, "scale": store.scale, "norms": store.norms})
+    if shared is None:
+        return store
+    keys.append(key)
+    return VectorStore(shared["vecs"], mode=store.mode, scale=shared.get("scale"), norms=shared.get("norms"))
+
+
+def _read_faiss(path: Path):
+    if SHARED:
+        try:  # mem-mapped and read-only, so the pages are shared between workers
+            return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except Exception:
+            log.warning("copilot: %s can't be mem-mapped by this FAISS build; loading a private copy", path)
+    return faiss.read_index(str(path))
+
+
+def _swap_in() -> _Snapshot:
+    """Open whatever CURRENT points at and make it live in one assignment."""
+    global _snap
+    version = snapshot.current_version(BASE)
+    snap = _open_snapshot(snapshot.current_dir(BASE), version)
+    old, _snap = _snap, snap
+    if old is not None:
+        for key in set(old.shm_keys) - set(snap.shm_keys):
+            shm.release(key)
+    return snap
+
+
+def _reload_in_background() -> None:
+    global _snap_reloading
+    try:
+        with _snap_lock:
+            if _snap is None or snapshot.current_version(BASE) != _snap.version:
+                _swap_in()
+    except Exception:
+        log.exception("copilot: new index snapshot rejected, still serving %s", _snap and _snap.version)
+    finally:
+        _snap_reloading = False
+
+
+def _current() -> _Snapshot:
+    """
+    The live snapshot. The first call loads synchronously; afterwards a changed
+    CURRENT pointer is picked up by a background thread while queries keep
+    using the old version, so the swap never pauses a request.
+    """
+    global _snap_checked_at, _snap_reloading
+    snap = _snap
+    if snap is None:
+        with _snap_lock:
+            return _snap or _swap_in()
+
+    now = time.monotonic()
+    if SNAPSHOT_POLL > 0 and now - _snap_checked_at >= SNAPSHOT_POLL and not _snap_reloading:
+        _snap_checked_at = now
+        if snapshot.current_version(BASE) != snap.version:
+            _snap_reloading = True
+            threading.Thread(target=_reload_in_background, name="copilot-snapshot-reload", daemon=True).start()
+    return snap
+
+
+def _load() -> _Snapshot:
+    """Lazy-load model and the live index snapshot."""
+    _load_model()
+    return _current()
+
+
+def _norm_query(query: str) -> str:
+    # both the cache key and the encoder input: whitespace only, case is meaning to cased models
+    return " ".join((query or "").split())
+
+
+def _disk_cache() -> Optional[DiskQueryCache]:
+    global _qcache_disk
+    if QCACHE_DISK and _qcache_disk is None:
+        _qcache_disk = DiskQueryCache(BASE / "qcache.bin", slots=QCACHE_DISK_SLOTS, salt=MODEL_PATH)
+    return _qcache_disk
+
 
-    if faiss and _index is None and (BASE / "faiss.index").exists():
-        _index = faiss.read_index(str(BASE / "faiss.index"))
+def _remember(key: str, vec: np.ndarray) -> None:
+    if QCACHE_SIZE <= 0:
+        return
+    with _qcache_lock:
+        _qcache[key] = vec
+        _qcache.move_to_end(key)
+        while len(_qcache) > QCACHE_SIZE:
+            _qcache.popitem(last=False)
 
-    if _index is None and _vecs is None:
-        vec_path = BASE / "embeddings.npy"
-        if not vec_path.exists():
-            raise FileNotFoundError(f"Embeddings not found at {vec_path}. Build your index.")
-        _vecs = np.load(vec_path, mmap_mode="r" if USE_MEMMAP else None)
-        if _vecs.dtype != np.float32:
-            _vecs = _vecs.astype(np.float32, copy=False)
-        if _vecs.ndim != 2:
-            raise ValueError(f"embeddings.npy must be 2D, got {_vecs.shape}")
 
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    return _load_model().encode(texts, batch_size=max(1, min(len(texts), 256)),
+                                normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
 
-def search_dense(query: str, k: int = 6) -> list[tuple[type[NoneType[Any]], float]]:
+
+def _encoder() -> Optional[MicroBatcher]:
+    global _batcher
+    if MICROBATCH and _batcher is None:
+        _batcher = MicroBatcher(_encode_batch, max_batch=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS)
+    return _batcher
+
+
+def encode_query(query: str) -> np.ndarray:
+    """
+    Unit-normalized float32 vector (d,) for `query`.
+    Looks in the LRU, then the shared disk tier, and only then runs the encoder.
+    """
+    key = _norm_query(query)
+    with _qcache_lock:
+        vec = _qcache.get(key)
+        if vec is not None:
+            _qcache.move_to_end(key)
+            _qstats["hits"] += 1
+            return vec
+
+    disk = _disk_cache()
+    vec = disk.get(key) if disk is not None else None
+    if vec is not None:
+        _qstats["disk_hits"] += 1
+    else:
+        _qstats["misses"] += 1
+        batcher = _encoder()
+        vec = batcher.submit(key) if batcher is not None else _encode_batch([key])[0]
+        if disk is not None:
+            disk.put(key, vec)
+
+    vec.flags.writeable = False
+    _remember(key, vec)
+    return vec
+
+
+def encode_queries(queries: Sequence[str]) -> np.ndarray:
+    """
+    (m, d) float32 matrix for `queries`: cached vectors are reused and every
+    miss goes through the encoder in a single call (no micro-batcher hop).
+    """
+    keys = [_norm_query(q) for q in queries]
+    vecs: List[Optional[np.ndarray]] = [None] * len(keys)
+    with _qcache_lock:
+        for i, key in enumerate(keys):
+            vec = _qcache.get(key)
+            if vec is not None:
+                _qcache.move_to_end(key)
+                _qstats["hits"] += 1
+                vecs[i] = vec
+
+    disk = _disk_cache()
+    todo: Dict[str, List[int]] = {}  # key → rows
+    for i, key in enumerate(keys):
+        if vecs[i] is not None:
+            continue
+        vec = disk.get(key) if disk is not None and key not in todo else None
+        if vec is not None:
+            _qstats["disk_hits"] += 1
+            vec.flags.writeable = False
+            _remember(key, vec)
+            vecs[i] = vec
+        else:
+            todo.setdefault(key, []).append(i)
+
+    if todo:
+        _qstats["misses"] += len(todo)
+        for (key, idx), vec in zip(todo.items(), _encode_batch(list(todo))):
+            vec = np.array(vec, dtype=np.float32)
+            if disk is not None:
+                disk.put(key, vec)
+            vec.flags.writeable = False
+            _remember(key, vec)
+            for i in idx:
+                vecs[i] = vec
+    return np.stack(vecs) if vecs else np.empty((0, 0), dtype=np.float32)
+
+
+def query_cache_stats() -> Dict[str, Any]:
+    hits, disk_hits, misses = _qstats["hits"], _qstats["disk_hits"], _qstats["misses"]
+    total = hits + disk_hits + misses
+    return {
+        "size": len(_qcache),
+        "max_size": QCACHE_SIZE,
+        "hits": hits,
+        "disk_hits": disk_hits,
+        "misses": misses,
+        "hit_rate": round((hits + disk_hits) / total, 4) if total else 0.0,
+    }
+
+
+def encoder_stats() -> Dict[str, Any]:
+    """Micro-batcher throughput / queue-time metrics (empty when batching is off)."""
+    return _batcher.stats() if _batcher is not None else {}
+
+
+def _faiss_search(index, qv: np.ndarray, k: int, allowed: Optional[np.ndarray]):
+    if allowed is None:
+        return index.search(qv, k)
+    ids = np.ascontiguousarray(allowed, dtype=np.int64)
+    try:
+        sel = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        return index.search(qv, k, params=faiss.SearchParameters(sel=sel))
+    except Exception:  # FAISS < 1.7.3 has no search-time selectors: score the allowed rows directly
+        sims = qv @ index.reconstruct_batch(ids).T
+        top = _topk_rows(sims, k)
+        return np.take_along_axis(sims, top, axis=1), ids[top]
+
+
+def _topk_rows(sims: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k best scores in every row of a 2-D array, best first."""
+    top = np.argpartition(sims, -k, axis=1)[:, -k:]
+    order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _hits(snap: _Snapshot, rows, scores) -> DenseHits:
+    rows = np.asarray(rows, dtype=np.int64)
+    pids = snap.pids[rows] if snap.pids is not None else np.full(len(rows), -1, dtype=np.int64)
+    return DenseHits(rows, np.asarray(scores, dtype=np.float32), pids, snap.corpus)
+
+
+def search_dense_hits(query: str, k: int = 6, *, kind: Values = None, url_prefix: Values = None,
+                      lang: Values = None, qv: Optional[np.ndarray] = None) -> DenseHits:
+    """
+    search_dense as arrays (corpus rows, scores, Paragraph ids); no payload is built.
+    `qv` takes an encode_query(query) result computed by the caller.
+    """
+    snap = _load()
+    corpus = snap.corpus
+
+    qv = (encode_query(query) if qv is None else qv)[None, :]
+    allowed = snap.filters.rows(kind=kind, url_prefix=url_prefix, lang=lang) if snap.filters else None
+    n = len(corpus) if allowed is None else len(allowed)
+    if n == 0:
+        return _hits(snap, [], [])
+    k = int(max(1, min(k, n)))
+
+    if snap.index is not None:
+        scores, idx = _faiss_search(snap.index, qv, k, allowed)
+        found = idx[0] >= 0
+        return _hits(snap, idx[0][found], scores[0][found])
+
+    # numpy fallback (scores straight off the mem-mapped, possibly quantized, matrix)
+    assert snap.vecs is not None
+    rows = allowed
+    if snap.ivf is not None and IVF_NPROBE < snap.ivf.nlist:
+        probed = snap.ivf.probe(qv[0], IVF_NPROBE)
+        if allowed is None or len(allowed) > len(probed):
+            if allowed is not None:
+                probed = np.intersect1d(probed, allowed, assume_unique=True)
+            if len(probed) >= k:
+                rows = probed  # else too few candidates in the probed lists: scan every allowed row
+    q = qv[0] if snap.proj is None else snap.proj.apply(qv[0])
+    sims = snap.vecs.scores(q, rows=rows)  # (N,) or (len(rows),)
+    n_top = k if snap.full is None else int(min(len(sims), k * RESCORE))
+    topk = np.argpartition(sims, -n_top)[-n_top:]
+    topk = topk[np.argsort(sims[topk])][::-1]
+    ids = topk if rows is None else rows[topk]
+    scores = sims[topk]
+    if snap.full is not None:
+        ids, scores = reduce.rescore(snap.full, qv[0], ids, k)
+    return _hits(snap, ids, scores)
+
+
+def search_dense(query: str, k: int = 6, *, kind: Values = None, url_prefix: Values = None,
+                 lang: Values = None) -> List[Tuple[Dict, float]]:
     """
     Return top-K [(payload_dict, score)] for the query.
     payload_dict must contain: title, url, text (as created by your builder).
+
+    kind / url_prefix / lang (a value or a list of alternatives) restrict the
+    search to matching rows; the top-K is taken over those rows only.
+    """
+    return search_dense_hits(query, k, kind=kind, url_prefix=url_prefix, lang=lang).pairs()
+
+
+def search_dense_hits_many(queries: Sequence[str], k: int = 6, *, kind: Values = None, url_prefix: Values = None,
+                           lang: Values = None, qvs: Optional[np.ndarray] = None) -> List[DenseHits]:
+    """
+    search_dense_hits for a list of queries (offline eval, cache warming): one
+    encoder call, then one (queries × rows) score matrix per QUERY_BLOCK
+    queries with a row-wise argpartition. Every query scans all (allowed)
+    rows — IVF probing only pays off one query at a time.
+    `qvs` takes an encode_queries(queries) result computed by the caller.
     """
-    _load()
-    assert _model is not None and _corpus is not None
+    if not len(queries):
+        return []
+    snap = _load()
+    corpus = snap.corpus
+    allowed = snap.filters.rows(kind=kind, url_prefix=url_prefix, lang=lang) if snap.filters else None
+    n = len(corpus) if allowed is None else len(allowed)
+    if n == 0:
+        return [_hits(snap, [], []) for _ in queries]
+    k = int(max(1, min(k, n)))
 
-    qv = _model.encode([query], normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
-    k = int(max(1, min(k, len(_corpus))))
+    if qvs is None:
+        qvs = encode_queries(queries)
+    hits: List[DenseHits] = []
+    for s in range(0, len(qvs), QUERY_BLOCK):
+        block = qvs[s:s + QUERY_BLOCK]
+        if snap.index is not None:
+            scores, idx = _faiss_search(snap.index, block, k, allowed)
+            hits.extend(_hits(snap, ri[ri >= 0], rs[ri >= 0]) for ri, rs in zip(idx, scores))
+            continue
 
-    if _index is not None:
-        scores, idx = _index.search(qv, k)
-        return [(_corpus[i], float(s)) for i, s in zip(idx[0].tolist(), scores[0].tolist())]
+        assert snap.vecs is not None
+        sims = snap.vecs.scores(block if snap.proj is None else snap.proj.apply(block), rows=allowed)
+        top = _topk_rows(sims, k if snap.full is None else int(min(n, k * RESCORE)))
+        ids = top if allowed is None else allowed[top]
+        scores = np.take_along_axis(sims, top, axis=1)
+        for q, row_ids, row_scores in zip(block, ids, scores):
+            if snap.full is not None:
+                row_ids, row_scores = reduce.rescore(snap.full, q, row_ids, k)
+            hits.append(_hits(snap, row_ids, row_scores))
+    return hits
 
-    # numpy fallback
-    assert _vecs is not None
-    sims = np.dot(_vecs, qv[0])  # (N,)
-    topk = np.argpartition(sims, -k)[-k:]
-    topk = topk[np.argsort(sims[topk])][::-1]
-    return [(_corpus[i], float(sims[i])) for i in topk]
 
+def search_dense_many(queries: Sequence[str], k: int = 6, *, kind: Values = None, url_prefix: Values = None,
+                      lang: Values = None, qvs: Optional[np.ndarray] = None) -> List[List[Tuple[Dict, float]]]:
+    """search_dense for a list of queries, see search_dense_hits_many."""
+    hits = search_dense_hits_many(queries, k, kind=kind, url_prefix=url_prefix, lang=lang, qvs=qvs)
+    if not hits:
+        return []
+    uniq = np.unique(np.concatenate([h.rows for h in hits])).tolist()
+    payload = dict(zip(uniq, rows_of(hits[0].corpus, uniq)))  # each hit row materialized once
+    return [[(payload[i], float(x)) for i, x in zip(h.rows.tolist(), h.scores.tolist())] for h in hits]
 
-def reload_index() -> None:
-    """Hot-reload on next query (keeps model to save RAM)."""
-    global _index, _corpus, _vecs
-    _index = None
-    _corpus = None
-    _vecs = None
+
+def index_version() -> str:
+    """Version name of the live snapshot ("" for the legacy flat layout or before first load)."""
+    return _snap.version if _snap is not None else ""
+
+
+def reload_index() -> str:
+    """
+    Load the snapshot CURRENT points at and swap it in (keeps model to save RAM).
+    The old snapshot keeps serving until the new one is fully loaded and valid.
+    """
+    with _snap_lock:
+        return _swap_in().version
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+import unicodedata
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Vectors kept across builds (this build's texts always survive, then the most recent others)
+MAX_ITEMS = int(os.getenv("COPILOT_EMBED_CACHE_MAX", "200000") or 200000)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def text_key(text: str, model: str) -> bytes:
+    """16-byte content hash of (model, normalized text)."""
+    return hashlib.blake2b(f"{model}\0{normalize_text(text)}".encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent text-hash → vector store for index builds.
+
+    Lives outside the versioned snapshots (default COPILOT_INDEX_DIR/embed_cache/)
+    as keys.npy (|S16 hashes) + vecs.npy (float32 rows) and is rewritten
+    atomically after each build.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.keys = np.empty(0, dtype="S16")
+        self.vecs: Optional[np.ndarray] = None
+        kp, vp = self.path / "keys.npy", self.path / "vecs.npy"
+        if kp.exists() and vp.exists():
+            keys, vecs = np.load(kp), np.load(vp, mmap_mode="r")
+            if len(keys) == len(vecs):
+                self.keys, self.vecs = keys, vecs
+        self._row = {k: i for i, k in enumerate(self.keys.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, keys: Sequence[bytes]) -> np.ndarray:
+        """Row in the cache for each key, -1 when missing."""
+        return np.fromiter((self._row.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+
+    def save(self, keys: Sequence[bytes], vecs: np.ndarray, max_items: int = MAX_ITEMS) -> None:
+        """Persist `keys`/`vecs` (this build) first, then as many older entries as fit."""
+        keys = np.asarray(list(keys), dtype="S16")
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        keys, vecs = keys[first], np.asarray(vecs, dtype=np.float32)[first]
+        if self.vecs is not None and len(self.keys) and len(keys) < max_items and self.vecs.shape[1] == vecs.shape[1]:
+            # the file is newest first (each save leads with its build), so the head holds the most recent others
+            old = np.flatnonzero(~np.isin(self.keys, keys))[: max_items - len(keys)]
+            keys = np.concatenate([keys, self.keys[old]])
+            vecs = np.concatenate([vecs, np.asarray(self.vecs[old], dtype=np.float32)])
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name, arr in (("vecs.npy", vecs), ("keys.npy", keys)):
+            tmp = self.path / f".{name}.{os.getpid()}.tmp.npy"
+            np.save(tmp, arr)
+            os.replace(tmp, self.path / name)
+        (self.path / "meta.json").write_text(json.dumps({"items": int(len(keys)), "dim": int(vecs.shape[1]),
+                                                         "saved_at": time.time()}), encoding="utf-8")
+
+
+def embed_texts(texts: Sequence[str], encode_fn: Callable[[List[str]], np.ndarray], model: str,
+                cache: Optional[EmbeddingCache] = None, batch_size: int = 256) -> Tuple[np.ndarray, Dict]:
+    """
+    Unit-normalized float32 matrix for `texts`, encoding only texts whose
+    (model, normalized text) hash isn't cached yet. Duplicate texts are encoded once.
+    Returns (vecs, {"total", "reused", "computed", "encode_s"}).
+    """
+    keys = [text_key(t, model) for t in texts]
+    rows = cache.lookup(keys) if cache is not None else np.full(len(keys), -1, dtype=np.int64)
+
+    todo: Dict[bytes, int] = {}
+    for i in np.flatnonzero(rows < 0).tolist():
+        todo.setdefault(keys[i], i)
+    fresh: Dict[bytes, np.ndarray] = {}
+    t0 = time.perf_counter()
+    pending = list(todo.items())
+    for s in range(0, len(pending), batch_size):
+        chunk = pending[s:s + batch_size]
+        out = np.asarray(encode_fn([normalize_text(texts[i]) for _, i in chunk]), dtype=np.float32)
+        for (k, _), v in zip(chunk, out):
+            fresh[k] = v
+    encode_s = time.perf_counter() - t0
+
+    dim = next(iter(fresh.values())).shape[0] if fresh else (cache.vecs.shape[1] if cache is not None
+                                                              and cache.vecs is not None else 0)
+    vecs = np.empty((len(texts), dim), dtype=np.float32)
+    hit = rows >= 0
+    if hit.any():
+        vecs[hit] = cache.vecs[rows[hit]]
+    for i in np.flatnonzero(~hit).tolist():
+        vecs[i] = fresh[keys[i]]
+
+    if cache is not None and len(texts):
+        cache.save(keys, vecs)
+    stats = {"total": len(texts), "reused": int(hit.sum()), "computed": len(fresh), "encode_s": round(encode_s, 3)}
+    return vecs, stats
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Optional, Union
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from copilot.corpus import meta_columns
+
+DEFAULT_KIND = "page"  # Doc.kind default; corpus rows built before `kind` was exported
+_MAX_PREFIXES = 256
+
+Values = Union[str, Iterable[str], None]
+
+
+def _values(v: Values) -> List[str]:
+    if v is None:
+        return []
+    return [v] if isinstance(v, str) else [str(x) for x in v]
+
+
+class RowFilters:
+    """
+    Sorted row-id arrays per `kind` and `lang`, plus sorted UTF-8 URL keys
+    (numpy bytes arrays, no Python string per row) for prefix lookups by
+    searchsorted, cached per prefix. Built once per snapshot from the corpus
+    metadata; a filter resolves to the rows that match it so scoring never
+    touches the others.
+    """
+
+    def __init__(self, kinds: Sequence, langs: Sequence, urls: Sequence):
+        self.n = len(urls)
+        self.kinds = self._groups([k or DEFAULT_KIND for k in kinds])
+        self.langs = self._groups([(lang or "").lower() for lang in langs])
+        urls = [u or "" for u in urls]
+        self._url_keys, self._url_rows = self._sorted(urls)
+        self._path_keys, self._path_rows = self._sorted([urlsplit(u).path or "/" for u in urls])
+        self._prefixes: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_corpus(cls, corpus: Sequence) -> "RowFilters":
+        return cls(*meta_columns(corpus, ("kind", "lang", "url")).values())
+
+    @staticmethod
+    def _groups(values: List[str]) -> Dict[str, np.ndarray]:
+        arr = np.asarray(values, dtype=object)
+        return {v: np.flatnonzero(arr == v).astype(np.int64) for v in set(values)}
+
+    @staticmethod
+    def _sorted(keys: List[str]) -> tuple[np.ndarray, np.ndarray]:
+        # UTF-8 bytes sort in code point order, so prefix ranges are the same as on the strings
+        arr = np.asarray([k.encode("utf-8") for k in keys], dtype=np.bytes_)
+        order = np.argsort(arr, kind="stable")
+        return arr[order], order.astype(np.int64)
+
+    def url_rows(self, prefix: str) -> np.ndarray:
+        """Rows whose URL (or URL path, when `prefix` starts with "/") starts with `prefix`."""
+        hit = self._prefixes.get(prefix)
+        if hit is not None:
+            return hit
+        keys, rows = (self._path_keys, self._path_rows) if prefix.startswith("/") else (self._url_keys, self._url_rows)
+        key = prefix.encode("utf-8")
+        lo, hi = np.searchsorted(keys, [key, key + b"\xff"])  # 0xff never occurs in UTF-8
+        hit = np.sort(rows[lo:hi])
+        with self._lock:
+            if len(self._prefixes) >= _MAX_PREFIXES:
+                self._prefixes.clear()
+            self._prefixes[prefix] = hit
+        return hit
+
+    @staticmethod
+    def _any(parts: List[np.ndarray]) -> np.ndarray:
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+    def rows(self, kind: Values = None, url_prefix: Values = None, lang: Values = None) -> Optional[np.ndarray]:
+        """Sorted matching row ids, or None when no filter is given (= all rows)."""
+        sets = []
+        if kind is not None:
+            sets.append(self._any([self.kinds[v] for v in _values(kind) if v in self.kinds]))
+        if lang is not None:
+            sets.append(self._any([self.langs[v.lower()] for v in _values(lang) if v.lower() in self.langs]))
+        if url_prefix is not None:
+            sets.append(self._any([self.url_rows(p) for p in _values(url_prefix)]))
+        if not sets:
+            return None
+        out = sets[0]
+        for s in sets[1:]:
+            out = np.intersect1d(out, s, assume_unique=True)
+        return out
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import math
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from copilot.quant import VectorStore, _topk
+
+_FILES = {"centroids": "ivf.centroids.npy", "offsets": "ivf.offsets.npy", "ids": "ivf.ids.npy"}
+
+
+class IVFIndex:
+    """
+    Inverted-file index: spherical k-means centroids + one row-id list per centroid.
+    A query scores the centroids, then only the rows in the `nprobe` closest lists.
+    Lists are stored back to back in `ids`; list c is ids[offsets[c]:offsets[c + 1]].
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    def probe(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row ids in the `nprobe` lists closest to unit query `q` (d,)."""
+        nprobe = int(max(1, min(nprobe, self.nlist)))
+        c_scores = self.centroids @ q
+        lists = np.argpartition(-c_scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        return np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+    def save(self, base: Path) -> list[Path]:
+        written = []
+        for name, fname in _FILES.items():
+            path = base / fname
+            tmp = path.with_suffix(".tmp.npy")
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path)
+            written.append(path)
+        return written
+
+    @classmethod
+    def load(cls, base: Path, mmap: bool = True) -> Optional["IVFIndex"]:
+        paths = {name: base / fname for name, fname in _FILES.items()}
+        if not all(p.exists() for p in paths.values()):
+            return None
+        arrays = {name: np.load(p, mmap_mode="r" if mmap else None) for name, p in paths.items()}
+        # centroids are tiny and hit on every query: keep them in RAM
+        return cls(np.array(arrays["centroids"], dtype=np.float32), np.asarray(arrays["offsets"]), arrays["ids"])
+
+
+def _assign(store: VectorStore, centroids: np.ndarray, rows: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    out = np.empty(len(rows), dtype=np.int32)
+    for s in range(0, len(rows), chunk):
+        out[s:s + chunk] = np.argmax(store.take(rows[s:s + chunk]) @ centroids.T, axis=1)
+    return out
+
+
+def build_ivf(store: VectorStore, nlist: Optional[int] = None, iters: int = 20,
+              sample: int = 256, seed: int = 0) -> IVFIndex:
+    """
+    Train spherical k-means on (a sample of) the rows and bucket every row.
+    nlist defaults to ~4·sqrt(N); training uses at most `sample`·nlist rows.
+    """
+    n, d = len(store), store.dim
+    if n == 0:
+        raise ValueError("cannot build an IVF index over an empty matrix")
+    nlist = int(max(1, min(nlist or round(4 * math.sqrt(n)), n)))
+    rng = np.random.default_rng(seed)
+
+    train_rows = np.sort(rng.choice(n, size=min(n, sample * nlist), replace=False))
+    x = store.take(train_rows)
+    centroids = x[rng.choice(len(x), size=nlist, replace=False)].copy()
+
+    for _ in range(max(1, iters)):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros((nlist, d), dtype=np.float32)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = x[rng.choice(len(x), size=len(empty), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+    assign = _assign(store, centroids, np.arange(n))
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+    return IVFIndex(centroids.astype(np.float32), offsets, order.astype(np.int32))
+
+
+def recall_report(store: VectorStore, ivf: IVFIndex, nprobe: int, k: int = 10,
+                  n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> Dict:
+    """Recall@k of IVF probing vs brute force, plus the fraction of rows scanned."""
+    n = len(store)
+    k = int(max(1, min(k, n)))
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+    qs = store.take(rows) + rng.normal(scale=noise, size=(len(rows), store.dim)).astype(np.float32)
+    qs /= np.maximum(np.linalg.norm(qs, axis=1, keepdims=True), 1e-12)
+
+    exact = _topk(store.scores(qs), k)
+    hits, scanned = 0, 0
+    for q, truth in zip(qs, exact):
+        cand = ivf.probe(q, nprobe)
+        scanned += len(cand)
+        sims = store.scores(q, rows=cand)
+        top = cand[np.argsort(-sims)[:k]]
+        hits += len(set(top.tolist()) & set(truth.tolist()))
+    return {
+        "rows": n,
+        "nlist": ivf.nlist,
+        "nprobe": int(nprobe),
+        "k": k,
+        "queries": int(len(rows)),
+        "recall_at_k": round(hits / float(len(rows) * k), 4),
+        "scanned_fraction": round(scanned / float(len(rows) * n), 4),
+    }
@@ -0,0 +1,203 @@
+"""
+On-disk BM25 index ("lexicon"), versioned inside the index snapshot next to
+the dense files and mem-mapped at startup:
+
+    lex.terms.bin           sorted vocabulary, UTF-8, concatenated
+    lex.term_offsets.npy    int64 (T+1): term i = terms.bin[off[i]:off[i+1]]
+    lex.indptr.npy          CSR rows (one per term, same order)
+    lex.indices.npy         posting doc ids
+    lex.weights.npy         float32 precomputed BM25 term weights
+    lex.doc_len.npy         tokens per paragraph
+    lex.idf.npy             float64 idf per term
+    lex.paragraphs.arrow    pk, doc_id, title, url, text per paragraph row
+    lex.tok_*.npy           optional: term id / char start / char end of every token (snippets)
+    lex.json                k1 / b / epsilon / avgdl / rows / last_change / built_at
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from copilot import corpus
+from copilot.bm25 import SparseBM25
+from copilot.snippets import TokenSpans
+
+PREFIX = "lex."
+META_NAME = "lex.json"
+PARAS_NAME = "lex.paragraphs.arrow"
+_ARRAYS = ("term_offsets", "indptr", "indices", "weights", "doc_len", "idf")
+_SPAN_ARRAYS = ("tok_terms", "tok_starts", "tok_ends")
+
+
+class MappedVocab:
+    """
+    term → row lookups by binary search over the sorted, mem-mapped term blob;
+    terms added after load (folded deltas) live in a small dict on top.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.n = len(offsets) - 1
+        self.extra: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self.n + len(self.extra)
+
+    def _term(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def get(self, term: str, default=None):
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n and self._term(lo) == key:
+            return lo
+        return self.extra.get(term, default)
+
+    def setdefault(self, term: str, default: int) -> int:
+        row = self.get(term)
+        if row is None:
+            self.extra[term] = row = default
+        return row
+
+
+class ParagraphRows(Sequence):
+    """
+    Paragraph metadata rows of lex.paragraphs.arrow, turned into `make(**row)`
+    objects only when indexed; extend() appends in-memory rows (folded deltas).
+    """
+
+    def __init__(self, table, make: Callable):
+        self.table = table
+        self.make = make
+        self.n_base = int(table.num_rows)
+        self._cols = [c for c in table.column_names if c != "pk"]
+        self.extra: List = []
+
+    def __len__(self) -> int:
+        return self.n_base + len(self.extra)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i >= self.n_base:
+            return self.extra[i - self.n_base]
+        return self.make(**{c: self.table.column(c)[i].as_py() or "" for c in self._cols})
+
+    def extend(self, items: Iterable) -> None:
+        self.extra.extend(items)
+
+
+def _save(path: Path, arr: np.ndarray) -> Path:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp.npy")
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+    return path
+
+
+def save(base: Path, bm: SparseBM25, paragraphs: List[Dict], last_change: int = 0,
+         spans: Optional[TokenSpans] = None, aliases: Optional[Dict[int, List[str]]] = None) -> List[Path]:
+    """
+    Write `bm` (freshly built, no deltas) and the metadata of its paragraphs
+    (dicts with pk, doc_id, title, url, text, in row order) into `base`, plus
+    the token spans and the row → near-duplicate URL aliases when given.
+    """
+    if not corpus.available():
+        raise RuntimeError("pyarrow is not installed")
+    if bm.n_delta:
+        raise ValueError("only a freshly built index can be saved (it has folded deltas)")
+    base = Path(base)
+    terms = sorted(bm.vocab, key=bm.vocab.__getitem__)
+    order = sorted(range(len(terms)), key=terms.__getitem__)  # rows in sorted-term order
+    encoded = [terms[i].encode("utf-8") for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in encoded], out=offsets[1:])
+
+    m = bm.matrix[order] if order else bm.matrix
+    idx_dtype = np.int32 if m.nnz < 2 ** 31 and bm.corpus_size < 2 ** 31 else np.int64
+    blob_tmp = base / f".lex.terms.bin.{os.getpid()}.tmp"
+    blob_tmp.write_bytes(b"".join(encoded))
+    os.replace(blob_tmp, base / "lex.terms.bin")
+    arrays = {
+        "term_offsets": offsets,
+        "indptr": m.indptr.astype(idx_dtype),
+        "indices": m.indices.astype(idx_dtype),
+        "weights": m.data.astype(np.float32),
+        "doc_len": bm.doc_len.astype(np.int32),
+        "idf": bm.idf_vec[order] if order else bm.idf_vec,
+    }
+    names = list(_ARRAYS)
+    if spans is not None and spans.extra == {} and len(spans.terms) == int(bm.doc_len.sum()):
+        new_id = np.empty(len(order), dtype=np.int32)
+        new_id[order] = np.arange(len(order), dtype=np.int32)  # old term row → sorted row
+        arrays.update(tok_terms=new_id[spans.terms] if len(order) else spans.terms,
+                      tok_starts=spans.starts, tok_ends=spans.ends)
+        names += _SPAN_ARRAYS
+    written = [base / "lex.terms.bin"] + [_save(base / f"lex.{name}.npy", arrays[name]) for name in names]
+
+    table = corpus.pa.table({
+        "pk": corpus.pa.array([int(p["pk"]) for p in paragraphs], type=corpus.pa.int64()),
+        **{c: corpus.pa.array([str(p.get(c) or "") for p in paragraphs], type=corpus.pa.string())
+           for c in ("doc_id", "title", "url", "text")},
+    })
+    written.append(corpus.write_arrow(base / PARAS_NAME, table))
+
+    meta = {"k1": bm.k1, "b": bm.b, "epsilon": bm.epsilon, "avgdl": bm.avgdl, "rows": bm.corpus_size,
+            "terms": len(terms), "postings": int(m.nnz), "last_change": int(last_change), "built_at": time.time(),
+            "aliases": {str(row): urls for row, urls in (aliases or {}).items()}}
+    (base / META_NAME).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return written + [base / META_NAME]
+
+
+def available(base: Path) -> bool:
+    return corpus.available() and (Path(base) / META_NAME).exists() and (Path(base) / PARAS_NAME).exists()
+
+
+def read_meta(base: Path) -> Optional[Dict]:
+    try:
+        return json.loads((Path(base) / META_NAME).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def load(base: Path, make: Callable) -> Optional[Tuple[SparseBM25, ParagraphRows, np.ndarray, Dict,
+                                                      Optional[TokenSpans]]]:
+    """
+    Mem-map the lexicon in `base`: (SparseBM25, paragraph rows, paragraph pks,
+    meta, token spans or None), or None when the snapshot has none.
+    """
+    base = Path(base)
+    if not available(base):
+        return None
+    meta = read_meta(base)
+    arr = {name: np.load(base / f"lex.{name}.npy", mmap_mode="r") for name in _ARRAYS}
+    blob = np.memmap(base / "lex.terms.bin", dtype=np.uint8, mode="r") \
+        if (base / "lex.terms.bin").stat().st_size else np.empty(0, dtype=np.uint8)
+    vocab = MappedVocab(blob, arr["term_offsets"])
+
+    if all((base / f"lex.{name}.npy").exists() for name in _SPAN_ARRAYS):
+        arr.update({name: np.load(base / f"lex.{name}.npy", mmap_mode="r") for name in _SPAN_ARRAYS})
+    bm = SparseBM25.from_arrays(vocab, arr["indptr"], arr["indices"], arr["weights"], arr["doc_len"], arr["idf"],
+                                avgdl=meta["avgdl"], k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"],
+                                token_terms=arr.get("tok_terms"))
+    spans = TokenSpans(bm.token_ptr, arr["tok_terms"], arr["tok_starts"], arr["tok_ends"]) \
+        if bm.token_terms is not None else None
+    table = corpus.pa.ipc.open_file(corpus.pa.memory_map(str(base / PARAS_NAME), "r")).read_all()
+    if table.num_rows != bm.corpus_size:
+        raise ValueError(f"{base}: {PARAS_NAME} has {table.num_rows} rows, postings cover {bm.corpus_size}")
+    return bm, ParagraphRows(table, make), table.column("pk").to_numpy(), meta, spans
@@ -0,0 +1,50 @@
+# copilot/management/commands/copilot_bench.py
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import bench
+
+
+class Command(BaseCommand):
+    help = "Replay Q/A pairs through the bm25 / dense / hybrid retrievers: recall@k, MRR, latency, memory (JSON)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--data", action="append", default=None,
+                            help="JSONL of {q, a[, url]} lines (repeatable; default data/qa_site.jsonl)")
+        parser.add_argument("--modes", nargs="+", choices=bench.MODES, default=list(bench.MODES))
+        parser.add_argument("--k", type=int, default=5, help="Top-k for recall and MRR")
+        parser.add_argument("--repeat", type=int, default=1, help="Timed runs per query")
+        parser.add_argument("--match", type=float, default=0.6,
+                            help="Share of answer tokens a hit must contain to count as relevant (pairs without url)")
+        parser.add_argument("--warm", action="store_true",
+                            help="Leave the query-vector caches (LRU, disk) and the semantic cache on while timing")
+        parser.add_argument("--out", help="Write the JSON report here (compare across commits)")
+
+    def handle(self, *a, **kw):
+        paths = [Path(p) for p in (kw["data"] or [Path(settings.BASE_DIR) / "data" / "qa_site.jsonl"])]
+        missing = [str(p) for p in paths if not p.exists()]
+        if missing:
+            raise CommandError(f"Not found: {', '.join(missing)}")
+        pairs = bench.load_pairs(paths)
+        if not pairs:
+            raise CommandError("No Q/A pairs in the given files.")
+
+        report = bench.run(pairs, modes=kw["modes"], k=kw["k"], repeat=kw["repeat"], match=kw["match"],
+                           warm=kw["warm"])
+        report["data"] = [str(p) for p in paths]
+        text = json.dumps(report, indent=2)
+        if kw["out"]:
+            Path(kw["out"]).write_text(text + "\n", encoding="utf-8")
+        self.stdout.write(text)
+        for mode, res in report["modes"].items():
+            if "error" in res:
+                self.stdout.write(self.style.WARNING(f"{mode:<7} skipped: {res['error']}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{mode:<7} recall@{kw['k']} {res['recall_at_k']:.3f}  MRR {res['mrr']:.3f}  "
+                    f"p50 {res['p50_ms']:.2f} ms  p95 {res['p95_ms']:.2f} ms  p99 {res['p99_ms']:.2f} ms"))
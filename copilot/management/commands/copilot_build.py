@@ -0,0 +1,104 @@
+# copilot/management/commands/copilot_build.py
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import asdict
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import corpus, dense, lexicon, retrieval, snapshot
+from copilot.embed_cache import EmbeddingCache, embed_texts
+from copilot.models import Doc
+
+
+def _pool_encoder(workers: int, batch_size: int):
+    """(encode_fn, pool): sentence-transformers' multi-process pool, one CPU worker per core."""
+    model = dense._load_model()
+    pool = model.start_multi_process_pool(["cpu"] * workers)
+
+    def encode(texts):
+        return model.encode_multi_process(texts, pool, batch_size=batch_size, normalize_embeddings=True)
+
+    return encode, pool
+
+
+class Command(BaseCommand):
+    help = ("Build a whole index snapshot from the Paragraph table in one pass: corpus, normalized float32 "
+            "embeddings, optional FAISS index and the BM25 lexicon, all from the same rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=256, help="Texts per model.encode call (per worker)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Encoding processes, one per core by default (1 = in-process, single-threaded)")
+        parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the embedding cache")
+        parser.add_argument("--no-faiss", action="store_true", help="Skip faiss.index even if faiss is installed")
+        parser.add_argument("--no-lexicon", action="store_true", help="Don't publish the BM25 lexicon (lex.*)")
+        parser.add_argument("--jsonl", action="store_true", help="Write corpus.jsonl even when pyarrow is installed")
+        parser.add_argument("--dedupe", type=float, default=retrieval.DEDUPE_THRESHOLD,
+                            help="Fold paragraphs at least this similar to an earlier one into its aliases (0 = off)")
+        parser.add_argument("--budget-mb", type=float, default=0,
+                            help="Stop at this estimated BM25 heap, whole documents only (default 0 = every "
+                                 "paragraph; COPILOT_INDEX_BUDGET_MB only bounds the workers' own builds)")
+
+    def handle(self, *a, **kw):
+        t0 = time.perf_counter()
+        built = retrieval.collect_index(dedupe=kw["dedupe"], budget_mb=kw["budget_mb"])
+        if not built.paras:
+            raise CommandError("No paragraphs to index. Run copilot_index and copilot_chunk first.")
+        docs = {pk: (kind, (meta or {}).get("lang")) for pk, kind, meta in
+                Doc.objects.filter(pk__in={p.doc_id for p in built.paras}).values_list("pk", "kind", "meta")}
+        rows = []
+        for row, (pk, p) in enumerate(zip(built.pks, built.paras)):
+            kind, lang = docs.get(p.doc_id, (None, None))
+            rows.append({"pid": str(pk), **asdict(p), "kind": kind, "lang": lang,
+                         "aliases": built.aliases.get(row, [])})
+        read_s = time.perf_counter() - t0
+
+        workers = max(1, kw["workers"])
+        encode, pool = dense._encode_batch, None
+        batch = kw["batch_size"]
+        if workers > 1 and len(rows) > batch:
+            encode, pool = _pool_encoder(workers, batch)
+            batch *= workers * 4  # enough per call to keep every worker busy
+        cache = None if kw["no_cache"] else EmbeddingCache(dense.BASE / "embed_cache")
+        try:
+            vecs, stats = embed_texts([r["text"] for r in rows], encode, dense.MODEL_PATH, cache=cache,
+                                      batch_size=batch)
+        finally:
+            if pool is not None:
+                dense._load_model().stop_multi_process_pool(pool)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs /= np.where(norms > 0, norms, 1.0)
+
+        with_faiss = dense.faiss is not None and not kw["no_faiss"]
+        with_lexicon = built.bm25 is not None and corpus.available() and not kw["no_lexicon"]
+        # a fresh snapshot: every file of the previous one describes other rows
+        with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, inherit=False) as staged:
+            if corpus.available():
+                corpus.write_arrow(staged / corpus.ARROW_NAME, corpus.pa.Table.from_pylist(rows))
+            if kw["jsonl"] or not corpus.available():
+                with (staged / "corpus.jsonl").open("w", encoding="utf-8") as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            np.save(staged / "embeddings.npy", vecs)
+            if with_faiss:
+                index = dense.faiss.IndexFlatIP(vecs.shape[1])
+                index.add(vecs)
+                dense.faiss.write_index(index, str(staged / "faiss.index"))
+            if with_lexicon:
+                paragraphs = [{"pk": pk, **asdict(p)} for pk, p in zip(built.pks, built.paras)]
+                lexicon.save(staged, built.bm25, paragraphs, last_change=built.last_change, spans=built.spans,
+                             aliases=built.aliases)
+        total_s = time.perf_counter() - t0
+
+        n = len(rows)
+        self.stdout.write(f"{n} paragraphs ({built.duplicates} near-duplicates folded): read {read_s:.2f}s; reused {stats['reused']}, computed {stats['computed']} "
+                          f"in {stats['encode_s']:.2f}s ({stats['computed'] / max(stats['encode_s'], 1e-3):.0f} "
+                          f"paragraphs/s encoding, {workers if pool is not None else 1} worker(s))")
+        parts = ["corpus", f"embeddings {vecs.shape[1]}d"] + ["faiss"] * with_faiss + ["lexicon"] * with_lexicon
+        self.stdout.write(self.style.SUCCESS(
+            f"{' + '.join(parts)} in {total_s:.2f}s ({n / total_s:.0f} paragraphs/s) "
+            f"→ {snapshot.current_version(dense.BASE)}"))
@@ -0,0 +1,31 @@
+# copilot/management/commands/copilot_corpus.py
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import corpus, dense, snapshot
+
+
+class Command(BaseCommand):
+    help = "Convert the active corpus.jsonl into a mem-mappable corpus.arrow (new index snapshot)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drop-jsonl", action="store_true",
+                            help="Leave corpus.jsonl out of the new snapshot (arrow only)")
+
+    def handle(self, *a, **kw):
+        if not corpus.available():
+            raise CommandError("pyarrow is not installed")
+        src = snapshot.current_dir(dense.BASE) / "corpus.jsonl"
+        if not src.exists():
+            raise CommandError(f"Corpus not found at {src}. Build your index.")
+
+        t0 = time.perf_counter()
+        drop = ("corpus.jsonl",) if kw["drop_jsonl"] else ()
+        with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=drop) as staged:
+            rows = corpus.jsonl_to_arrow(src, staged / corpus.ARROW_NAME)
+        self.stdout.write(self.style.SUCCESS(
+            f"{rows} rows → {corpus.ARROW_NAME} in {time.perf_counter() - t0:.2f}s "
+            f"({snapshot.current_version(dense.BASE)})"))
@@ -0,0 +1,38 @@
+# copilot/management/commands/copilot_embed.py
+from __future__ import annotations
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import corpus, dense, snapshot
+from copilot.embed_cache import EmbeddingCache, embed_texts
+
+# everything derived from the vectors is stale once they change
+_DERIVED = ("faiss.index", "embeddings.*", "ivf.*")
+
+
+class Command(BaseCommand):
+    help = "Re-embed the active corpus into a new snapshot, encoding only paragraphs whose text changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the embedding cache")
+
+    def handle(self, *a, **kw):
+        src = snapshot.current_dir(dense.BASE)
+        if corpus.count_rows(src) is None:
+            raise CommandError(f"Corpus not found in {src}. Build your index.")
+        texts = corpus.read_texts(src)
+
+        cache = None if kw["no_cache"] else EmbeddingCache(dense.BASE / "embed_cache")
+        t0 = time.perf_counter()
+        vecs, stats = embed_texts(texts, dense._encode_batch, dense.MODEL_PATH, cache=cache,
+                                  batch_size=kw["batch_size"])
+        with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=_DERIVED) as staged:
+            np.save(staged / "embeddings.npy", vecs)
+
+        self.stdout.write(f"{stats['total']} paragraphs: reused {stats['reused']}, computed {stats['computed']} "
+                          f"(encode {stats['encode_s']:.2f}s, total {time.perf_counter() - t0:.2f}s)")
+        self.stdout.write(self.style.SUCCESS(f"Embedded into {snapshot.current_version(dense.BASE)}."))
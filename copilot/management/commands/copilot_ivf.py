@@ -0,0 +1,46 @@
+# copilot/management/commands/copilot_ivf.py
+from __future__ import annotations
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import dense, snapshot
+from copilot.ivf import IVFIndex, build_ivf, recall_report
+from copilot.quant import load_store
+
+
+class Command(BaseCommand):
+    help = "Build the pure-numpy IVF index (k-means centroids + inverted lists) into a new index snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nlist", type=int, default=0, help="Number of lists (default ~4*sqrt(N))")
+        parser.add_argument("--iters", type=int, default=20, help="k-means iterations")
+        parser.add_argument("--nprobe", type=int, default=dense.IVF_NPROBE, help="nprobe used for the report")
+        parser.add_argument("--k", type=int, default=10, help="Top-k used for the recall report")
+        parser.add_argument("--queries", type=int, default=200, help="Sampled queries for the recall report")
+        parser.add_argument("--report-only", action="store_true", help="Don't rebuild, just report")
+
+    def handle(self, *a, **kw):
+        src = snapshot.current_dir(dense.BASE)
+        store = load_store(src, mode="float32", mmap=True)
+        if store is None:
+            raise CommandError(f"Embeddings not found at {src / 'embeddings.npy'}. Build your index.")
+
+        if kw["report_only"]:
+            ivf = IVFIndex.load(src)
+            if ivf is None:
+                raise CommandError(f"No IVF index in {src}; run without --report-only first.")
+        else:
+            t0 = time.perf_counter()
+            ivf = build_ivf(store, nlist=kw["nlist"] or None, iters=kw["iters"])
+            with snapshot.stage(dense.BASE, model=dense.MODEL_PATH) as staged:
+                for path in ivf.save(staged):
+                    self.stdout.write(f"wrote {path.name}")
+            self.stdout.write(f"built {ivf.nlist} lists over {len(store)} rows in {time.perf_counter() - t0:.2f}s"
+                              f" → {snapshot.current_version(dense.BASE)}")
+
+        report = recall_report(store, ivf, nprobe=kw["nprobe"], k=kw["k"], n_queries=kw["queries"])
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS("IVF ready. Tune COPILOT_IVF_NPROBE at query time."))
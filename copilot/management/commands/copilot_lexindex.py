@@ -0,0 +1,45 @@
+# copilot/management/commands/copilot_lexindex.py
+from __future__ import annotations
+
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import corpus, dense, lexicon, retrieval, snapshot
+
+
+class Command(BaseCommand):
+    help = "Build the BM25 index from the Paragraph table and publish it (mem-mappable) in a new index snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--remove", action="store_true",
+                            help="Publish a snapshot without the lexicon (workers build BM25 from the database)")
+
+    def handle(self, *a, **kw):
+        drop = (lexicon.PREFIX + "*",)
+        if kw["remove"]:
+            with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=drop):
+                pass
+            self.stdout.write(self.style.SUCCESS(f"Lexicon removed → {snapshot.current_version(dense.BASE)}"))
+            return
+        if retrieval.BM25 is None:
+            raise CommandError("scipy is not installed")
+        if not corpus.available():
+            raise CommandError("pyarrow is not installed")
+
+        t0 = time.perf_counter()
+        built = retrieval.collect_index()
+        bm = built.bm25
+        if bm is None:
+            raise CommandError("No paragraphs to index. Run copilot_index first.")
+        paragraphs = [{"pk": pk, **asdict(p)} for pk, p in zip(built.pks, built.paras)]
+        elapsed = time.perf_counter() - t0
+
+        with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=drop) as staged:
+            written = lexicon.save(staged, bm, paragraphs, last_change=built.last_change, spans=built.spans,
+                                   aliases=built.aliases)
+            size = sum(p.stat().st_size for p in written)
+        self.stdout.write(self.style.SUCCESS(
+            f"{bm.corpus_size} paragraphs, {len(bm.vocab)} terms, {bm.matrix.nnz} postings "
+            f"({size / 2 ** 20:.1f} MiB) built in {elapsed:.2f}s → {snapshot.current_version(dense.BASE)}"))
@@ -0,0 +1,47 @@
+# copilot/management/commands/copilot_quantize.py
+from __future__ import annotations
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import dense, snapshot
+from copilot.quant import load_store, recall_report, save_quantized, write_report
+
+
+class Command(BaseCommand):
+    help = "Write float16/int8 copies of embeddings.npy into a new index snapshot and report recall vs float32."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["float16", "int8", "both"], default="int8")
+        parser.add_argument("--k", type=int, default=10, help="Top-k used for the recall report")
+        parser.add_argument("--queries", type=int, default=200, help="Sampled queries for the recall report")
+        parser.add_argument("--report-only", action="store_true", help="Don't (re)write files, just report")
+
+    def handle(self, *a, **kw):
+        src = snapshot.current_dir(dense.BASE)
+        ref = load_store(src, mode="float32", mmap=True)
+        if ref is None:
+            raise CommandError(f"Embeddings not found at {src / 'embeddings.npy'}. Build your index.")
+        modes = ["float16", "int8"] if kw["mode"] == "both" else [kw["mode"]]
+
+        if kw["report_only"]:
+            for mode in modes:
+                self._report(src, ref, mode, kw)
+            return
+
+        with snapshot.stage(dense.BASE, model=dense.MODEL_PATH) as staged:
+            for mode in modes:
+                for path in save_quantized(staged, ref.vecs, mode):
+                    self.stdout.write(f"wrote {path.name}")
+                write_report(staged, self._report(staged, ref, mode, kw))
+        self.stdout.write(self.style.SUCCESS(
+            f"Quantized into {snapshot.current_version(dense.BASE)}. Set COPILOT_VEC_DTYPE to use it."))
+
+    def _report(self, base, ref, mode, kw):
+        cand = load_store(base, mode=mode, mmap=True)
+        if cand is None or cand.mode != mode:
+            raise CommandError(f"No {mode} files in {base}; run without --report-only first.")
+        report = recall_report(ref, cand, k=kw["k"], n_queries=kw["queries"])
+        self.stdout.write(json.dumps(report, indent=2))
+        return report
@@ -0,0 +1,63 @@
+# copilot/management/commands/copilot_reduce.py
+from __future__ import annotations
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import dense, reduce, snapshot
+from copilot.quant import load_store
+
+
+class Command(BaseCommand):
+    help = "Project the dense vectors to fewer dimensions (PCA or prefix truncation) into a new index snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dim", type=int, default=128, help="Target dimension")
+        parser.add_argument("--method", choices=reduce.METHODS, default="pca",
+                            help="pca (fitted on the corpus) or prefix (Matryoshka-trained models)")
+        parser.add_argument("--sample", type=int, default=50000, help="Rows sampled to fit the PCA")
+        parser.add_argument("--rescore", type=int, default=dense.RESCORE or 4,
+                            help="Candidates per result rescored at full dim, for the report")
+        parser.add_argument("--k", type=int, default=10, help="Top-k used for the recall report")
+        parser.add_argument("--queries", type=int, default=200, help="Sampled queries for the recall report")
+        parser.add_argument("--report-only", action="store_true", help="Don't rebuild, just report")
+        parser.add_argument("--remove", action="store_true", help="Publish a snapshot without reduced vectors")
+
+    def handle(self, *a, **kw):
+        src = snapshot.current_dir(dense.BASE)
+        drop = (reduce.PROJ_NAME, reduce.MEAN_NAME, reduce.REDUCED_NAME, reduce.META_NAME)
+        if kw["remove"]:
+            with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=drop):
+                pass
+            self.stdout.write(self.style.SUCCESS(f"Reduced vectors removed → {snapshot.current_version(dense.BASE)}"))
+            return
+
+        full = load_store(src, mode="float32", mmap=True)
+        if full is None:
+            raise CommandError(f"Embeddings not found at {src / 'embeddings.npy'}. Build your index.")
+
+        if kw["report_only"]:
+            proj, red = reduce.Projection.load(src), reduce.load_reduced(src)
+            if proj is None or red is None:
+                raise CommandError(f"No reduced vectors in {src}; run without --report-only first.")
+        else:
+            if kw["dim"] >= full.dim:
+                raise CommandError(f"--dim must be below the embedding dimension ({full.dim})")
+            t0 = time.perf_counter()
+            proj, meta = reduce.fit(full, kw["dim"], method=kw["method"], sample=kw["sample"])
+            reduced = reduce.reduce_store(full, proj)
+            with snapshot.stage(dense.BASE, model=dense.MODEL_PATH, drop=drop) as staged:
+                for path in reduce.save(staged, proj, reduced, meta):
+                    self.stdout.write(f"wrote {path.name}")
+            self.stdout.write(f"{meta['method']} {full.dim} → {meta['dim']} dims over {len(full)} rows in "
+                              f"{time.perf_counter() - t0:.2f}s (explained variance {meta['explained_variance']})"
+                              f" → {snapshot.current_version(dense.BASE)}")
+            red = reduce.load_reduced(snapshot.current_dir(dense.BASE))
+
+        report = reduce.recall_report(full, red, proj, k=kw["k"], n_queries=kw["queries"],
+                                      rescore_factor=kw["rescore"])
+        self.stdout.write(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS("Reduced vectors ready. COPILOT_RESCORE sets the full-dim rescore "
+                                             "depth (0 = low-dim only); COPILOT_REDUCED=0 ignores them."))
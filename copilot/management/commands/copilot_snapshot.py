@@ -0,0 +1,52 @@
+# copilot/management/commands/copilot_snapshot.py
+from __future__ import annotations
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from copilot import dense, snapshot
+
+
+class Command(BaseCommand):
+    help = "List, publish, verify, activate (roll back) or prune versioned copilot index snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--publish", action="store_true",
+                            help="Snapshot the files currently served (e.g. a hand-built flat copilot_index/)")
+        parser.add_argument("--activate", metavar="VERSION", help="Point CURRENT at an existing version")
+        parser.add_argument("--verify", action="store_true", help="Re-hash the active snapshot against its manifest")
+        parser.add_argument("--prune", type=int, metavar="KEEP", help="Keep only the newest KEEP versions")
+
+    def handle(self, *a, **kw):
+        base = dense.BASE
+        if kw["publish"]:
+            with snapshot.stage(base, model=dense.MODEL_PATH):
+                pass
+            self.stdout.write(self.style.SUCCESS(f"published {snapshot.current_version(base)}"))
+        if kw["activate"]:
+            try:
+                snapshot.activate(base, kw["activate"])
+            except snapshot.SnapshotError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"activated {kw['activate']}"))
+        if kw["verify"]:
+            path = snapshot.current_dir(base)
+            manifest = snapshot.read_manifest(path)
+            if manifest is None:
+                raise CommandError(f"{path} has no manifest (flat layout); run --publish first")
+            try:
+                snapshot.validate(path, manifest, checksums=True)
+            except snapshot.SnapshotError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"{path.name} OK ({manifest['rows']} rows × {manifest['dim']})"))
+        if kw["prune"] is not None:
+            for v in snapshot.prune(base, keep=kw["prune"]):
+                self.stdout.write(f"removed {v}")
+
+        active = snapshot.current_version(base)
+        for v in snapshot.versions(base):
+            m = snapshot.read_manifest(base / v) or {}
+            mark = "*" if v == active else " "
+            self.stdout.write(f"{mark} {v}  rows={m.get('rows')} dim={m.get('dim')} model={m.get('model')!r}"
+                              f"  files={json.dumps(sorted(m.get('files', {})))}")
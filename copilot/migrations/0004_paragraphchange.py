@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 03:47
+
+import copilot.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('copilot', '0003_apicall'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParagraphChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paragraph_id', models.BigIntegerField(blank=True, null=True)),
+                ('op', models.CharField(choices=[('upsert', 'upsert'), ('delete', 'delete'), ('reset', 'reset')], max_length=8)),
+                ('created_at', models.DateTimeField(db_index=True, default=copilot.models._now)),
+            ],
+        ),
+    ]
@@ -112,6 +112,26 @@ class Paragraph(models.Model):
         return f"{self.doc_id}#{self.order}"
 
 
+class ParagraphChange(models.Model):
+    """
+    Append-only log of Paragraph writes (filled by copilot.signals).
+    Each worker folds rows newer than the last id it has seen into its
+    in-memory BM25 index; "reset" asks for a full rebuild (bulk writes
+    that bypass model signals should record one via log_reset()).
+    """
+    OPS = [("upsert", "upsert"), ("delete", "delete"), ("reset", "reset")]
+    paragraph_id = models.BigIntegerField(null=True, blank=True)  # no FK: deleted rows stay logged
+    op = models.CharField(max_length=8, choices=OPS)
+    created_at = models.DateTimeField(default=_now, db_index=True)
+
+    def __str__(self):
+        return f"{self.op} {self.paragraph_id or ''}".strip()
+
+    @classmethod
+    def log_reset(cls) -> None:
+        cls.objects.create(op="reset")
+
+
 # === API call analytics ========================================================
 
 class APICall(models.Model):
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+_MAGIC = b"BQC1"
+_HEADER = struct.Struct("<4sII")  # magic, dim, slots
+_HEADER_SIZE = 16
+
+
+def _hash(salt: str, key: str) -> int:
+    h = hashlib.blake2b(f"{salt}\0{key}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(h, "little") or 1  # 0 marks an empty slot
+
+
+class DiskQueryCache:
+    """
+    Direct-mapped query → vector table in one mem-mapped file.
+
+    Every worker maps the same file (MAP_SHARED), so a vector encoded by one
+    process is visible to all of them and survives restarts. Each slot holds
+    a 64-bit key hash + the vector; collisions simply overwrite. Writers clear
+    the key before touching the vector and readers re-check it afterwards, so
+    a torn read shows up as a miss instead of a wrong vector.
+    """
+
+    def __init__(self, path: Path, slots: int = 8192, salt: str = ""):
+        self.path = Path(path)
+        self.slots = int(max(1, slots))
+        self.salt = salt
+        self._table: Optional[np.memmap] = None
+        self._dim = 0
+
+    def _dtype(self, dim: int) -> np.dtype:
+        return np.dtype([("key", "<u8"), ("vec", "<f4", (dim,))])
+
+    def _open(self, dim: Optional[int] = None) -> Optional[np.memmap]:
+        if self._table is not None and (dim is None or dim == self._dim):
+            return self._table
+        if self.path.exists():
+            with self.path.open("rb") as f:
+                magic, fdim, fslots = _HEADER.unpack(f.read(_HEADER.size))
+            if magic == _MAGIC and fslots == self.slots and (dim is None or dim == fdim):
+                self._dim = fdim
+                self._table = np.memmap(self.path, dtype=self._dtype(fdim), mode="r+",
+                                        offset=_HEADER_SIZE, shape=(self.slots,))
+                return self._table
+        if dim is None:
+            return None
+        self._create(dim)
+        return self._open(dim)
+
+    def _create(self, dim: int) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(_HEADER.pack(_MAGIC, dim, self.slots).ljust(_HEADER_SIZE, b"\0"))
+            f.truncate(_HEADER_SIZE + self._dtype(dim).itemsize * self.slots)
+        os.replace(tmp, self.path)
+        self._table = None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        table = self._open()
+        if table is None:
+            return None
+        h = _hash(self.salt, key)
+        slot = table[h % self.slots]
+        if int(slot["key"]) != h:
+            return None
+        vec = np.array(slot["vec"], dtype=np.float32)
+        if int(table[h % self.slots]["key"]) != h:
+            return None
+        return vec
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        table = self._open(dim=vec.shape[0])
+        if table is None:
+            return
+        h = _hash(self.salt, key)
+        i = h % self.slots
+        table["key"][i] = 0
+        table["vec"][i] = vec
+        table["key"][i] = h
+
+    def __len__(self) -> int:
+        table = self._open()
+        return 0 if table is None else int(np.count_nonzero(table["key"]))
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+# Rows converted to float32 per step when scoring a quantized matrix
+SCORE_CHUNK = int(os.getenv("COPILOT_SCORE_CHUNK", "8192") or 8192)
+
+MODES = ("float32", "float16", "int8")
+_TAGS = {"float16": "f16", "int8": "i8"}
+
+
+class VectorStore:
+    """
+    Row-major embedding matrix used for dense scoring.
+
+    mode="float32": plain (usually mem-mapped) matrix, scored with one BLAS call.
+    mode="float16": half-precision rows + norm table.
+    mode="int8":    per-row scaled int8 rows (x ≈ q * scale) + norm table.
+
+    Quantized rows are widened to float32 a chunk at a time, so the full
+    float32 matrix never exists in memory.
+    """
+
+    def __init__(self, vecs: np.ndarray, mode: str = "float32",
+                 scale: Optional[np.ndarray] = None, norms: Optional[np.ndarray] = None):
+        if vecs.ndim != 2:
+            raise ValueError(f"embeddings must be 2D, got {vecs.shape}")
+        self.vecs = vecs
+        self.mode = mode
+        self.scale = scale
+        self.norms = norms
+        # per-row multiplier that turns q·row into cosine(q, dequantized row)
+        mult = None
+        if scale is not None:
+            mult = np.asarray(scale, dtype=np.float32)
+        if norms is not None:
+            inv = 1.0 / np.maximum(np.asarray(norms, dtype=np.float32), 1e-12)
+            mult = inv if mult is None else mult * inv
+        self._mult = mult
+
+    def __len__(self) -> int:
+        return int(self.vecs.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.vecs.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        n = int(self.vecs.nbytes)
+        for a in (self.scale, self.norms):
+            if a is not None:
+                n += int(a.nbytes)
+        return n
+
+    def scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine scores of query vector(s) against all rows (or only `rows`).
+        q: (d,) → (n,) ; q: (m, d) → (m, n)
+        """
+        q = np.asarray(q, dtype=np.float32)
+        mat = self.vecs if rows is None else self.vecs[rows]
+        mult = self._mult if (rows is None or self._mult is None) else self._mult[rows]
+
+        if mat.dtype == np.float32:
+            out = mat @ q.T
+        else:
+            n = mat.shape[0]
+            out = np.empty((n, q.shape[0]) if q.ndim == 2 else n, dtype=np.float32)
+            for s in range(0, n, SCORE_CHUNK):
+                out[s:s + SCORE_CHUNK] = mat[s:s + SCORE_CHUNK].astype(np.float32) @ q.T
+        if mult is not None:
+            out = out * (mult[:, None] if out.ndim == 2 else mult)
+        return np.ascontiguousarray(out.T) if out.ndim == 2 else out
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Dequantized float32 copies of `rows` (unit-normalized)."""
+        mat = np.asarray(self.vecs[rows], dtype=np.float32)
+        if self._mult is not None:
+            mat = mat * self._mult[rows][:, None]
+        return mat
+
+
+# --- build / convert ----------------------------------------------------------
+def quantize(vecs: np.ndarray, mode: str) -> Dict[str, np.ndarray]:
+    """Return the arrays that make up `mode` for a float32 matrix."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if mode == "float16":
+        q = vecs.astype(np.float16)
+        return {"vecs": q, "norms": np.linalg.norm(q.astype(np.float32), axis=1).astype(np.float32)}
+    if mode == "int8":
+        scale = np.abs(vecs).max(axis=1) / 127.0
+        scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+        q = np.clip(np.rint(vecs / scale[:, None]), -127, 127).astype(np.int8)
+        deq = q.astype(np.float32) * scale[:, None]
+        return {"vecs": q, "scale": scale, "norms": np.linalg.norm(deq, axis=1).astype(np.float32)}
+    raise ValueError(f"unknown quantization mode: {mode}")
+
+
+def _paths(base: Path, mode: str) -> Dict[str, Path]:
+    tag = _TAGS[mode]
+    return {
+        "vecs": base / f"embeddings.{tag}.npy",
+        "scale": base / f"embeddings.{tag}.scale.npy",
+        "norms": base / f"embeddings.{tag}.norms.npy",
+    }
+
+
+def vec_file(base: Path, mode: str) -> Path:
+    """The file holding the row matrix for `mode`."""
+    return _paths(base, mode)["vecs"] if mode in _TAGS else base / "embeddings.npy"
+
+
+def save_quantized(base: Path, vecs: np.ndarray, mode: str) -> list[Path]:
+    """Write the quantized arrays for `mode` next to embeddings.npy."""
+    written = []
+    for name, arr in quantize(vecs, mode).items():
+        path = _paths(base, mode)[name]
+        tmp = path.with_suffix(".tmp.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, path)
+        written.append(path)
+    return written
+
+
+def load_store(base: Path, mode: str = "float32", mmap: bool = True) -> Optional[VectorStore]:
+    """
+    Load the matrix in `mode` from `base`. Falls back to embeddings.npy when the
+    quantized files are missing; returns None when there are no embeddings at all.
+    """
+    mmap_mode = "r" if mmap else None
+    if mode in _TAGS:
+        p = _paths(base, mode)
+        if p["vecs"].exists() and p["norms"].exists():
+            arrays = {name: np.load(path, mmap_mode=mmap_mode) for name, path in p.items() if path.exists()}
+            return VectorStore(arrays["vecs"], mode=mode, scale=arrays.get("scale"), norms=arrays["norms"])
+
+    vec_path = base / "embeddings.npy"
+    if not vec_path.exists():
+        return None
+    vecs = np.load(vec_path, mmap_mode=mmap_mode)
+    if vecs.dtype != np.float32:
+        vecs = vecs.astype(np.float32, copy=False)
+    return VectorStore(vecs)
+
+
+# --- quality report -----------------------------------------------------------
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(idx, np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1), axis=1)
+
+
+def recall_report(ref: VectorStore, cand: VectorStore, k: int = 10,
+                  n_queries: int = 200, noise: float = 0.05, seed: int = 0) -> Dict:
+    """
+    Compare top-k of `cand` against the float32 reference.
+    Queries are corpus rows with a little gaussian noise (so the row itself
+    isn't a guaranteed exact hit), unit-normalized like real query vectors.
+    """
+    n = len(ref)
+    k = int(max(1, min(k, n)))
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+    qs = ref.take(rows) + rng.normal(scale=noise, size=(len(rows), ref.dim)).astype(np.float32)
+    qs /= np.maximum(np.linalg.norm(qs, axis=1, keepdims=True), 1e-12)
+
+    s_ref, s_cand = ref.scores(qs), cand.scores(qs)
+    top_ref, top_cand = _topk(s_ref, k), _topk(s_cand, k)
+    hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(top_ref, top_cand))
+
+    return {
+        "mode": cand.mode,
+        "rows": n,
+        "dim": ref.dim,
+        "k": k,
+        "queries": int(len(rows)),
+        "recall_at_k": round(hits / float(len(rows) * k), 4),
+        "top1_agreement": round(float(np.mean(top_ref[:, 0] == top_cand[:, 0])), 4),
+        "max_abs_score_err": round(float(np.abs(s_ref - s_cand).max()), 6),
+        "bytes_float32": int(ref.nbytes),
+        "bytes": int(cand.nbytes),
+        "compression": round(ref.nbytes / max(1, cand.nbytes), 2),
+    }
+
+
+def write_report(base: Path, report: Dict) -> Path:
+    path = base / f"embeddings.{_TAGS[report['mode']]}.report.json"
+    tmp = path.with_suffix(".tmp.json")  # `path` may be a hard link into the previous snapshot: replace, don't truncate
+    tmp.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
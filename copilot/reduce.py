@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from copilot.quant import SCORE_CHUNK, VectorStore, _topk
+
+METHODS = ("pca", "prefix")
+PROJ_NAME = "proj.npy"
+MEAN_NAME = "proj_mean.npy"
+REDUCED_NAME = "embeddings.reduced.npy"
+META_NAME = "reduce.json"
+
+
+class Projection:
+    """x ↦ normalize((x - mean) @ proj): maps full-dim unit vectors to `dim` dims."""
+
+    def __init__(self, proj: np.ndarray, mean: np.ndarray, method: str = "pca"):
+        self.proj = np.asarray(proj, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.method = method
+
+    @property
+    def dim(self) -> int:
+        return int(self.proj.shape[1])
+
+    def apply(self, x: np.ndarray) -> np.ndarray:
+        if self.method == "prefix":
+            y = np.asarray(x, dtype=np.float32)[..., : self.dim]
+        else:
+            y = (np.asarray(x, dtype=np.float32) - self.mean) @ self.proj
+        return (y / np.maximum(np.linalg.norm(y, axis=-1, keepdims=True), 1e-12)).astype(np.float32)
+
+    @classmethod
+    def load(cls, base: Path) -> Optional["Projection"]:
+        base = Path(base)
+        if not (base / PROJ_NAME).exists() or not (base / MEAN_NAME).exists():
+            return None
+        meta = json.loads((base / META_NAME).read_text(encoding="utf-8")) if (base / META_NAME).exists() else {}
+        return cls(np.load(base / PROJ_NAME), np.load(base / MEAN_NAME), method=meta.get("method", "pca"))
+
+
+def fit(store: VectorStore, dim: int, method: str = "pca", sample: int = 50000, seed: int = 0) -> tuple[Projection, Dict]:
+    """
+    PCA on (a sample of) the corpus vectors, or prefix truncation for models
+    trained Matryoshka-style. Returns the projection and {"explained_variance": ...}.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown reduction method {method!r} (expected one of {METHODS})")
+    d = store.dim
+    dim = int(max(1, min(dim, d)))
+    n = len(store)
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n, size=min(n, sample), replace=False)) if n > sample else np.arange(n)
+    x = store.take(rows).astype(np.float64)
+
+    if method == "prefix":
+        proj, mean = np.eye(d, dim, dtype=np.float32), np.zeros(d, dtype=np.float32)
+        var = x.var(axis=0)
+        explained = float(var[:dim].sum() / max(var.sum(), 1e-12))
+    else:
+        mean = x.mean(axis=0)
+        _, s, vt = np.linalg.svd(x - mean, full_matrices=False)
+        proj = np.zeros((d, dim), dtype=np.float32)
+        k = min(dim, vt.shape[0])
+        proj[:, :k] = vt[:k].T
+        var = s ** 2
+        explained = float(var[:k].sum() / max(var.sum(), 1e-12))
+    return Projection(proj, mean, method=method), {"method": method, "dim": dim, "full_dim": d,
+                                                   "explained_variance": round(explained, 4)}
+
+
+def reduce_store(store: VectorStore, projection: Projection) -> np.ndarray:
+    out = np.empty((len(store), projection.dim), dtype=np.float32)
+    for s in range(0, len(store), SCORE_CHUNK):
+        rows = np.arange(s, min(s + SCORE_CHUNK, len(store)))
+        out[rows] = projection.apply(store.take(rows))
+    return out
+
+
+def save(base: Path, projection: Projection, reduced: np.ndarray, meta: Dict) -> list[Path]:
+    base = Path(base)
+    written = []
+    for name, arr in ((PROJ_NAME, projection.proj), (MEAN_NAME, projection.mean), (REDUCED_NAME, reduced)):
+        tmp = base / f".{name}.{os.getpid()}.tmp.npy"
+        np.save(tmp, np.ascontiguousarray(arr, dtype=np.float32))
+        os.replace(tmp, base / name)
+        written.append(base / name)
+    (base / META_NAME).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return written + [base / META_NAME]
+
+
+def load_reduced(base: Path, mmap: bool = True) -> Optional[VectorStore]:
+    p = Path(base) / REDUCED_NAME
+    if not p.exists():
+        return None
+    return VectorStore(np.load(p, mmap_mode="r" if mmap else None))
+
+
+def rescore(full: VectorStore, q: np.ndarray, cand: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Exact full-dim scores for candidate rows; returns (rows, scores) of the best k, best first."""
+    sims = full.scores(q, rows=cand)
+    k = int(min(k, len(cand)))
+    top = np.argpartition(sims, -k)[-k:]
+    top = top[np.argsort(sims[top])][::-1]
+    return cand[top], sims[top]
+
+
+def recall_report(full: VectorStore, reduced: VectorStore, projection: Projection, k: int = 10,
+                  n_queries: int = 200, rescore_factor: int = 4, noise: float = 0.05, seed: int = 0) -> Dict:
+    """Top-k overlap with the full-dim search: reduced alone, and reduced + full-dim rescore."""
+    n = len(full)
+    k = int(max(1, min(k, n)))
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+    qs = full.take(rows) + rng.normal(scale=noise, size=(len(rows), full.dim)).astype(np.float32)
+    qs /= np.maximum(np.linalg.norm(qs, axis=1, keepdims=True), 1e-12)
+
+    top_ref = _topk(full.scores(qs), k)
+    s_red = reduced.scores(projection.apply(qs))
+    top_red = _topk(s_red, k)
+    n_cand = int(min(n, max(k, k * rescore_factor)))
+    top_cand = _topk(s_red, n_cand)
+    top_two = [rescore(full, q, c, k)[0] for q, c in zip(qs, top_cand)]
+
+    def _recall(tops) -> float:
+        return round(sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(top_ref, tops)) / float(len(rows) * k), 4)
+
+    return {
+        "method": projection.method,
+        "rows": n,
+        "dim": reduced.dim,
+        "full_dim": full.dim,
+        "k": k,
+        "queries": int(len(rows)),
+        "recall_at_k": _recall(top_red),
+        "rescore_candidates": n_cand,
+        "recall_at_k_rescored": _recall(top_two),
+        "bytes_full": int(full.nbytes),
+        "bytes": int(reduced.nbytes),
+    }
@@ -1,25 +1,73 @@
 from __future__ import annotations
 
+import logging
 import os
-import re
+import sys
+import threading
 import time
-from collections import defaultdict
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Optional
+from datetime import timedelta
+from typing import List, Dict, Iterator, Tuple, Optional, Sequence
 
 import numpy as np
 from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 
-from copilot.dense import search_dense  # unified dense API
-from .models import Paragraph
+from copilot import dense, lexicon, snapshot
+from copilot.corpus import rows_of
+from copilot.dedupe import NearDuplicates
+from copilot.dense import search_dense_hits, search_dense_hits_many  # unified dense API
+from copilot.semcache import SemanticCache
+from copilot.snippets import TokenSpans, token_spans, tokens, window
+from .models import Paragraph, ParagraphChange
 
 try:
-    from rank_bm25 import BM25Okapi as BM25
+    from copilot.bm25 import SparseBM25 as BM25
 except Exception:
     BM25 = None
 
+log = logging.getLogger("app")
+
 RETRIEVER_MODE = (getattr(settings, "COPILOT_RETRIEVER", os.getenv("COPILOT_RETRIEVER", "hybrid")) or "hybrid").lower()
-MAX_DOCS = int(getattr(settings, "COPILOT_MAX_DOCS", os.getenv("COPILOT_MAX_DOCS", 60)) or 60)
+# Estimated heap the BM25 index may take (paragraph text + postings); whole documents past it are left out
+INDEX_BUDGET_MB = float(getattr(settings, "COPILOT_INDEX_BUDGET_MB", os.getenv("COPILOT_INDEX_BUDGET_MB", 256)) or 0)
+ROW_CHUNK = 2000  # Paragraph rows fetched per database round trip while building
+_ROW_BYTES = 200  # Para object, its slot in _paras, _row_of entry
+_TOKEN_BYTES = 60  # per token at the build peak: term/doc ids + COO → CSR conversion, plus its kept char span
+# Paragraphs whose word shingles match an earlier one's at least this much (MinHash estimate) are left out of
+# the build, their URLs kept as aliases of the indexed copy (0 = keep every paragraph)
+DEDUPE_THRESHOLD = float(getattr(settings, "COPILOT_DEDUPE_THRESHOLD", os.getenv("COPILOT_DEDUPE_THRESHOLD", 0.9)) or 0)
+
+# BM25 freshness: ParagraphChange rows (see copilot.signals) are folded into the live index every
+# BM25_POLL seconds; a full rebuild restoring exact IDF runs in the background every BM25_COMPACT
+# seconds, or once folded documents reach BM25_COMPACT_RATIO of the index
+BM25_POLL = float(getattr(settings, "COPILOT_BM25_POLL", os.getenv("COPILOT_BM25_POLL", 5)))
+BM25_COMPACT = float(getattr(settings, "COPILOT_BM25_COMPACT", os.getenv("COPILOT_BM25_COMPACT", 3600)))
+BM25_COMPACT_RATIO = float(getattr(settings, "COPILOT_BM25_COMPACT_RATIO", os.getenv("COPILOT_BM25_COMPACT_RATIO", 0.2)))
+# Start from the mem-mapped lexicon of the active index snapshot (`manage.py copilot_lexindex`) when present
+USE_LEXICON = str(getattr(settings, "COPILOT_LEXICON", os.getenv("COPILOT_LEXICON", "1"))) != "0"
+
+# BM25 runs on the request thread while the query encoder and dense search run on a small per-process pool
+# (NumPy, torch and FAISS release the GIL); at most DENSE_POOL_SIZE dense jobs are in flight, calls finding
+# them all taken skip the dense side. Fusion starts once both are done, or after RETRIEVER_TIMEOUT_MS with
+# whatever has arrived. With the micro-batcher on, a full encoder batch of queries may wait in it at once
+PARALLEL = str(getattr(settings, "COPILOT_PARALLEL", os.getenv("COPILOT_PARALLEL", "1"))) == "1"
+_DENSE_THREADS = dense.BATCH_SIZE if dense.MICROBATCH else 2
+DENSE_POOL_SIZE = int(getattr(settings, "COPILOT_DENSE_THREADS",
+                              os.getenv("COPILOT_DENSE_THREADS", _DENSE_THREADS)) or _DENSE_THREADS)
+RETRIEVER_TIMEOUT_MS = float(getattr(settings, "COPILOT_RETRIEVER_TIMEOUT_MS",
+                                     os.getenv("COPILOT_RETRIEVER_TIMEOUT_MS", 2000)) or 0)
+
+# Paraphrase-level result cache in front of hybrid_search ("who are you" ≈ "who is bambi")
+SEMCACHE = str(getattr(settings, "COPILOT_SEMCACHE", os.getenv("COPILOT_SEMCACHE", "1"))) == "1"
+_semcache = SemanticCache(
+    threshold=float(getattr(settings, "COPILOT_SEMCACHE_THRESHOLD", os.getenv("COPILOT_SEMCACHE_THRESHOLD", 0.95))),
+    ttl=float(getattr(settings, "COPILOT_SEMCACHE_TTL", os.getenv("COPILOT_SEMCACHE_TTL", 600))),
+    max_items=int(getattr(settings, "COPILOT_SEMCACHE_SIZE", os.getenv("COPILOT_SEMCACHE_SIZE", 512))),
+) if SEMCACHE else None
 
 
 @dataclass
@@ -31,167 +79,639 @@ class Para:
 
 
 _bm25 = None
-_paras: List[Para] = []
-_bm_tokens: List[List[str]] = []
-_built_at: float = 0.0
-
-_ws = re.compile(r"\s+")
-_tok_tr = re.compile(r"[^\wçğıöşüâîû]+", re.I)
-_tok_en = re.compile(r"[^\w]+", re.I)
+_spans: Optional[TokenSpans] = None  # token char offsets per row, for snippets
+_paras: Sequence[Para] = []  # list, or lexicon.ParagraphRows when mem-mapped
+_built_at: float = 0.0  # last time the index changed (rebuild or folded deltas)
+
+_row_of: Dict[int, int] = {}  # Paragraph pk → row in _paras / _bm25
+_aliases: Dict[int, List[str]] = {}  # row → URLs of the near-duplicates it stands for
+_docs: set = set()
+_index_bytes = 0  # estimated heap of the indexed rows (mem-mapped lexicon pages not included)
+_last_change = 0  # newest ParagraphChange id reflected in the index
+_checked_at = 0.0
+_compacted_at = 0.0
+_compacting = False
+_lex_built_at = 0.0  # built_at of the mem-mapped lexicon in use (0: built from the DB)
+_index_lock = threading.Lock()
+
+_pool: Optional[ThreadPoolExecutor] = None  # query encoder + dense search (BM25 runs on the request thread)
+_pool_slots: Optional[threading.BoundedSemaphore] = None
+_pool_pid = 0
+_pool_lock = threading.Lock()
 
 
 def _tok(s: str) -> List[str]:
-    s = s.lower()
-    is_tr = bool(re.search(r"[çğıöşüİı]", s))
-    s = (_tok_tr if is_tr else _tok_en).sub(" ", s)
-    return [t for t in _ws.split(s) if t]
+    return tokens(s)  # same tokenizer as the index rows and their snippet spans
 
 
-_tag = re.compile(r"<[^>]+>")
+def _para_of(p: Paragraph) -> Para:
+    return Para(
+        doc_id=str(p.doc_id),
+        title=p.title or (getattr(p.doc, "title", "") or ""),
+        url=p.url or (getattr(p.doc, "url", "") or ""),
+        text=p.text or "",
+    )
 
 
-def _highlight(text: str, qtok: List[str], width: int = 210) -> str:
-    if not text:
-        return ""
-    lo = text[: width * 2]
-    best, pos = 0, 0
-    tl = lo.lower()
-    for t in qtok[:6]:
-        i = tl.find(t)
-        if i >= 0:
-            sc = max(1, len(t))
-            if sc > best:
-                best, pos = sc, i
-    start = max(0, pos - width // 2)
-    end = min(len(lo), start + width)
-    snip = lo[start:end].strip()
-    if start > 0: snip = "… " + snip
-    if end < len(text): snip = snip + " …"
-    return snip
-
-
-def _split_paragraphs(html_or_text: str, max_len: int = 800) -> List[str]:
-    if not html_or_text:
-        return []
-    raw_parts = re.split(r"(?:</p>|<br\s*/?>|\n\s*\n)+", html_or_text, flags=re.I)
-    out: List[str] = []
-    for part in raw_parts:
-        txt = _tag.sub(" ", part)
-        txt = " ".join(txt.split())
-        if len(txt) < 40:
-            continue
-        while len(txt) > max_len:
-            cut = txt.rfind(".", 0, max_len)
-            if cut <= 0:
-                cut = txt.rfind(" ", 0, max_len)
-                if cut <= 0: break
-            out.append(txt[:cut + 1].strip())
-            txt = txt[cut + 1:].strip()
-        if txt:
-            out.append(txt)
-    return out
+def _row_bytes(para: Para, n_tokens: int) -> int:
+    return (sum(sys.getsizeof(v) for v in (para.doc_id, para.title, para.url, para.text))
+            + _ROW_BYTES + _TOKEN_BYTES * n_tokens)
 
 
-def _build_index(force: bool = False) -> None:
-    global _bm25, _paras, _bm_tokens, _built_at
-    if not force and _built_at and (time.time() - _built_at) < 600 and _paras:
-        return
+def _budget() -> int:
+    return int(INDEX_BUDGET_MB * 2 ** 20)
+
 
-    qs = Paragraph.objects.select_related("doc").order_by("doc_id", "order")
-    if MAX_DOCS > 0:
-        seen, rows = set(), []
-        for p in qs.iterator(chunk_size=1000):
-            rows.append(p)
-            seen.add(p.doc_id)
-            if len(seen) >= MAX_DOCS and p.order >= 2:
+def _stream_rows(budget: int) -> Iterator[Tuple[int, Para, Tuple[List[str], List[int], List[int]], int]]:
+    """
+    (pk, Para, (tokens, starts, ends), bytes) of indexable paragraphs in (doc, order) order,
+    read as slim value rows in ROW_CHUNK chunks. Whole documents only: the
+    first one that would take the estimate past `budget` (> 0) ends the stream.
+    """
+    qs = (Paragraph.objects.order_by("doc_id", "order")
+          .values_list("pk", "doc_id", "title", "url", "text", "doc__title", "doc__url"))
+    spent, doc, pending, cost = 0, None, [], 0
+    for pk, doc_id, title, url, text, doc_title, doc_url in qs.iterator(chunk_size=ROW_CHUNK):
+        if doc_id != doc:
+            if budget > 0 and spent and spent + cost > budget:
                 break
+            yield from pending
+            spent += cost
+            doc, pending, cost = doc_id, [], 0
+        if not (text or "").strip():
+            continue
+        para = Para(doc_id=str(doc_id), title=title or doc_title or "", url=url or doc_url or "", text=text)
+        spans = token_spans(text)
+        pending.append((pk, para, spans, _row_bytes(para, len(spans[0]))))
+        cost += pending[-1][3]
     else:
-        rows = list(qs)
-
-    _paras = [
-        Para(
-            doc_id=str(p.doc_id),
-            title=p.title or (getattr(p.doc, "title", "") or ""),
-            url=p.url or (getattr(p.doc, "url", "") or ""),
-            text=p.text or "",
-        )
-        for p in rows if (p.text or "").strip()
-    ]
-
-    _bm25, _bm_tokens = None, []
-    if BM25 is not None and _paras:
-        _bm_tokens = [_tok(p.text) for p in _paras]
-        _bm25 = BM25(_bm_tokens)
-    _built_at = time.time()
-
-
-def _search_bm25(q: str) -> Optional[np.ndarray]:
-    if _bm25 is None:
-        return None
-    qtok = _tok(q)
-    scores = np.asarray(_bm25.get_scores(qtok), dtype=np.float32)
-    if scores.size:
-        m = float(scores.max())
-        if m > 0:
-            scores = scores / m
-        return scores
-    return None
+        if not (budget > 0 and spent and spent + cost > budget):
+            yield from pending
+            return
+    left = qs.filter(doc_id__gte=doc)  # `doc` is the first document that didn't fit
+    log.warning("copilot: BM25 index stopped at %.0f MB (budget %.0f MB): %d paragraphs of %d documents left out",
+                spent / 2 ** 20, budget / 2 ** 20, left.count(), left.values("doc_id").distinct().count())
 
 
-def hybrid_search(q: str, k: int = 8, rrf_k: int = 60) -> List[Dict]:
+@dataclass
+class IndexBuild:
+    last_change: int  # newest ParagraphChange id the build reflects
+    bm25: object  # BM25 (with token_terms), None without scipy or rows
+    paras: List[Para]
+    pks: List[int]
+    nbytes: int  # estimate, see COPILOT_INDEX_BUDGET_MB
+    spans: Optional[TokenSpans]
+    aliases: Dict[int, List[str]]  # row → URLs of the near-duplicates left out for it
+    duplicates: int = 0
+
+
+def collect_index(dedupe: Optional[float] = None, budget_mb: Optional[float] = None) -> IndexBuild:
     """
-    Return list of {title,url,text?,snippet,score}
-    Hybrid = Reciprocal Rank Fusion of BM25 (DB paragraphs) + Dense (prebuilt corpus.jsonl/embeddings).
+    One streaming pass over the Paragraph table. Token lists go straight into
+    the index's compact arrays and are dropped row by row; their character
+    spans are kept next to the index's per-token term ids for snippets.
+    Near-duplicates (similarity >= `dedupe`, default DEDUPE_THRESHOLD) of an
+    earlier paragraph are skipped and their URLs recorded as its aliases.
+    Documents past `budget_mb` (default COPILOT_INDEX_BUDGET_MB, 0 = none) are left out.
     """
-    _build_index()
-    if not q or not q.strip():
-        return []
-
-    bm_scores = _search_bm25(q)
-    bm_pairs: List[Tuple[Dict, float]] = []
-    if bm_scores is not None:
-        order = np.argsort(-bm_scores)[: max(k * 4, 12)]
-        for idx in order:
-            p = _paras[int(idx)]
-            bm_pairs.append((
-                {"title": p.title or p.url, "url": p.url, "text": p.text},
-                float(bm_scores[int(idx)]),
-            ))
-
+    # changes logged after this point get folded on top (re-applying one is harmless)
+    last = ParagraphChange.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    threshold = DEDUPE_THRESHOLD if dedupe is None else dedupe
+    dups = NearDuplicates(threshold) if threshold > 0 else None
+    paras: List[Para] = []
+    aliases: Dict[int, List[str]] = {}
+    pks, starts, ends = array("q"), array("i"), array("i")
+    spent = skipped = 0
+
+    def tokens() -> Iterator[List[str]]:
+        nonlocal spent, skipped
+        budget = _budget() if budget_mb is None else int(budget_mb * 2 ** 20)
+        for pk, para, (toks, s, e), nbytes in _stream_rows(budget):
+            kept = dups.check(len(paras), toks) if dups is not None else None
+            if kept is not None:
+                skipped += 1
+                urls = aliases.setdefault(kept, [])
+                if para.url and para.url != paras[kept].url and para.url not in urls:
+                    urls.append(para.url)
+                continue
+            paras.append(para)
+            pks.append(pk)
+            starts.extend(s)
+            ends.extend(e)
+            spent += nbytes
+            yield toks
+
+    bm, spans = None, None
+    if BM25 is not None:
+        bm = BM25(tokens(), positions=True)
+        spans = TokenSpans(bm.token_ptr, bm.token_terms,
+                           np.frombuffer(starts, dtype=np.int32) if starts else np.empty(0, dtype=np.int32),
+                           np.frombuffer(ends, dtype=np.int32) if ends else np.empty(0, dtype=np.int32))
+    else:
+        for _ in tokens():
+            pass
+    if not paras:
+        bm, spans = None, None
+    if skipped:
+        log.info("copilot: %d near-duplicate paragraphs left out of the index", skipped)
+    return IndexBuild(last, bm, paras, pks.tolist(), spent, spans, {r: u for r, u in aliases.items() if u}, skipped)
+
+
+def _rebuild() -> None:
+    """Full rebuild from the database (exact IDF), swapped in when complete."""
+    global _bm25, _paras, _built_at, _row_of, _docs, _last_change, _checked_at, _compacted_at, _lex_built_at
+    global _index_bytes, _spans, _aliases
+    built = collect_index()
+
+    now = time.time()
+    with _index_lock:
+        _bm25, _paras, _spans, _aliases = built.bm25, built.paras, built.spans, built.aliases
+        _row_of = dict(zip(built.pks, range(len(built.pks))))
+        _docs = {p.doc_id for p in built.paras}
+        _index_bytes = built.nbytes
+        _last_change = built.last_change
+        _built_at = _checked_at = _compacted_at = now
+        _lex_built_at = 0.0
+    # prune old log rows but never the newest: a worker whose next row to fold is gone sees the gap and rebuilds
+    newest = ParagraphChange.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    ParagraphChange.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=2 * BM25_COMPACT),
+                                   id__lt=newest).delete()
+
+
+def _apply_changes() -> bool:
+    """
+    Fold ParagraphChange rows newer than _last_change into the live index:
+    changed/deleted paragraphs are masked out, current versions appended.
+    False means a full rebuild is needed instead ("reset" logged, rows after
+    _last_change already pruned, no index yet).
+    """
+    global _last_change, _built_at, _index_bytes
+    changes = list(ParagraphChange.objects.filter(id__gt=_last_change).order_by("id")
+                   .values_list("id", "paragraph_id", "op"))
+    if not changes:
+        return True  # pruning keeps the newest row, so an empty tail means nothing was logged since
+    if _bm25 is None or changes[0][0] != _last_change + 1 or any(op == "reset" for _, _, op in changes):
+        return False
+
+    latest: Dict[int, str] = {}
+    for _, pid, op in changes:
+        latest[pid] = op
+    upserts = [pid for pid, op in latest.items() if op == "upsert"]
+    fresh = {p.pk: p for p in Paragraph.objects.select_related("doc").filter(pk__in=upserts)}
+
+    with _index_lock:
+        bm = _bm25
+        moved = {pid: _row_of.pop(pid) for pid in latest if pid in _row_of}
+        dead = list(moved.values())
+        if dead:
+            bm.remove(dead)
+        budget = _budget()
+        add, paras, spans = [], [], []
+        for p in (fresh.get(pid) for pid in upserts):
+            if p is None or not (p.text or "").strip():
+                continue
+            if budget > 0 and _index_bytes >= budget and str(p.doc_id) not in _docs:
+                continue  # documents already indexed stay complete; new ones wait for room
+            para = _para_of(p)
+            add.append(p)
+            paras.append(para)
+            spans.append(token_spans(p.text))
+            _index_bytes += _row_bytes(para, len(spans[-1][0]))
+        if add:
+            first = len(_paras)
+            _paras.extend(paras)  # rows exist before the index can return them
+            bm.add([toks for toks, _, _ in spans])
+            for i, p in enumerate(add):
+                _row_of[p.pk] = first + i
+                if moved.get(p.pk) in _aliases:  # an edited paragraph keeps the duplicates it stood for
+                    _aliases[first + i] = _aliases.pop(moved[p.pk])
+                _docs.add(str(p.doc_id))
+                if _spans is not None:
+                    toks, starts, ends = spans[i]
+                    _spans.add(first + i, [bm.vocab.get(t) for t in toks], starts, ends)
+        _last_change = changes[-1][0]
+        _built_at = time.time()
+    return True
+
+
+def _load_lexicon() -> bool:
+    """
+    Mem-map the BM25 index published in the active snapshot; False if there is
+    none. Changes logged since it was exported are folded in on the next poll.
+    """
+    global _bm25, _paras, _built_at, _row_of, _docs, _last_change, _checked_at, _compacted_at, _lex_built_at
+    global _index_bytes, _spans, _aliases
+    if BM25 is None:
+        return False
     try:
-        dense_pairs = search_dense(q, k=max(k, 8))  # [(payload, score)]
+        loaded = lexicon.load(snapshot.current_dir(dense.BASE), Para)
     except Exception:
-        dense_pairs = []
+        log.exception("copilot: unreadable BM25 lexicon, building from the database")
+        return False
+    if loaded is None:
+        return False
+    bm, paras, pks, meta, spans = loaded
+    with _index_lock:
+        _bm25, _paras = bm, paras
+        # exports without span arrays: rows folded in later still get them, base rows fall back to scanning
+        _spans = spans or TokenSpans(np.zeros(1, dtype=np.int64), *(np.empty(0, dtype=np.int32),) * 3)
+        _row_of = dict(zip(pks.tolist(), range(len(pks))))
+        _aliases = {int(r): list(u) for r, u in (meta.get("aliases") or {}).items()}
+        _docs = set(paras.table.column("doc_id").to_pylist())
+        _index_bytes = 0  # shared page cache, not this worker's heap
+        _last_change = int(meta.get("last_change") or 0)
+        _lex_built_at = float(meta.get("built_at") or 0.0)
+        _checked_at = _lex_built_at  # as if polled at export time
+        _built_at = _compacted_at = time.time()
+    return True
+
+
+def _newer_lexicon() -> bool:
+    meta = lexicon.read_meta(snapshot.current_dir(dense.BASE)) if USE_LEXICON else None
+    return bool(meta) and float(meta.get("built_at") or 0.0) > _lex_built_at and float(meta["built_at"]) > _compacted_at
+
+
+def _compact_in_background() -> None:
+    global _compacting
+    try:
+        _rebuild()
+    except Exception:
+        log.exception("copilot: BM25 compaction failed, still serving the folded index")
+    finally:
+        _compacting = False
+        connection.close()
+
+
+def _build_index(force: bool = False) -> None:
+    """
+    Keep the BM25 index current. The first call mem-maps the snapshot's
+    lexicon (or builds from the database; force always does); afterwards
+    logged Paragraph changes are folded in every BM25_POLL seconds, and
+    compaction (a full rebuild) runs in a background thread while the folded
+    index keeps serving.
+    """
+    global _checked_at, _compacting
+    if force or (not _built_at and not (USE_LEXICON and _load_lexicon())):
+        _rebuild()
+        return
+    now = time.time()
+    if now - _checked_at < BM25_POLL:
+        return
+    if _newer_lexicon():
+        _load_lexicon()  # a newer copilot_lexindex export was published; fold on top of it
+    _checked_at = now
+
+    folded = _apply_changes()
+    if not folded and not _paras:
+        _rebuild()  # nothing to serve meanwhile
+        return
+    bm = _bm25
+    drifted = bm is not None and (bm.n_delta > 0 or not bm.alive.all())
+    due = (not folded
+           or drifted and now - _compacted_at >= BM25_COMPACT
+           or bm is not None and bm.n_delta > BM25_COMPACT_RATIO * max(1, bm.corpus_size))
+    if due and not _compacting:
+        _compacting = True
+        threading.Thread(target=_compact_in_background, name="copilot-bm25-compact", daemon=True).start()
+
 
-    # Reciprocal Rank Fusion
-    def key_of(payload: Dict) -> tuple[str, str]:
-        return ((payload.get("text") or "")[:80], payload.get("url") or "")
+BmHits = Tuple[np.ndarray, np.ndarray]  # (paragraph ids, max-normalized scores), best first
+# (fused row ids, RRF scores, corpus row of each id past the paragraph store): what the semantic cache keeps
+Ranking = Tuple[np.ndarray, np.ndarray, Dict[int, Dict]]
 
-    scores = defaultdict(float)
-    payloads: Dict[tuple[str, str], Dict] = {}
 
-    for rank, (pl, _) in enumerate(dense_pairs):
-        key = key_of(pl)
-        scores[key] += 1.0 / (rrf_k + rank + 1)
-        payloads[key] = pl
+def _normalized(hits: BmHits) -> BmHits:
+    ids, scores = hits
+    scores = scores.astype(np.float32)
+    if len(scores) and scores[0] > 0:
+        scores = scores / scores[0]
+    return ids, scores
 
-    for rank, (pl, _) in enumerate(bm_pairs):
-        key = key_of(pl)
-        scores[key] += 1.0 / (rrf_k + rank + 1)
-        payloads[key] = payloads.get(key) or pl
 
+def _search_bm25(q: str, k: int) -> Optional[BmHits]:
+    if _bm25 is None:
+        return None
+    return _normalized(_bm25.top_k(_tok(q), k))
+
+
+def _search_bm25_many(queries: Sequence[str], k: int) -> Optional[List[BmHits]]:
+    """_search_bm25 for a batch: one sparse (query × term) @ (term × doc) product."""
+    if _bm25 is None:
+        return None
+    return [_normalized(hits) for hits in _bm25.top_k_many([_tok(q) for q in queries], k)]
+
+
+def _bm25_depth(k: int) -> int:
+    return max(k * 4, 12)
+
+
+def _query_ids(qtok: List[str]) -> Optional[np.ndarray]:
+    bm = _bm25
+    if bm is None or _spans is None:
+        return None
+    return np.unique(np.asarray([i for i in (bm.vocab.get(t) for t in set(qtok)) if i is not None], dtype=np.int32))
+
+
+def _snippet(text: str, qtok: List[str], row: Optional[int] = None,
+             qids: Optional[np.ndarray] = None) -> Tuple[str, List[List[int]]]:
+    """
+    (snippet, highlight spans inside it). For an indexed row the query-term
+    positions come from its stored token spans; other text is tokenized once.
+    """
+    if not text:
+        return "", []
+    spans = _spans
+    if row is not None and qids is not None and spans is not None:
+        hits = spans.hits(row, qids)
+        if hits is not None:
+            return window(text, *hits)
+    toks, starts, ends = token_spans(text)
+    qset = set(qtok)
+    keep = [i for i, t in enumerate(toks) if t in qset]
+    return window(text, np.asarray(starts, dtype=np.int64)[keep], np.asarray(ends, dtype=np.int64)[keep])
+
+
+def _rrf(ranked: Sequence[np.ndarray], rrf_k: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k (ids, scores) of Reciprocal Rank Fusion over best-first id arrays:
+    one bincount over all ranks; ties keep the order ids were first seen in.
+    """
+    ranked = [r for r in ranked if len(r)]
+    if not ranked:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    ids = np.concatenate(ranked)
+    weights = np.concatenate([1.0 / (rrf_k + 1 + np.arange(len(r))) for r in ranked])
+    uniq, first, inv = np.unique(ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inv, weights=weights, minlength=len(uniq))
+    top = np.lexsort((first, -scores))[:k]
+    return uniq[top], scores[top]
+
+
+def _rank(k: int, rrf_k: int, bm_hits: Optional[BmHits], dense_hits: Optional[dense.DenseHits]) -> Ranking:
+    """
+    Reciprocal Rank Fusion of one query's BM25 hits and dense hits → top-k ranking.
+    Both sides are keyed by row in the paragraph store (_paras): dense rows
+    through their Paragraph id; ones the store doesn't hold are keyed past its end
+    and their corpus rows come along, since a later snapshot may not have them.
+    """
+    row_of = _row_of
+    n = len(_paras)
+    ranked: List[np.ndarray] = []
+    if dense_hits is not None and len(dense_hits.rows):
+        ids = np.fromiter((row_of.get(pid, -1) for pid in dense_hits.pids.tolist()), dtype=np.int64,
+                          count=len(dense_hits.pids))
+        ranked.append(np.where(ids >= 0, ids, n + dense_hits.rows))
+    if bm_hits is not None:
+        ranked.append(np.asarray(bm_hits[0], dtype=np.int64))
+    top, scores = _rrf(ranked, rrf_k, k)
+
+    outside = top[top >= n]
+    extra = dict(zip(outside.tolist(), rows_of(dense_hits.corpus, outside - n))) if len(outside) else {}
+    return top, scores, extra
+
+
+def _items(q: str, ranking: Ranking) -> List[Dict]:
+    """Result items of a ranking, snippets and highlights cut for `q`; only the ranked rows become payloads."""
+    top, scores, extra = ranking
+    paras, aliases = _paras, _aliases
+    n = len(paras)
     qtok = _tok(q)
+    qids = _query_ids(qtok) if len(extra) < len(top) else None
     items: List[Dict] = []
-    for key, sc in sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]:
-        pl = payloads[key]
-        text = pl.get("text") or ""
+    for i, sc in zip(top.tolist(), scores.tolist()):
+        if i < n:
+            p = paras[i]
+            title, url, text, row, also = p.title, p.url, p.text or "", i, aliases.get(i) or []
+        else:
+            pl = extra[i]
+            title, url, text, row = pl.get("title"), pl.get("url") or "", pl.get("text") or "", None
+            also = pl.get("aliases") or []
+        snippet, marks = _snippet(text, qtok, row, qids)
         items.append({
-            "title": pl.get("title") or pl.get("url") or "Result",
-            "url": pl.get("url") or "",
+            "title": title or url or "Result",
+            "url": url,
+            "aliases": list(also),  # URLs of near-duplicate paragraphs folded into this one
             "text": text,
-            "snippet": _highlight(text, qtok),
+            "snippet": snippet,
+            "highlights": marks,  # [start, end) of query terms in snippet
             "score": round(float(sc), 4),
         })
-        if len(items) >= k:
-            break
     return items
+
+
+def _executor() -> Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    """
+    The dense pool of this process and the slots of its in-flight jobs
+    (threads don't survive a gunicorn --preload fork, nor do the jobs holding slots).
+    """
+    global _pool, _pool_slots, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=DENSE_POOL_SIZE, thread_name_prefix="copilot-dense")
+                _pool_slots = threading.BoundedSemaphore(DENSE_POOL_SIZE)
+                _pool_pid = os.getpid()
+    return _pool, _pool_slots
+
+
+def _submit_dense(fn, *args) -> Optional[Future]:
+    """
+    Run `fn` on the dense pool if one of its slots is free, else None. Jobs
+    that outlive their call's deadline keep their slot until they finish, so
+    once slow ones hold them all new calls go without instead of queueing.
+    """
+    pool, slots = _executor()
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        job = pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    job.add_done_callback(lambda _: slots.release())
+    return job
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def _left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until `deadline` (perf_counter time; None = no deadline), never negative."""
+    return None if deadline is None else max(0.0, deadline - time.perf_counter())
+
+
+def _dense_job(q: str, k: int, encoded: Optional[Future] = None) -> Tuple[dense.DenseHits, float]:
+    """
+    (dense hits, ms) for `q`. With `encoded`, the query vector is set on it
+    as soon as it exists, for the semantic cache lookup to use while the
+    search itself still runs.
+    """
+    t0 = time.perf_counter()
+    qv = None
+    if encoded is not None:
+        try:
+            qv = dense.encode_query(q)
+        except BaseException as e:
+            encoded.set_exception(e)
+            raise
+        encoded.set_result(qv)
+    return search_dense_hits(q, k=k, qv=qv), (time.perf_counter() - t0) * 1000.0
+
+
+def _lookup(q: str, params: Tuple, version: Tuple, encoded: Optional[Future], deadline: Optional[float],
+            stats: Dict) -> Tuple[Optional[np.ndarray], Optional[Ranking]]:
+    """
+    (query vector, cached ranking) from the semantic cache, waiting for the
+    vector at most half of what is left of the budget; a slower (or busy)
+    encoder skips the lookup.
+    """
+    if encoded is None:
+        stats["skipped"].append("semcache")
+        return None, None
+    left = _left(deadline)
+    done, _ = wait([encoded], timeout=None if left is None else left / 2)
+    if not done:
+        stats["skipped"].append("semcache")
+        return None, None
+    try:
+        qv = encoded.result()
+    except Exception:
+        return None, None  # no encoder: nothing to compare meanings with (the dense side reports it)
+    return qv, _semcache.get(qv, params, version)
+
+
+def _run(name: str, fn, stats: Dict, deadline: Optional[float], *args):
+    """`fn(*args)` on this thread, its ms in stats; None (and the name in timed_out / failed) if it didn't run."""
+    if deadline is not None and time.perf_counter() >= deadline:
+        stats["timed_out"].append(name)  # one stage at a time: the budget went on the ones before
+        return None
+    try:
+        out, stats[f"{name}_ms"] = _timed(fn, *args)
+        return out
+    except Exception:
+        log.warning("copilot: %s retriever failed", name, exc_info=True)
+        stats["failed"].append(name)
+        return None
+
+
+def hybrid_search(q: str, k: int = 8, rrf_k: int = 60, stats: Optional[Dict] = None,
+                  budget_ms: Optional[float] = None) -> List[Dict]:
+    """
+    Return list of {title,url,text?,snippet,highlights,score}
+    Hybrid = Reciprocal Rank Fusion of BM25 (DB paragraphs) + Dense (prebuilt corpus.jsonl/embeddings).
+
+    BM25 runs on the calling thread while the query encoder and the dense
+    search run on the dense pool (unless PARALLEL is off). `budget_ms` bounds
+    the wait for them (default COPILOT_RETRIEVER_TIMEOUT_MS, <= 0 for none);
+    results come from whichever finished in time.
+
+    A dict passed as `stats` is filled with:
+      cached      the semantic cache answered
+      skipped     stages that contributed nothing ("bm25", "dense", "semcache")
+      timed_out   retrievers that missed the deadline
+      failed      retrievers that raised
+      busy        retrievers that found every dense slot taken
+      bm25_ms, dense_ms, retrieve_ms, fuse_ms, total_ms   per-stage timings
+    """
+    t0 = time.perf_counter()
+    stats = {} if stats is None else stats
+    stats.update(cached=False, skipped=[], timed_out=[], failed=[], busy=[])
+    budget_ms = RETRIEVER_TIMEOUT_MS if budget_ms is None else budget_ms
+    deadline = t0 + budget_ms / 1000.0 if budget_ms > 0 else None
+    _build_index()
+    if not q or not q.strip():
+        return []
+
+    params, version = (k, rrf_k), (dense.index_version(), _built_at)
+    encoded = Future() if _semcache is not None else None
+    qv = cached = dense_hits = job = None
+    t1 = time.perf_counter()
+    if PARALLEL:
+        # one slot per query: encode, publish the vector, search; BM25 and the cache lookup overlap with it
+        job = _submit_dense(_dense_job, q, max(k, 8), encoded)
+        if job is None:
+            stats["busy"].append("dense")
+            encoded = None
+        bm_hits = _run("bm25", _search_bm25, stats, deadline, q, _bm25_depth(k))
+        if _semcache is not None:
+            qv, cached = _lookup(q, params, version, encoded, deadline, stats)
+    else:
+        if encoded is not None:
+            try:
+                encoded.set_result(dense.encode_query(q))
+            except Exception as e:
+                encoded.set_exception(e)
+            qv, cached = _lookup(q, params, version, encoded, deadline, stats)
+        bm_hits = None if cached is not None else _run("bm25", _search_bm25, stats, deadline, q, _bm25_depth(k))
+        if cached is None:
+            dense_hits = _run("dense", lambda: search_dense_hits(q, k=max(k, 8), qv=qv), stats, deadline)
+    if cached is not None:  # a paraphrase's ranking: snippets and highlights are cut for this query
+        items = _items(q, cached)
+        stats["cached"] = True
+        stats["total_ms"] = (time.perf_counter() - t0) * 1000.0
+        return items
+
+    if job is not None:
+        done, _ = wait([job], timeout=_left(deadline))
+        if not done:
+            stats["timed_out"].append("dense")  # finishes in the background, keeping its slot until then
+        else:
+            try:
+                dense_hits, stats["dense_ms"] = job.result()
+            except Exception:
+                log.warning("copilot: dense retriever failed", exc_info=True)
+                stats["failed"].append("dense")
+    stats["retrieve_ms"] = (time.perf_counter() - t1) * 1000.0
+    stats["timed_out"], stats["failed"] = sorted(stats["timed_out"]), sorted(stats["failed"])
+    if stats["timed_out"]:
+        log.warning("copilot: %s missed the deadline", ", ".join(stats["timed_out"]))
+    partial = set(stats["timed_out"]) | set(stats["failed"]) | set(stats["busy"])
+    stats["skipped"] = sorted(set(stats["skipped"]) | partial)
+    t2 = time.perf_counter()
+    ranking = _rank(k, rrf_k, bm_hits, dense_hits)
+    items = _items(q, ranking)
+    stats["fuse_ms"] = (time.perf_counter() - t2) * 1000.0
+    if qv is not None and not partial:  # don't pin a partial answer in the cache
+        _semcache.put(qv, params, version, ranking)
+    stats["total_ms"] = (time.perf_counter() - t0) * 1000.0
+    return items
+
+
+def hybrid_search_many(queries: Sequence[str], k: int = 8, rrf_k: int = 60) -> List[List[Dict]]:
+    """
+    hybrid_search for a list of queries (offline eval, cache warming): one
+    encoder batch + score matrix for the dense side, one pass per distinct
+    term for BM25. Results both retrievers contributed to also seed the semantic cache.
+    """
+    _build_index()
+    out: List[List[Dict]] = [[] for _ in queries]
+    live = [i for i, q in enumerate(queries) if q and q.strip()]
+    if not live:
+        return out
+    qs = [queries[i] for i in live]
+
+    bm = _search_bm25_many(qs, _bm25_depth(k))
+    qvs = None
+    try:
+        qvs = dense.encode_queries(qs)
+        dense_many = search_dense_hits_many(qs, k=max(k, 8), qvs=qvs)
+    except Exception:
+        log.warning("copilot: dense retriever failed", exc_info=True)
+        dense_many = [None] * len(qs)
+
+    params, version = (k, rrf_k), (dense.index_version(), _built_at)
+    for j, i in enumerate(live):
+        ranking = _rank(k, rrf_k, bm[j] if bm is not None else None, dense_many[j])
+        out[i] = _items(qs[j], ranking)
+        complete = bm is not None and dense_many[j] is not None  # don't pin a partial answer in the cache
+        if qvs is not None and _semcache is not None and complete:
+            _semcache.put(qvs[j], params, version, ranking)
+    return out
+
+
+def semantic_cache_stats() -> Dict:
+    """Hit rate etc. of the hybrid_search semantic cache (each hit skips an encoder + BM25 + fusion pass)."""
+    return _semcache.stats() if _semcache is not None else {}
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Result cache keyed by query *meaning*: a lookup hits when a cached query
+    vector has cosine ≥ `threshold` with the new one (same params, same index
+    version, not older than `ttl` seconds). Fixed number of slots, LRU eviction;
+    a lookup is one (slots × d) mat-vec. Results are handed back as stored,
+    to every query that hits them: cache values nobody mutates.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 600.0, max_items: int = 512):
+        self.threshold = float(threshold)
+        self.ttl = float(ttl)
+        self.max_items = int(max(1, max_items))
+        self._lock = threading.Lock()
+        self._vecs: Optional[np.ndarray] = None
+        self._valid = np.zeros(self.max_items, dtype=bool)
+        self._expires = np.zeros(self.max_items, dtype=np.float64)
+        self._used = np.zeros(self.max_items, dtype=np.float64)
+        self._params: List[Hashable] = [None] * self.max_items
+        self._results: List[Any] = [None] * self.max_items
+        self._version: Hashable = None
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _check_version(self, version: Hashable) -> None:
+        if version != self._version:
+            if self._valid.any():
+                self._stats["invalidations"] += 1
+            self._valid[:] = False
+            self._results = [None] * self.max_items
+            self._version = version
+
+    def get(self, qv: np.ndarray, params: Hashable, version: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            live = self._valid & (self._expires > now)
+            if self._vecs is not None and live.any() and self._vecs.shape[1] == qv.shape[0]:
+                slots = np.flatnonzero(live)
+                slots = slots[[self._params[i] == params for i in slots]]
+                if len(slots):
+                    sims = self._vecs[slots] @ qv
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        slot = int(slots[best])
+                        self._used[slot] = now
+                        self._stats["hits"] += 1
+                        return self._results[slot]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, qv: np.ndarray, params: Hashable, version: Hashable, result: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            if self._vecs is None or self._vecs.shape[1] != qv.shape[0]:
+                self._vecs = np.zeros((self.max_items, qv.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+            free = np.flatnonzero(~self._valid | (self._expires <= now))
+            slot = int(free[0]) if len(free) else int(np.argmin(self._used))
+            self._vecs[slot] = qv
+            self._valid[slot] = True
+            self._expires[slot] = now + self.ttl
+            self._used[slot] = now
+            self._params[slot] = params
+            self._results[slot] = result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._valid[:] = False
+            self._results = [None] * self.max_items
+
+    def stats(self) -> Dict[str, Any]:
+        hits, misses = self._stats["hits"], self._stats["misses"]
+        return {
+            **self._stats,
+            "size": int(self._valid.sum()),
+            "max_items": self.max_items,
+            "threshold": self.threshold,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        }
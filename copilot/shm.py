@@ -0,0 +1,170 @@
+"""
+Share read-only index arrays between gunicorn workers.
+
+share(key, arrays) copies the arrays into one named SharedMemory segment the
+first time any process asks for `key` (the --preload master, or whichever
+worker gets there first) and every later caller attaches to it zero-copy.
+Segments outlive the process that created them; release(key) unlinks one
+once a newer snapshot is live.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import struct
+import sys
+import time
+from collections.abc import Sequence
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_READY = b"BMBSHM01"
+_ALIGN = 64
+_HEAD = struct.Struct("<8sQ")  # ready magic, directory length
+WAIT_S = 10.0
+
+_segments: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _name(key: str) -> str:
+    # POSIX shm names are short on some platforms (31 chars on macOS)
+    return "bmb_" + hashlib.blake2b(key.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def _layout(arrays: Dict[str, np.ndarray]) -> tuple[bytes, List[tuple], int]:
+    entries, offset = [], 0
+    for name, arr in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        entries.append((name, arr.dtype.str, list(arr.shape), offset))
+        offset += int(arr.nbytes)
+    directory = json.dumps(entries).encode("utf-8")
+    data_start = -(-(_HEAD.size + len(directory)) // _ALIGN) * _ALIGN
+    return directory, [(n, d, s, o + data_start) for n, d, s, o in entries], data_start + offset
+
+
+# Python < 3.13 has no track=False: the resource tracker would unlink every
+# segment when the process that created *or attached* it exits.
+_HAS_TRACK = sys.version_info >= (3, 13)
+
+
+def _track(seg: shared_memory.SharedMemory, on: bool) -> None:
+    if _HAS_TRACK:
+        return
+    try:
+        from multiprocessing import resource_tracker
+        (resource_tracker.register if on else resource_tracker.unregister)(seg._name, "shared_memory")  # type: ignore[attr-defined]
+    except Exception:
+        pass
+
+
+def _open(name: str, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    if _HAS_TRACK:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    seg = shared_memory.SharedMemory(name=name, create=create, size=size)
+    _track(seg, False)
+    return seg
+
+
+def _views(seg: shared_memory.SharedMemory, entries: List[tuple]) -> Dict[str, np.ndarray]:
+    out = {}
+    for name, dtype, shape, offset in entries:
+        arr = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=seg.buf, offset=offset)
+        arr.flags.writeable = False
+        out[name] = arr
+    return out
+
+
+def share(key: str, arrays: Dict[str, np.ndarray]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Read-only views of `arrays` backed by the shared segment for `key`, or None
+    if shared memory is unavailable (callers then keep their private arrays).
+    The arrays only need to be materialized by the process that creates it;
+    attachers can pass mem-mapped inputs, only shapes/dtypes are read.
+    """
+    arrays = {k: v for k, v in arrays.items() if v is not None}
+    directory, entries, size = _layout(arrays)
+    name = _name(key)
+
+    seg = _segments.get(name)
+    if seg is not None:
+        return _views(seg, entries)
+
+    try:
+        seg = _open(name, create=True, size=max(1, size))
+        created = True
+    except FileExistsError:
+        seg = _open(name, create=False)
+        created = False
+    except Exception:
+        return None
+
+    try:
+        if created:
+            seg.buf[_HEAD.size:_HEAD.size + len(directory)] = directory
+            for (_, _, _, offset), arr in zip(entries, arrays.values()):
+                dst = np.ndarray(arr.shape, dtype=arr.dtype, buffer=seg.buf, offset=offset)
+                dst[...] = arr
+                del dst
+            seg.buf[:_HEAD.size] = _HEAD.pack(_READY, len(directory))
+        else:
+            deadline = time.monotonic() + WAIT_S
+            while bytes(seg.buf[:8]) != _READY:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"shared segment {name} never became ready")
+                time.sleep(0.01)
+            _, dlen = _HEAD.unpack(bytes(seg.buf[:_HEAD.size]))
+            if bytes(seg.buf[_HEAD.size:_HEAD.size + dlen]) != directory:
+                raise ValueError(f"shared segment {name} holds different arrays")
+    except Exception:
+        seg.close()
+        if created:  # a half-written segment would make every later caller wait for _READY, then give up
+            try:
+                _track(seg, True)  # SharedMemory.unlink() unregisters it again
+                seg.unlink()
+            except Exception:
+                pass
+        return None
+
+    _segments[name] = seg
+    return _views(seg, entries)
+
+
+def release(key: str) -> None:
+    """Unlink the segment for `key` (mappings already attached stay valid)."""
+    name = _name(key)
+    seg = _segments.pop(name, None)
+    try:
+        seg = seg or _open(name, create=False)
+        _track(seg, True)  # SharedMemory.unlink() unregisters it again
+        seg.unlink()
+    except Exception:
+        pass
+
+
+# --- corpus payloads ------------------------------------------------------------
+def line_offsets(blob: np.ndarray) -> np.ndarray:
+    """(start, end) byte spans of every non-empty line in a JSONL buffer."""
+    nl = np.flatnonzero(blob == ord("\n"))
+    starts = np.concatenate([[0], nl + 1])
+    ends = np.concatenate([nl, [len(blob)]])
+    keep = ends > starts
+    return np.stack([starts[keep], ends[keep]], axis=1).astype(np.int64)
+
+
+class PackedCorpus(Sequence):
+    """corpus.jsonl bytes + line offsets; rows are parsed only when indexed."""
+
+    def __init__(self, blob: np.ndarray, spans: np.ndarray):
+        self.blob = blob
+        self.spans = spans
+
+    def __len__(self) -> int:
+        return int(self.spans.shape[0])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        s, e = self.spans[i]
+        return json.loads(self.blob[s:e].tobytes().decode("utf-8"))
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Paragraph, ParagraphChange
+
+_local = threading.local()
+
+
+@contextmanager
+def muted() -> Iterator[None]:
+    """Skip per-row change logging on this thread; bulk writers log their changes themselves."""
+    prev = getattr(_local, "muted", False)
+    _local.muted = True
+    try:
+        yield
+    finally:
+        _local.muted = prev
+
+
+@receiver(post_save, sender=Paragraph, dispatch_uid="copilot_paragraph_saved")
+def paragraph_saved(sender, instance: Paragraph, **kw) -> None:
+    if not getattr(_local, "muted", False):
+        ParagraphChange.objects.create(paragraph_id=instance.pk, op="upsert")
+
+
+@receiver(post_delete, sender=Paragraph, dispatch_uid="copilot_paragraph_deleted")
+def paragraph_deleted(sender, instance: Paragraph, **kw) -> None:
+    if not getattr(_local, "muted", False):
+        ParagraphChange.objects.create(paragraph_id=instance.pk, op="delete")
@@ -0,0 +1,184 @@
+"""
+Versioned index snapshots under COPILOT_INDEX_DIR.
+
+    copilot_index/
+      CURRENT                 ← name of the active version (swapped with os.replace)
+      v20251012T101500123/
+        manifest.json         ← rows, dim, model, per-file bytes + sha256
+        corpus.jsonl
+        embeddings.npy
+        ...
+
+Builders write into a hidden staging dir and only rename + flip CURRENT once
+every file and the manifest are on disk, so readers never see a mix of
+versions. A base dir without CURRENT is the legacy flat layout and is
+still served as-is.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from copilot import corpus
+
+CURRENT = "CURRENT"
+MANIFEST = "manifest.json"
+KEEP = int(os.getenv("COPILOT_SNAPSHOT_KEEP", "3") or 3)
+
+# never carried over from the flat layout / previous versions
+_SKIP = {CURRENT, MANIFEST, "qcache.bin"}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def current_version(base: Path) -> str:
+    try:
+        return (base / CURRENT).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ""
+
+
+def current_dir(base: Path) -> Path:
+    version = current_version(base)
+    if version and (base / version).is_dir():
+        return base / version
+    return base
+
+
+def versions(base: Path) -> List[str]:
+    if not base.exists():
+        return []
+    return sorted(p.name for p in base.iterdir() if p.is_dir() and p.name.startswith("v")
+                  and (p / MANIFEST).exists())
+
+
+def read_manifest(path: Path) -> Optional[Dict]:
+    try:
+        return json.loads((path / MANIFEST).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def describe(path: Path, model: str = "") -> Dict:
+    """Build the manifest dict for the files currently in `path`."""
+    rows, dim = corpus.count_rows(path), None
+    if (path / "corpus.jsonl").exists() and (path / corpus.ARROW_NAME).exists():
+        with (path / "corpus.jsonl").open("rb") as f:
+            jsonl_rows = sum(1 for line in f if line.strip())
+        if rows is not None and jsonl_rows != rows:
+            raise SnapshotError(f"corpus.jsonl has {jsonl_rows} rows but corpus.arrow has {rows}")
+    if (path / "embeddings.npy").exists():
+        shape = np.load(path / "embeddings.npy", mmap_mode="r").shape
+        dim = int(shape[1])
+        if rows is not None and int(shape[0]) != rows:
+            raise SnapshotError(f"corpus has {rows} rows but embeddings.npy has {shape[0]}")
+        rows = int(shape[0]) if rows is None else rows
+    files = {
+        p.name: {"bytes": p.stat().st_size, "sha256": _sha256(p)}
+        for p in sorted(path.iterdir()) if p.is_file() and p.name not in _SKIP
+    }
+    return {
+        "version": path.name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "rows": rows,
+        "dim": dim,
+        "model": model,
+        "files": files,
+    }
+
+
+def validate(path: Path, manifest: Dict, checksums: bool = False) -> None:
+    """Raise SnapshotError unless every file listed in the manifest is there at its size (and hash, if `checksums`)."""
+    for name, meta in (manifest.get("files") or {}).items():
+        p = path / name
+        if not p.exists():
+            raise SnapshotError(f"{path.name}: missing {name}")
+        if p.stat().st_size != meta.get("bytes"):
+            raise SnapshotError(f"{path.name}: {name} is {p.stat().st_size} bytes, manifest says {meta.get('bytes')}")
+        if checksums and meta.get("sha256") and _sha256(p) != meta["sha256"]:
+            raise SnapshotError(f"{path.name}: checksum mismatch for {name}")
+
+
+def activate(base: Path, version: str) -> None:
+    """Atomically point CURRENT at `version`."""
+    if not (base / version / MANIFEST).exists():
+        raise SnapshotError(f"{version} is not a complete snapshot")
+    tmp = base / f".{CURRENT}.{os.getpid()}.tmp"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, base / CURRENT)
+
+
+def prune(base: Path, keep: int = KEEP) -> List[str]:
+    """Delete all but the newest `keep` versions (never the active one)."""
+    active = current_version(base)
+    old = [v for v in versions(base) if v != active][: -max(0, keep - 1) or None]
+    for v in old:
+        shutil.rmtree(base / v, ignore_errors=True)
+    return old
+
+
+def _new_version() -> str:
+    now = time.time()
+    return time.strftime("v%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now * 1000) % 1000:03d}"
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+@contextmanager
+def stage(base: Path, model: str = "", inherit: bool = True, drop: tuple = ()) -> Iterator[Path]:
+    """
+    Yield a staging dir for a new version; activate it if the block succeeds.
+
+    inherit=True starts from the files of the active version (hard links, so
+    it is free); names in `drop` (or matching a `prefix*` entry) are left out.
+    Writers must replace files (tmp + os.replace), never modify them in place.
+    """
+    base.mkdir(parents=True, exist_ok=True)
+    version = _new_version()
+    while (base / version).exists() or (base / f".{version}.tmp").exists():
+        time.sleep(0.001)
+        version = _new_version()
+    tmp = base / f".{version}.tmp"
+    tmp.mkdir()
+    try:
+        if inherit:
+            src = current_dir(base)
+            for p in src.iterdir():
+                if not p.is_file() or p.name in _SKIP or p.name.startswith("."):
+                    continue
+                if any(p.name == d or (d.endswith("*") and p.name.startswith(d[:-1])) for d in drop):
+                    continue
+                _link_or_copy(p, tmp / p.name)
+        yield tmp
+        manifest = describe(tmp, model=model)
+        manifest["version"] = version
+        (tmp / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.rename(tmp, base / version)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    activate(base, version)
+    prune(base)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_word = re.compile(r"\w+")
+
+Spans = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (term ids, char starts, char ends) of a paragraph's tokens
+
+
+def _fold(word: str) -> str:
+    # "İ".lower() is "i" + U+0307 (combining dot above); fold it to a plain "i" so "İstanbul" is "istanbul"
+    lo = word.lower()
+    return lo.replace("\u0307", "") if len(lo) != len(word) else lo
+
+
+def tokens(text: str) -> List[str]:
+    """The index's tokens of `text`: runs of word characters, lowercased (the BM25 side of every query)."""
+    return [_fold(w) for w in _word.findall(text)]
+
+
+def token_spans(text: str) -> Tuple[List[str], List[int], List[int]]:
+    """tokens(text) with the character span of each in `text`."""
+    ms = list(_word.finditer(text))
+    return [_fold(m.group()) for m in ms], [m.start() for m in ms], [m.end() for m in ms]
+
+
+class TokenSpans:
+    """
+    Character span of every indexed token, laid out like SparseBM25.token_terms
+    (row r is [ptr[r], ptr[r + 1])), so where the query terms occur in a
+    paragraph comes from its term ids instead of rescanning its text. Rows
+    folded in after the build are kept per row in `extra`.
+    """
+
+    def __init__(self, ptr: np.ndarray, terms: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.ptr, self.terms, self.starts, self.ends = ptr, terms, starts, ends
+        self.extra: Dict[int, Spans] = {}
+
+    @property
+    def n_base(self) -> int:
+        return len(self.ptr) - 1
+
+    def add(self, row: int, terms: Sequence[int], starts: Sequence[int], ends: Sequence[int]) -> None:
+        self.extra[row] = (np.asarray(terms, dtype=np.int32), np.asarray(starts, dtype=np.int32),
+                           np.asarray(ends, dtype=np.int32))
+
+    def row(self, row: int) -> Optional[Spans]:
+        if row < self.n_base:
+            s, e = self.ptr[row], self.ptr[row + 1]
+            return self.terms[s:e], self.starts[s:e], self.ends[s:e]
+        return self.extra.get(row)
+
+    def hits(self, row: int, qids: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (starts, ends) of the tokens of `row` whose term is in `qids` (sorted,
+        unique), in text order; None if the row has no spans.
+        """
+        spans = self.row(row)
+        if spans is None:
+            return None
+        terms, starts, ends = spans
+        if not len(qids):
+            return starts[:0], ends[:0]
+        at = np.minimum(np.searchsorted(qids, terms), len(qids) - 1)
+        keep = qids[at] == terms
+        return starts[keep], ends[keep]
+
+
+def window(text: str, starts: np.ndarray, ends: np.ndarray, width: int = 210) -> Tuple[str, List[List[int]]]:
+    """
+    Snippet of about `width` characters around the densest run of hits, and
+    the hit spans inside it ([start, end) offsets into the snippet).
+    """
+    start = 0
+    if len(starts):
+        lo = np.maximum((starts + ends) // 2 - width // 2, 0)
+        covered = np.searchsorted(ends, lo + width, side="right") - np.searchsorted(starts, lo, side="left")
+        start = int(lo[int(np.argmax(covered))])
+    end = min(len(text), start + width)
+    raw = text[start:end]
+    body = raw.strip()
+    shift = -(len(raw) - len(raw.lstrip()))
+    snip = body
+    if start > 0:
+        snip, shift = "… " + snip, shift + 2
+    if end < len(text):
+        snip = snip + " …"
+    inside = (starts >= start) & (ends <= end)
+    marks = [[int(s) - start + shift, int(e) - start + shift] for s, e in zip(starts[inside], ends[inside])]
+    return snip, [m for m in marks if m[0] >= 0 and m[1] <= len(snip)]
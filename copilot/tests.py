@@ -1,3 +1,946 @@
-from django.test import TestCase
+import os
 
-# Create your tests here.
+import numpy as np
+import pytest
+
+from copilot.quant import VectorStore, quantize, recall_report
+
+
+def _unit_rows(n=300, d=64, seed=0):
+    rng = np.random.default_rng(seed)
+    v = rng.normal(size=(n, d)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode", ["float16", "int8"])
+def test_quantized_scores_track_float32(mode):
+    vecs = _unit_rows()
+    ref = VectorStore(vecs)
+    arrays = quantize(vecs, mode)
+    cand = VectorStore(arrays["vecs"], mode=mode, scale=arrays.get("scale"), norms=arrays["norms"])
+
+    q = vecs[:3]
+    assert np.allclose(ref.scores(q), cand.scores(q), atol=2e-2)
+    assert np.allclose(cand.scores(q[0], rows=np.array([5, 7])), cand.scores(q[0])[[5, 7]])
+
+    report = recall_report(ref, cand, k=10, n_queries=50)
+    assert report["recall_at_k"] >= 0.9
+    assert report["compression"] > 1.9
+
+
+def test_quantize_report_rewrite_leaves_the_previous_snapshot_intact(tmp_path):
+    from copilot import snapshot
+    from copilot.quant import write_report
+
+    for k in (10, 100):  # the second run stages a hard link to the first report, then rewrites it
+        with snapshot.stage(tmp_path) as staged:
+            write_report(staged, {"mode": "int8", "k": k})
+    old, new = snapshot.versions(tmp_path)
+    snapshot.validate(tmp_path / old, snapshot.read_manifest(tmp_path / old), checksums=True)
+    assert '"k": 10' in (tmp_path / old / "embeddings.i8.report.json").read_text(encoding="utf-8")
+
+
+class _FakeModel:
+    """Deterministic stand-in for SentenceTransformer.encode (hash-seeded unit vectors)."""
+
+    def __init__(self, dim=16):
+        self.dim = dim
+        self.calls = 0
+
+    def encode(self, texts, **kw):
+        self.calls += 1
+        out = []
+        for t in texts:
+            rng = np.random.default_rng(abs(hash(t)) % (2 ** 32))
+            v = rng.normal(size=self.dim).astype(np.float32)
+            out.append(v / np.linalg.norm(v))
+        return np.stack(out)
+
+
+@pytest.fixture
+def dense_index(monkeypatch, tmp_path):
+    """copilot.dense on an empty index dir (tmp_path, returned) with the fake encoder and no FAISS."""
+    from copilot import dense
+
+    monkeypatch.setattr(dense, "BASE", tmp_path)
+    monkeypatch.setattr(dense, "faiss", None)
+    monkeypatch.setattr(dense, "_model", _FakeModel())
+    monkeypatch.setattr(dense, "_snap", None)
+    monkeypatch.setattr(dense, "_qcache", dense.OrderedDict())  # vectors of another test's encoder
+    return tmp_path
+
+
+@pytest.fixture
+def bm25_index(monkeypatch):
+    """copilot.retrieval rebuilding BM25 from the test DB on the next query: no poll interval, no lexicon
+    snapshot, and compaction left to the test."""
+    from copilot import retrieval
+
+    monkeypatch.setattr(retrieval, "BM25_POLL", 0)
+    monkeypatch.setattr(retrieval, "_built_at", 0.0)
+    monkeypatch.setattr(retrieval, "_lex_built_at", 0.0)
+    monkeypatch.setattr(retrieval, "_compact_in_background", lambda: None)
+    monkeypatch.setattr(retrieval, "USE_LEXICON", False)
+    return retrieval
+
+
+def test_query_cache_lru_and_disk_tier(monkeypatch, tmp_path):
+    from copilot import dense
+    from copilot.qcache import DiskQueryCache
+
+    model = _FakeModel()
+    monkeypatch.setattr(dense, "_model", model)
+    monkeypatch.setattr(dense, "_qcache", dense.OrderedDict())
+    monkeypatch.setattr(dense, "_qstats", {"hits": 0, "disk_hits": 0, "misses": 0})
+    monkeypatch.setattr(dense, "QCACHE_SIZE", 2)
+    monkeypatch.setattr(dense, "_qcache_disk", DiskQueryCache(tmp_path / "qcache.bin", slots=64, salt="m"))
+    monkeypatch.setattr(dense, "QCACHE_DISK", True)
+
+    v1 = dense.encode_query("What is  Bambicim?")
+    assert np.allclose(v1, _FakeModel().encode(["What is Bambicim?"])[0])  # whitespace folded, case kept
+    assert np.array_equal(dense.encode_query(" What is Bambicim? "), v1)
+    assert not np.array_equal(dense.encode_query("what is bambicim?"), v1)  # another query to a cased model
+    dense.encode_query("bambi game")
+    dense.encode_query("contact")  # evicts both "what is bambicim?" spellings from the LRU
+    assert len(dense._qcache) == 2
+
+    # a fresh process (new disk cache handle, empty LRU) still skips the encoder
+    monkeypatch.setattr(dense, "_qcache", dense.OrderedDict())
+    monkeypatch.setattr(dense, "_qcache_disk", DiskQueryCache(tmp_path / "qcache.bin", slots=64, salt="m"))
+    assert np.array_equal(dense.encode_query("What is Bambicim?"), v1)
+
+    stats = dense.query_cache_stats()
+    assert model.calls == 4
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 4)
+
+
+def test_micro_batcher_coalesces_concurrent_queries():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from copilot.batcher import MicroBatcher
+
+    model = _FakeModel()
+    batcher = MicroBatcher(model.encode, max_batch=8, max_wait_ms=50)
+    texts = [f"query {i}" for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        vecs = list(pool.map(batcher.submit, texts))
+
+    for t, v in zip(texts, vecs):
+        assert np.allclose(v, model.encode([t])[0])
+    stats = batcher.stats()
+    assert stats["items"] == 8
+    assert stats["batches"] < 8
+    assert stats["queue_ms_max"] >= 0
+
+
+def test_ivf_probe_matches_brute_force_on_clustered_rows():
+    from copilot.ivf import build_ivf, recall_report
+
+    rng = np.random.default_rng(1)
+    centers = _unit_rows(n=8, d=32, seed=2)
+    vecs = centers[rng.integers(0, 8, size=400)] + rng.normal(scale=0.05, size=(400, 32)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    store = VectorStore(vecs.astype(np.float32))
+
+    ivf = build_ivf(store, nlist=8, iters=10)
+    assert ivf.offsets[-1] == 400 and sorted(ivf.ids.tolist()) == list(range(400))
+
+    report = recall_report(store, ivf, nprobe=2, k=5, n_queries=40)
+    assert report["recall_at_k"] >= 0.9
+    assert report["scanned_fraction"] < 0.5
+
+
+def _write_index(path, texts, dim=16):
+    import json
+
+    path.mkdir(parents=True, exist_ok=True)
+    with (path / "corpus.jsonl").open("w", encoding="utf-8") as f:
+        for i, t in enumerate(texts):
+            f.write(json.dumps({"pid": str(i), "title": t, "url": f"/p/{i}", "text": t}) + "\n")
+    np.save(path / "embeddings.npy", _FakeModel(dim).encode(texts))
+
+
+def test_snapshot_stage_activate_and_swap(tmp_path, dense_index):
+    from copilot import dense, snapshot
+
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, ["pink software", "bambi game"])
+    v1 = snapshot.current_version(tmp_path)
+    assert snapshot.read_manifest(tmp_path / v1)["rows"] == 2
+    assert dense.search_dense("bambi game", k=1)[0][0]["text"] == "bambi game"
+    assert dense.index_version() == v1
+
+    # a broken build never becomes CURRENT
+    with pytest.raises(snapshot.SnapshotError):
+        with snapshot.stage(tmp_path) as staged:
+            np.save(staged / "embeddings.npy", np.zeros((5, 16), dtype=np.float32))
+    assert snapshot.current_version(tmp_path) == v1
+
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, ["pink software", "bambi game", "contact form"])
+    assert dense.reload_index() != v1
+    assert len(dense._snap.corpus) == 3
+
+
+def test_warmup_phases_and_readyz(monkeypatch, client):
+    from copilot import warmup
+
+    monkeypatch.setattr(warmup, "ENABLED", True)
+    monkeypatch.setattr(warmup, "_state", {"state": "cold", "pid": None, "phases": {}, "total_ms": 0.0})
+    monkeypatch.setattr(warmup, "PHASES", [("load_model", lambda: None), ("build_bm25", lambda: 1 / 0)])
+
+    warmup._state.update(state="warming", pid=os.getpid())
+    assert client.get("/readyz").status_code == 503
+
+    warmup.warm_up()
+    resp = client.get("/readyz")
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["state"] == "ready"
+    assert "ms" in body["phases"]["load_model"]
+    assert body["phases"]["build_bm25"]["error"].startswith("ZeroDivisionError")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="POSIX fork")
+def test_fork_waits_for_the_warmup_thread(monkeypatch):
+    import threading
+    import time
+
+    from copilot import warmup
+
+    held = threading.Lock()
+
+    def slow_phase():
+        with held:  # e.g. dense._snap_lock while the index loads
+            time.sleep(0.3)
+
+    monkeypatch.setattr(warmup, "_state", {"state": "cold", "pid": None, "phases": {}, "total_ms": 0.0})
+    monkeypatch.setattr(warmup, "PHASES", [("load_dense_index", slow_phase)])
+    warmup.start()
+    pid = os.fork()
+    if pid == 0:  # the child must not inherit `held` locked
+        os._exit(0 if held.acquire(timeout=1) else 1)
+    assert os.waitpid(pid, 0)[1] == 0 and warmup._state["state"] == "ready"
+
+
+def test_shared_memory_snapshot_is_attached_not_copied(monkeypatch, tmp_path, dense_index):
+    from copilot import dense, shm
+
+    _write_index(tmp_path, ["pink software", "bambi game", "contact form"])
+    monkeypatch.setattr(dense, "SHARED", True)
+
+    first = dense._current()
+    assert dense.search_dense("contact form", k=1)[0][0]["url"] == "/p/2"
+    assert isinstance(first.vecs.vecs.base, memoryview) or not first.vecs.vecs.flags.owndata
+
+    # a second "worker" attaches to the very same segments
+    monkeypatch.setattr(shm, "_segments", {})
+    second = dense._open_snapshot(tmp_path, "")
+    assert second.shm_keys == first.shm_keys
+    assert np.array_equal(second.vecs.vecs, first.vecs.vecs)
+    assert second.corpus[1]["text"] == "bambi game"
+
+    for key in first.shm_keys:
+        shm.release(key)
+
+    # a segment that fails while being filled is unlinked, not left for the next worker to wait on
+    class Unreadable:  # e.g. a mem-mapped source file truncated under us
+        dtype, shape, nbytes = np.dtype("<f4"), (4,), 16
+
+        def __array__(self, *a, **kw):
+            raise OSError("short read")
+
+    assert shm.share("broken", {"rows": Unreadable()}) is None
+    with pytest.raises(FileNotFoundError):
+        shm.shared_memory.SharedMemory(name=shm._name("broken"))
+
+
+def test_arrow_corpus_materializes_only_requested_rows(tmp_path, dense_index):
+    pytest.importorskip("pyarrow")
+    from copilot import corpus, dense
+
+    _write_index(tmp_path, ["pink software", "bambi game", "contact form"])
+    assert corpus.jsonl_to_arrow(tmp_path / "corpus.jsonl", tmp_path / corpus.ARROW_NAME) == 3
+    (tmp_path / "corpus.jsonl").unlink()
+
+    arrow = corpus.open_corpus(tmp_path)
+    assert len(arrow) == 3 and arrow.rows([2, 0])[0]["url"] == "/p/2"
+
+    (payload, _), = dense.search_dense("bambi game", k=1)
+    assert payload == {"pid": "1", "title": "bambi game", "url": "/p/1", "text": "bambi game"}
+
+
+def test_embedding_cache_only_encodes_changed_text(tmp_path):
+    from copilot.embed_cache import EmbeddingCache, embed_texts
+
+    model = _FakeModel()
+    texts = ["pink software", "bambi  game", "contact form", "pink software"]
+    vecs, stats = embed_texts(texts, model.encode, "m1", cache=EmbeddingCache(tmp_path))
+    assert (stats["reused"], stats["computed"]) == (0, 3)
+
+    edited = ["pink software", "bambi game", "a brand new paragraph"]
+    vecs2, stats = embed_texts(edited, model.encode, "m1", cache=EmbeddingCache(tmp_path))
+    assert (stats["reused"], stats["computed"]) == (2, 1)
+    assert np.array_equal(vecs2[:2], vecs[:2])
+
+    _, stats = embed_texts(edited, model.encode, "m2", cache=EmbeddingCache(tmp_path))
+    assert stats["reused"] == 0  # another model never reuses vectors
+
+
+def test_embedding_cache_evicts_the_oldest_builds_first(tmp_path):
+    from copilot.embed_cache import EmbeddingCache
+
+    vec = np.ones((1, 4), dtype=np.float32)
+    for key in (b"old1", b"old2", b"prev"):  # one build each, oldest first
+        EmbeddingCache(tmp_path).save([key.ljust(16, b"-")], vec, max_items=3)
+    EmbeddingCache(tmp_path).save([b"this".ljust(16, b"-")], vec, max_items=3)
+    assert [k.rstrip(b"-") for k in EmbeddingCache(tmp_path).keys.tolist()] == [b"this", b"prev", b"old2"]
+
+
+def test_semantic_cache_threshold_ttl_and_version():
+    from copilot.semcache import SemanticCache
+
+    cache = SemanticCache(threshold=0.9, ttl=600, max_items=2)
+    who, bambi, game = _FakeModel().encode(["who are you", "who is bambi", "bambi game"])
+    near_who = who + 0.05 * bambi
+    near_who /= np.linalg.norm(near_who)
+
+    cache.put(who, (8, 60), "v1", [{"url": "/about"}])
+    assert cache.get(near_who, (8, 60), "v1") == [{"url": "/about"}]
+    assert cache.get(game, (8, 60), "v1") is None
+    assert cache.get(who, (3, 60), "v1") is None  # other k → other result list
+    assert cache.get(who, (8, 60), "v2") is None  # index changed → invalidated
+
+    cache.put(who, (8, 60), "v2", [{"url": "/a"}])
+    cache.put(bambi, (8, 60), "v2", [{"url": "/b"}])
+    cache.get(who, (8, 60), "v2")
+    cache.put(game, (8, 60), "v2", [{"url": "/c"}])  # evicts least recently used ("who is bambi")
+    assert cache.get(bambi, (8, 60), "v2") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_reduced_vectors_with_full_dim_rescore(tmp_path, dense_index):
+    from copilot import dense, reduce, snapshot
+
+    rng = np.random.default_rng(3)
+    centers = _unit_rows(n=6, d=32, seed=4)
+    vecs = centers[rng.integers(0, 6, size=300)] + rng.normal(scale=0.05, size=(300, 32)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    full = VectorStore(vecs.astype(np.float32))
+
+    proj, meta = reduce.fit(full, 8, method="pca")
+    assert meta["explained_variance"] > 0.8
+    red = VectorStore(reduce.reduce_store(full, proj))
+    report = reduce.recall_report(full, red, proj, k=5, n_queries=40, rescore_factor=8)
+    assert red.dim == 8 and report["recall_at_k_rescored"] >= report["recall_at_k"]
+    assert report["recall_at_k_rescored"] >= 0.9
+
+    texts = ["pink software", "bambi game", "contact form", "portfolio work"]
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, texts)
+        store = VectorStore(np.load(staged / "embeddings.npy"))
+        proj, meta = reduce.fit(store, 3, method="prefix")
+        reduce.save(staged, proj, reduce.reduce_store(store, proj), meta)
+
+    snap = dense._current()
+    assert snap.proj is not None and snap.vecs.dim == 3 and snap.full.dim == 16
+    payload, score = dense.search_dense("bambi game", k=1)[0]
+    assert payload["text"] == "bambi game" and score == pytest.approx(1.0, abs=1e-5)  # full-dim score
+
+
+def test_search_dense_filters_by_kind_url_prefix_and_lang(tmp_path, dense_index):
+    import json
+
+    from copilot import dense, shm, snapshot
+    from copilot.corpus import meta_columns
+    from copilot.filters import RowFilters
+
+    rows = [
+        {"title": "home", "url": "https://bambicim.com/", "text": "pink software studio", "kind": "page"},
+        {"title": "post", "url": "https://bambicim.com/blog/pink", "text": "pink software studio notes",
+         "kind": "note", "lang": "en"},
+        {"title": "objava", "url": "https://bambicim.com/blog/roza", "text": "roza softver", "kind": "note",
+         "lang": "hr"},
+        {"title": "snippet", "url": "https://bambicim.com/code/x", "text": "pink software code", "kind": "code"},
+    ]
+    filters = RowFilters.from_corpus(rows)
+    assert filters.rows() is None
+    assert filters.rows(kind="page").tolist() == [0]  # rows without a kind count as pages too
+    assert filters.rows(url_prefix="/blog/").tolist() == [1, 2]
+    assert filters.rows(url_prefix="https://bambicim.com/code").tolist() == [3]
+    assert filters.rows(kind=["note", "code"], lang="EN").tolist() == [1]
+    assert filters.rows(url_prefix="/nope/").tolist() == []
+    assert filters.rows(url_prefix="/blog/r").tolist() == [2]
+
+    blob = "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+    ends = np.cumsum([len(json.dumps(r)) + 1 for r in rows])
+    packed = shm.PackedCorpus(np.frombuffer(blob, dtype=np.uint8), np.stack([np.r_[0, ends[:-1]], ends], 1))
+    assert meta_columns(packed, ("kind", "url")) == meta_columns(rows, ("kind", "url"))  # read off the raw JSONL
+
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        with (staged / "corpus.jsonl").open("w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in rows)
+        np.save(staged / "embeddings.npy", _FakeModel().encode([r["text"] for r in rows]))
+
+    assert dense.search_dense("pink software studio", k=1)[0][0]["title"] == "home"
+    hits = dense.search_dense("pink software studio", k=5, url_prefix="/blog/")
+    assert {p["title"] for p, _ in hits} == {"post", "objava"}
+    assert [p["title"] for p, _ in dense.search_dense("pink software studio", k=3, kind="code")] == ["snippet"]
+    assert dense.search_dense("pink software studio", kind="page", lang="hr") == []
+
+
+def test_batched_search_matches_single_query(monkeypatch, tmp_path, dense_index):
+    from copilot import dense, retrieval, snapshot
+
+    texts = ["pink software studio", "bambi game levels", "contact form email", "portfolio work notes",
+             "game of pink bambi", "security first software"]
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, texts)
+
+    queries = ["bambi game", "pink software", "email", "bambi game"]
+    many = dense.search_dense_many(queries, k=3)
+    for q, hits in zip(queries, many):
+        single = dense.search_dense(q, k=3)
+        assert [p["url"] for p, _ in hits] == [p["url"] for p, _ in single]
+        assert [s for _, s in hits] == pytest.approx([s for _, s in single], abs=1e-6)
+    assert dense.encode_queries([]).shape[0] == 0
+
+    paras = [retrieval.Para(doc_id=str(i), title=t, url=f"/p/{i}", text=t) for i, t in enumerate(texts)]
+    monkeypatch.setattr(retrieval, "_paras", paras)
+    monkeypatch.setattr(retrieval, "_bm25", retrieval.BM25([retrieval._tok(t) for t in texts]))
+    bm_queries = ["pink pink game", "nothing matches", "software"]
+    for (ids, scores), q in zip(retrieval._search_bm25_many(bm_queries, 4), bm_queries):
+        one_ids, one_scores = retrieval._search_bm25(q, 4)
+        assert ids.tolist() == one_ids.tolist() and scores == pytest.approx(one_scores, abs=1e-6)
+
+
+def test_sparse_bm25_matches_rank_bm25():
+    from rank_bm25 import BM25Okapi
+
+    from copilot.bm25 import SparseBM25
+
+    rng = np.random.default_rng(5)
+    words = ["pink", "bambi", "game", "django", "code", "notes", "studio", "ux", "ai", "security"]
+    # "pink" in most documents → negative idf → epsilon floor
+    corpus = [["pink"] + rng.choice(words, size=rng.integers(0, 12)).tolist() for _ in range(60)] + [[]]
+    ref, bm = BM25Okapi(corpus), SparseBM25(corpus)
+
+    for query in (["bambi", "game"], ["pink"], ["ux", "ux", "ai"], ["nope"], []):
+        expected = ref.get_scores(query)
+        assert bm.get_scores(query) == pytest.approx(expected, abs=1e-9)
+        ids, scores = bm.top_k(query, 5)
+        assert scores == pytest.approx(np.sort(expected[expected != 0])[::-1][:5], abs=1e-9)
+        assert bm.top_k_many([query], 5)[0][1] == pytest.approx(scores, abs=1e-9)
+
+
+@pytest.mark.django_db
+def test_bm25_folds_paragraph_changes_then_compacts(monkeypatch, bm25_index):
+    from copilot import retrieval
+    from copilot.models import Doc, Paragraph, ParagraphChange
+
+    monkeypatch.setattr(retrieval, "BM25_COMPACT_RATIO", 10)
+    monkeypatch.setattr(retrieval, "_compacting", False)
+
+    def texts(q):
+        hits = retrieval._search_bm25(q, 5)
+        return [retrieval._paras[i].text for i in hits[0]]
+
+    doc = Doc.objects.create(id="d1", title="Bambi", url="/d1", text="")
+    p1 = Paragraph.objects.create(doc=doc, order=0, text="pink bambi studio")
+    p2 = Paragraph.objects.create(doc=doc, order=1, text="bambi game levels")
+    assert ParagraphChange.objects.filter(op="upsert").count() == 2
+    retrieval._build_index()
+    assert sorted(texts("bambi")) == ["bambi game levels", "pink bambi studio"]
+
+    p1.text = "zebra stripes studio"
+    p1.save()
+    Paragraph.objects.create(doc=doc, order=2, text="giraffe neck")
+    p2.delete()
+    retrieval._build_index()  # folded, no rebuild
+    assert retrieval._bm25.n_delta == 2 and not retrieval._compacting
+    assert texts("bambi") == [] and texts("zebra") == ["zebra stripes studio"]
+    assert texts("giraffe") == ["giraffe neck"]
+
+    monkeypatch.setattr(retrieval, "_checked_at", retrieval._checked_at - 3 * 3600)  # e.g. a 3 h old lexicon
+    retrieval._build_index()  # nothing logged since: still folding, no rebuild
+    assert not retrieval._compacting and retrieval._bm25.n_delta == 2
+
+    Paragraph.objects.create(doc=doc, order=3, text="okapi forest")
+    Paragraph.objects.create(doc=doc, order=4, text="tapir river")
+    ParagraphChange.objects.filter(id=retrieval._last_change + 1).delete()  # pruned before this worker saw it
+    retrieval._build_index()
+    assert retrieval._compacting  # a gap in the log: rebuild instead of folding
+    monkeypatch.setattr(retrieval, "_compacting", False)
+    retrieval._rebuild()
+
+    ParagraphChange.log_reset()
+    retrieval._build_index()
+    assert retrieval._compacting  # rebuild handed to the background
+    retrieval._rebuild()
+    assert retrieval._bm25.n_delta == 0 and len(retrieval._paras) == 4
+    assert texts("studio") == ["zebra stripes studio"]
+
+
+@pytest.mark.django_db
+def test_lexicon_snapshot_is_mem_mapped_and_folded(monkeypatch, bm25_index, tmp_path, dense_index):
+    from django.core.management import call_command
+
+    from copilot import lexicon, retrieval, snapshot
+    from copilot.models import Doc, Paragraph
+
+    monkeypatch.setattr(retrieval, "BM25_COMPACT_RATIO", 10)
+    monkeypatch.setattr(retrieval, "USE_LEXICON", True)  # the bm25_index default is the DB rebuild
+
+    def texts(q):
+        return [retrieval._paras[i].text for i in retrieval._search_bm25(q, 5)[0]]
+
+    doc = Doc.objects.create(id="d1", title="Bambi", url="/d1", text="")
+    p1 = Paragraph.objects.create(doc=doc, order=0, text="pink bambi studio")
+    Paragraph.objects.create(doc=doc, order=1, text="bambi game levels")
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, ["pink software"])
+    call_command("copilot_lexindex")
+    assert lexicon.available(snapshot.current_dir(tmp_path))
+
+    loaded = lexicon.load(snapshot.current_dir(tmp_path), retrieval.Para)
+    fresh = retrieval.collect_index().bm25
+    for q in (["bambi"], ["pink", "studio"], ["nope"]):
+        assert loaded[0].get_scores(q) == pytest.approx(fresh.get_scores(q), abs=1e-6)
+
+    p1.text = "zebra stripes studio"
+    p1.save()
+    retrieval._build_index()  # lexicon mem-mapped, then the logged change folded on top
+    assert isinstance(retrieval._paras, lexicon.ParagraphRows) and retrieval._bm25.n_delta == 1
+    assert texts("bambi") == ["bambi game levels"] and texts("zebra") == ["zebra stripes studio"]
+    for q in ("bambi levels", "zebra studio"):  # exported row, folded row: spans from the index
+        row = int(retrieval._search_bm25(q, 1)[0][0])
+        qtok = retrieval._tok(q)
+        assert retrieval._spans.row(row) is not None
+        assert retrieval._snippet(retrieval._paras[row].text, qtok, row, retrieval._query_ids(qtok)) == \
+            retrieval._snippet(retrieval._paras[row].text, qtok)
+
+
+def test_hybrid_search_runs_retrievers_concurrently_with_deadline(monkeypatch):
+    import time
+
+    from copilot import dense, retrieval
+
+    def slow_bm25(q, k):
+        time.sleep(0.15)
+        return np.array([0]), np.array([1.0])
+
+    def slow_dense(q, k=6, qv=None):
+        time.sleep(delay["dense"])
+        return dense.DenseHits(np.array([0]), np.array([0.9]), np.array([-1]),
+                               [{"title": "Dense", "url": "/dense", "text": "dense hit"}])
+
+    delay = {"dense": 0.15}
+    monkeypatch.setattr(retrieval, "_build_index", lambda force=False: None)
+    monkeypatch.setattr(retrieval, "_semcache", None)
+    monkeypatch.setattr(retrieval, "_paras", [retrieval.Para(doc_id="d", title="Lexical", url="/bm", text="bm hit")])
+    monkeypatch.setattr(retrieval, "_search_bm25", slow_bm25)
+    monkeypatch.setattr(retrieval, "search_dense_hits", slow_dense)
+    monkeypatch.setattr(retrieval, "RETRIEVER_TIMEOUT_MS", 1000)
+
+    stats = {}
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats)
+    assert {i["url"] for i in items} == {"/bm", "/dense"}
+    assert stats["bm25_ms"] >= 140 and stats["dense_ms"] >= 140
+    assert stats["retrieve_ms"] < stats["bm25_ms"] + stats["dense_ms"] - 50  # overlapped, not summed
+    assert stats["timed_out"] == [] and stats["total_ms"] >= stats["retrieve_ms"]
+
+    delay["dense"] = 0.6
+    monkeypatch.setattr(retrieval, "RETRIEVER_TIMEOUT_MS", 300)
+    stats = {}
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats)
+    assert [i["url"] for i in items] == ["/bm"] and stats["timed_out"] == ["dense"]
+    assert stats["retrieve_ms"] < 550 and stats["skipped"] == ["dense"]
+
+    stats = {}  # a per-call budget overrides the default deadline
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats, budget_ms=5000)
+    assert {i["url"] for i in items} == {"/bm", "/dense"} and stats["skipped"] == []
+
+    def broken_dense(q, k=6, qv=None):
+        raise RuntimeError("encoder down")
+
+    monkeypatch.setattr(retrieval, "search_dense_hits", broken_dense)
+    stats = {}
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats)
+    assert [i["url"] for i in items] == ["/bm"] and stats["failed"] == stats["skipped"] == ["dense"]
+
+
+def test_hybrid_budget_covers_a_slow_query_encoder(monkeypatch):
+    import time
+
+    from copilot import dense, retrieval
+    from copilot.semcache import SemanticCache
+
+    def slow_encode(q):
+        time.sleep(0.5)
+        return np.ones(4, dtype=np.float32) / 2
+
+    def dense_hits(q, k=6, qv=None):
+        seen.append(qv)
+        return dense.DenseHits(np.array([0]), np.array([0.9]), np.array([-1]),
+                               [{"title": "Dense", "url": "/dense", "text": "dense hit"}])
+
+    seen = []
+    monkeypatch.setattr(retrieval, "_build_index", lambda force=False: None)
+    monkeypatch.setattr(retrieval, "_semcache", SemanticCache(threshold=0.9, ttl=60, max_items=8))
+    monkeypatch.setattr(retrieval, "_paras", [retrieval.Para(doc_id="d", title="Lexical", url="/bm", text="bm hit")])
+    monkeypatch.setattr(retrieval, "_spans", None)  # highlights from the text, not another test's lexicon
+    monkeypatch.setattr(retrieval, "_search_bm25", lambda q, k: (np.array([0]), np.array([1.0])))
+    monkeypatch.setattr(retrieval, "search_dense_hits", dense_hits)
+    monkeypatch.setattr(dense, "encode_query", slow_encode)
+
+    stats = {}
+    t0 = time.perf_counter()
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats, budget_ms=200)
+    assert time.perf_counter() - t0 < 0.4
+    assert [i["url"] for i in items] == ["/bm"] and stats["skipped"] == ["dense", "semcache"]
+    assert stats["timed_out"] == ["dense"] and retrieval._semcache.stats()["size"] == 0  # partial: not cached
+
+    time.sleep(0.5)  # the late encoder and dense search finish and give their dense slots back
+    stats = {}
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats, budget_ms=3000)
+    assert {i["url"] for i in items} == {"/bm", "/dense"} and stats["skipped"] == []
+    assert seen[-1] is not None  # the dense side reused the lookup's query vector
+    assert retrieval.hybrid_search("bambi", k=4, stats=stats) and stats["cached"]
+
+    # a paraphrase (same vector here) reuses the ranking; snippets are cut for the new query
+    items = retrieval.hybrid_search("hit", k=4, stats=stats)
+    bm = next(i for i in items if i["url"] == "/bm")
+    assert stats["cached"] and [bm["snippet"][s:e] for s, e in bm["highlights"]] == ["hit"]
+    items[0]["aliases"].append("/mutated")
+    assert "/mutated" not in retrieval.hybrid_search("bambi", k=4)[0]["aliases"]
+
+
+def test_hybrid_bm25_overlaps_the_query_encoder_with_the_semantic_cache_on(monkeypatch):
+    import time
+
+    from copilot import dense, retrieval
+    from copilot.semcache import SemanticCache
+
+    def slow_bm25(q, k):
+        time.sleep(0.2)
+        return np.array([0]), np.array([1.0])
+
+    def slow_encode(q):
+        time.sleep(0.2)
+        return _FakeModel().encode([q])[0]
+
+    def dense_hits(q, k=6, qv=None):
+        return dense.DenseHits(np.array([0]), np.array([0.9]), np.array([-1]),
+                               [{"title": "Dense", "url": "/dense", "text": "dense hit"}])
+
+    monkeypatch.setattr(retrieval, "_build_index", lambda force=False: None)
+    monkeypatch.setattr(retrieval, "_semcache", SemanticCache(threshold=0.9, ttl=60, max_items=8))
+    monkeypatch.setattr(retrieval, "_paras", [retrieval.Para(doc_id="d", title="Lexical", url="/bm", text="bm hit")])
+    monkeypatch.setattr(retrieval, "_search_bm25", slow_bm25)
+    monkeypatch.setattr(retrieval, "search_dense_hits", dense_hits)
+    monkeypatch.setattr(dense, "encode_query", slow_encode)
+
+    stats = {}
+    items = retrieval.hybrid_search("bambi", k=4, stats=stats, budget_ms=3000)
+    assert {i["url"] for i in items} == {"/bm", "/dense"} and stats["skipped"] == []
+    assert stats["total_ms"] < 350  # encode and BM25 side by side, not 400 ms in a row
+    assert retrieval._semcache.stats()["size"] == 1
+
+
+def test_hybrid_search_many_caches_only_complete_rankings(monkeypatch):
+    from copilot import dense, retrieval
+    from copilot.semcache import SemanticCache
+
+    def broken_dense(queries, k=8, qvs=None):
+        raise RuntimeError("index missing")
+
+    def dense_many(queries, k=8, qvs=None):
+        return [dense.DenseHits(np.array([0]), np.array([0.9]), np.array([-1]),
+                                [{"title": "Dense", "url": "/dense", "text": "dense hit"}]) for _ in queries]
+
+    monkeypatch.setattr(retrieval, "_build_index", lambda force=False: None)
+    monkeypatch.setattr(retrieval, "_semcache", SemanticCache(threshold=0.9, ttl=60, max_items=8))
+    monkeypatch.setattr(retrieval, "_paras", [retrieval.Para(doc_id="d", title="Lexical", url="/bm", text="bm hit")])
+    monkeypatch.setattr(retrieval, "_search_bm25_many", lambda qs, k: [(np.array([0]), np.array([1.0]))] * len(qs))
+    monkeypatch.setattr(dense, "encode_queries", lambda qs: _FakeModel().encode(qs))
+    monkeypatch.setattr(retrieval, "search_dense_hits_many", broken_dense)
+
+    out = retrieval.hybrid_search_many(["bambi", "pink"], k=4)
+    assert [[i["url"] for i in items] for items in out] == [["/bm"], ["/bm"]]
+    assert retrieval._semcache.stats()["size"] == 0  # BM25-only: not cached
+
+    monkeypatch.setattr(retrieval, "search_dense_hits_many", dense_many)
+    retrieval.hybrid_search_many(["bambi", "pink"], k=4)
+    assert retrieval._semcache.stats()["size"] == 2
+
+
+def test_hybrid_keeps_answering_from_bm25_while_slow_dense_calls_pile_up(monkeypatch):
+    import time
+
+    from copilot import dense, retrieval
+
+    def stuck_dense(q, k=6, qv=None):
+        time.sleep(1.0)
+        return dense.DenseHits(np.array([0]), np.array([0.9]), np.array([-1]),
+                               [{"title": "Dense", "url": "/dense", "text": "dense hit"}])
+
+    monkeypatch.setattr(retrieval, "_build_index", lambda force=False: None)
+    monkeypatch.setattr(retrieval, "_semcache", None)
+    monkeypatch.setattr(retrieval, "_paras", [retrieval.Para(doc_id="d", title="Lexical", url="/bm", text="bm hit")])
+    monkeypatch.setattr(retrieval, "_search_bm25", lambda q, k: (np.array([0]), np.array([1.0])))
+    monkeypatch.setattr(retrieval, "search_dense_hits", stuck_dense)
+    monkeypatch.setattr(retrieval, "DENSE_POOL_SIZE", 2)
+    for name in ("_pool", "_pool_slots", "_pool_pid"):  # a fresh pool of 2, not the one other tests left busy
+        monkeypatch.setattr(retrieval, name, None if name != "_pool_pid" else 0)
+
+    for n in range(6):
+        stats = {}
+        t0 = time.perf_counter()
+        items = retrieval.hybrid_search("bambi", k=4, stats=stats, budget_ms=200)
+        assert [i["url"] for i in items] == ["/bm"] and stats["skipped"] == ["dense"]
+        assert time.perf_counter() - t0 < 0.4
+        # the first two calls time out and keep their slot; the rest find none and don't wait at all
+        assert stats["busy"] == ([] if n < 2 else ["dense"])
+        assert n < 2 or stats["retrieve_ms"] < 50
+
+
+@pytest.mark.bench
+@pytest.mark.django_db
+def test_bench_replays_qa_site_through_every_mode(monkeypatch, bm25_index, tmp_path, dense_index):
+    import json
+    from pathlib import Path
+
+    from copilot import bench, dense, retrieval, snapshot
+    from copilot.models import Doc, Paragraph
+
+    pairs = bench.load_pairs([Path(__file__).resolve().parent.parent / "data" / "qa_site.jsonl"])
+    assert len(pairs) == 50
+    for i, pair in enumerate(pairs):
+        doc = Doc.objects.create(id=f"qa{i}", title=pair["q"], url=f"/faq/{i}", text="")
+        Paragraph.objects.create(doc=doc, order=0, text=pair["a"])
+    with snapshot.stage(tmp_path, inherit=False) as staged:
+        _write_index(staged, [p["a"] for p in pairs])
+
+    hits, lru = dense.query_cache_stats()["hits"], dense._qcache
+    report = bench.run(pairs, k=5, repeat=2)
+    json.dumps(report)
+    assert report["caches"] == "cold" and dense.query_cache_stats()["hits"] == hits  # every repeat encoded again
+    assert set(report["modes"]) == set(bench.MODES) and report["queries"] == 50
+    for res in report["modes"].values():
+        assert 0 <= res["mrr"] <= res["recall_at_k"] <= 1
+        assert res["p50_ms"] <= res["p95_ms"] <= res["p99_ms"]
+    assert report["modes"]["bm25"]["recall_at_k"] >= 0.25
+    assert retrieval._semcache is not None or not retrieval.SEMCACHE  # restored
+    assert dense.QCACHE_SIZE > 0 and dense._qcache is lru
+
+
+@pytest.mark.django_db
+def test_streaming_build_stops_at_whole_documents_within_budget(monkeypatch, bm25_index, caplog):
+    from copilot import retrieval
+    from copilot.models import Doc, Paragraph
+
+    monkeypatch.setattr(retrieval, "ROW_CHUNK", 2)
+    for d in ("a", "b", "c"):
+        doc = Doc.objects.create(id=d, title=d.upper(), url=f"/{d}", text="")
+        for i in range(3):
+            Paragraph.objects.create(doc=doc, order=i, text=f"doc {d} paragraph {i} " + "filler " * 40)
+
+    per_doc = retrieval.collect_index().nbytes / 3
+    monkeypatch.setattr(retrieval, "INDEX_BUDGET_MB", 1.5 * per_doc / 2 ** 20)
+    with caplog.at_level("WARNING", logger="app"):
+        built = retrieval.collect_index()
+    assert [p.doc_id for p in built.paras] == ["a"] * 3 and built.bm25.corpus_size == 3
+    assert built.nbytes <= 1.5 * per_doc
+    assert "6 paragraphs of 2 documents left out" in caplog.text
+    assert len(retrieval.collect_index(budget_mb=0).paras) == 9  # offline builds (copilot_build) take everything
+    assert built.paras[0].title == "A" and built.paras[0].url == "/a"  # doc fallbacks from the same row
+
+    monkeypatch.setattr(retrieval, "INDEX_BUDGET_MB", 0.5 * per_doc / 2 ** 20)  # the first document always fits
+    retrieval._build_index()
+    assert len(retrieval._paras) == 3
+    Paragraph.objects.create(doc_id="a", order=3, text="doc a late paragraph")
+    Paragraph.objects.create(doc_id="c", order=3, text="doc c late paragraph")
+    retrieval._build_index()  # budget spent: only the indexed document grows
+    assert sorted(retrieval._paras[i].doc_id for i in retrieval._search_bm25("late", 5)[0]) == ["a"]
+
+
+def test_snippet_window_and_highlights_from_token_spans():
+    from copilot import snippets
+
+    text = "Intro about nothing much. " * 12 + "The Bambi game has pink levels and a Bambi boss. " + "Outro. " * 20
+    toks, starts, ends = snippets.token_spans(text)
+    assert toks[:2] == ["intro", "about"] and text[starts[-1]:ends[-1]] == "Outro"
+
+    hit = np.flatnonzero(np.isin(toks, ["bambi", "pink"]))
+    snip, marks = snippets.window(text, np.asarray(starts)[hit], np.asarray(ends)[hit], width=120)
+    assert snip.startswith("… ") and snip.endswith(" …") and len(marks) == 3
+    assert [snip[s:e] for s, e in marks] == ["Bambi", "pink", "Bambi"]
+
+    snip, marks = snippets.window("short text", np.empty(0, dtype=int), np.empty(0, dtype=int))
+    assert (snip, marks) == ("short text", [])
+
+
+@pytest.mark.django_db
+def test_turkish_dotted_capital_i_matches_in_index_query_and_snippet(monkeypatch, bm25_index):
+    from copilot import retrieval, snippets
+    from copilot.models import Doc, Paragraph
+
+    doc = Doc.objects.create(id="tr", title="İletişim", url="/iletisim", text="")
+    Paragraph.objects.create(doc=doc, order=0, text="İstanbul ofisimiz için İLETİŞİM formunu kullanın.")
+    Paragraph.objects.create(doc=doc, order=1, text="Bambi oyunu pembe seviyelerle dolu.")
+    retrieval._build_index(force=True)
+
+    assert retrieval._tok("İstanbul İletişim") == snippets.token_spans("İstanbul İletişim")[0] == \
+        ["istanbul", "iletişim"]
+    for q in ("İstanbul", "istanbul", "İletişim"):
+        ids, _ = retrieval._search_bm25(q, 5)
+        assert [retrieval._paras[i].text[:8] for i in ids] == ["İstanbul"], q
+    row = int(retrieval._search_bm25("İletişim", 5)[0][0])
+    snip, marks = retrieval._snippet(retrieval._paras[row].text, retrieval._tok("İletişim İstanbul"), row,
+                                     retrieval._query_ids(retrieval._tok("İletişim İstanbul")))
+    assert [snip[s:e] for s, e in marks] == ["İstanbul", "İLETİŞİM"]
+
+
+@pytest.mark.django_db
+def test_copilot_chunk_bulk_writes_and_skips_unchanged_docs(monkeypatch, bm25_index):
+    from django.core.management import call_command
+
+    from copilot import chunking, retrieval
+    from copilot.models import Doc, Paragraph, ParagraphChange
+
+    text = "\n".join(f"Section {i}. " + "Pink bambi studio builds small things. " * 4 for i in range(6))
+    chunks = chunking.chunk_text(text, target=200, overlap=40)
+    assert all(len(c) <= 200 for c in chunks) and len(chunks) >= 6
+    for prev, nxt in zip(chunks, chunks[1:]):  # each chunk starts with the last words of the one before
+        assert any(nxt.startswith(prev[-n:]) for n in range(8, 40))
+    assert chunking.chunk_text("tiny", min_len=40) == ["tiny"]
+
+    monkeypatch.setattr(retrieval, "BM25_COMPACT_RATIO", 10)
+    Doc.objects.create(id="d1", title="Studio", url="/studio", text=text)
+    Doc.objects.create(id="d2", title="Game", url="/game", text="The Bambi game has pink levels.\n" * 3)
+    retrieval._build_index()
+
+    call_command("copilot_chunk", "--target", "200")
+    d1 = list(Paragraph.objects.filter(doc_id="d1").order_by("order").values_list("order", "text", "url"))
+    assert [o for o, _, _ in d1] == list(range(len(d1))) and d1[0][2] == "/studio"
+    assert Paragraph.objects.filter(doc_id="d2").count() == 1  # short lines pack into one chunk
+    assert ParagraphChange.objects.filter(op="upsert").count() == Paragraph.objects.count()
+    assert Doc.objects.get(pk="d1").meta["chunks"] == len(d1)
+    retrieval._build_index()  # folded from the bulk-logged changes
+    assert {retrieval._paras[i].url for i in retrieval._search_bm25("levels", 5)[0]} == {"/game"}
+
+    before = set(Paragraph.objects.values_list("pk", flat=True))
+    call_command("copilot_chunk", "--target", "200")
+    assert set(Paragraph.objects.values_list("pk", flat=True)) == before  # content hash unchanged
+
+    Doc.objects.filter(pk="d2").update(text="Zebra stripes replace the old game page entirely.")
+    call_command("copilot_chunk", "--target", "200")
+    assert list(Paragraph.objects.filter(doc_id="d2").values_list("text", flat=True)) == \
+        ["Zebra stripes replace the old game page entirely."]
+    assert set(Paragraph.objects.filter(doc_id="d1").values_list("pk", flat=True)) <= before
+    retrieval._build_index()
+    assert retrieval._search_bm25("levels", 5)[0].size == 0 and retrieval._search_bm25("zebra", 5)[0].size == 1
+
+
+@pytest.mark.django_db
+def test_copilot_build_writes_corpus_vectors_and_lexicon_from_one_pass(tmp_path, dense_index):
+    from io import StringIO
+
+    from django.core.management import call_command
+
+    from copilot import corpus, dense, lexicon, retrieval, snapshot
+    from copilot.models import Doc, Paragraph
+
+    studio = Doc.objects.create(id="d1", kind="page", title="Studio", url="/studio", text="")
+    notes = Doc.objects.create(id="d2", kind="note", title="Notes", url="/blog/x", text="", meta={"lang": "hr"})
+    Paragraph.objects.create(doc=studio, order=0, text="pink software studio", title="Studio", url="/studio")
+    Paragraph.objects.create(doc=studio, order=1, text="bambi game levels", title="Studio", url="/studio")
+    Paragraph.objects.create(doc=notes, order=0, text="roza softver studio", title="Notes", url="/blog/x")
+
+    out = StringIO()
+    call_command("copilot_build", "--workers", "1", stdout=out)
+    assert "paragraphs/s" in out.getvalue()
+    path = snapshot.current_dir(tmp_path)
+    vecs = np.load(path / "embeddings.npy")
+    assert vecs.dtype == np.float32 and vecs.shape[0] == 3
+    assert np.linalg.norm(vecs, axis=1) == pytest.approx(1.0, abs=1e-5)
+    if corpus.available():  # same rows, same order as the BM25 lexicon published next to them
+        assert lexicon.available(path)
+        paras = lexicon.load(path, retrieval.Para)[1]
+        assert [p.text for p in paras] == corpus.read_texts(path)
+
+    assert dense.search_dense("bambi game levels", k=1)[0][0]["text"] == "bambi game levels"
+    assert [p["text"] for p, _ in dense.search_dense("studio", k=3, kind="note", lang="hr")] == ["roza softver studio"]
+
+    call_command("copilot_build", "--workers", "1", stdout=out)  # unchanged text: every vector from the cache
+    assert "reused 3, computed 0" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_hybrid_fuses_both_retrievers_on_paragraph_ids(monkeypatch, bm25_index, dense_index):
+    from django.core.management import call_command
+
+    from copilot import retrieval
+    from copilot.models import Doc, Paragraph
+
+    ranked = [np.array([7, 3, 5]), np.array([3, 9])]
+    ids, scores = retrieval._rrf(ranked, 60, 3)
+    assert ids.tolist() == [3, 7, 9]  # 3 in both lists; 7 and 9 tie at rank 1, 7 was seen first
+    assert scores.tolist() == pytest.approx([1 / 62 + 1 / 61, 1 / 61, 1 / 62])
+
+    monkeypatch.setattr(retrieval, "BM25_COMPACT_RATIO", 10)
+    monkeypatch.setattr(retrieval, "_semcache", None)
+    doc = Doc.objects.create(id="d1", title="Studio", url="/studio", text="")
+    game = Paragraph.objects.create(doc=doc, order=0, text="bambi game levels", title="Studio", url="/studio")
+    Paragraph.objects.create(doc=doc, order=1, text="pink software studio", title="Studio", url="/studio")
+    call_command("copilot_build", "--workers", "1", "--no-lexicon")
+
+    items = retrieval.hybrid_search("bambi game levels", k=5)
+    assert [i["text"] for i in items].count("bambi game levels") == 1  # found by both, fused once
+    assert items[0]["text"] == "bambi game levels" and items[0]["score"] == pytest.approx(2 / 61, abs=1e-4)
+
+    game.text = "bambi game levels and bosses"  # the dense corpus still has the old text
+    game.save()
+    items = retrieval.hybrid_search("bambi game levels", k=5)
+    assert items[0]["text"] == "bambi game levels and bosses" and len(items) == 2
+    assert items[0]["highlights"]
+
+
+@pytest.mark.django_db
+def test_near_duplicate_paragraphs_fold_into_aliases(monkeypatch, bm25_index, tmp_path, dense_index):
+    from django.core.management import call_command
+
+    from copilot import corpus, dense, lexicon, retrieval, snapshot
+    from copilot.dedupe import NearDuplicates
+    from copilot.models import Doc, Paragraph
+
+    about = ("Bambi builds princess pink software, small games and web tools, and takes on freelance projects. "
+             "Every project starts with a short call about what you need, then a written plan with a fixed price, "
+             "weekly previews you can click through, and a handover with docs and a month of free fixes.")
+    dups = NearDuplicates(0.8)
+    assert dups.check("a", about.split()) is None
+    assert dups.check("b", about.replace("small", "tiny").split()) == "a"
+    assert dups.check("c", "the bambi game has levels bosses and a secret ending".split()) is None
+    assert dups.check("d", []) is None and dups.check("e", []) is None  # token-less rows are all kept
+
+    monkeypatch.setattr(retrieval, "_semcache", None)
+    for i, path in enumerate(["/", "/#work", "/#contact"]):  # fragments of one homepage, crawled as three docs
+        doc = Doc.objects.create(id=f"d{i}", title="Home", url=path, text="")
+        Paragraph.objects.create(doc=doc, order=0, text=about, title="Home", url=path)
+        Paragraph.objects.create(doc=doc, order=1, text=f"section {path} only: " + "unique words " * i)
+    built = retrieval.collect_index()
+    assert built.duplicates == 2 and len(built.paras) == 4
+    assert built.aliases == {0: ["/#work", "/#contact"]}
+    assert len(retrieval.collect_index(dedupe=0).paras) == 6
+
+    call_command("copilot_build", "--workers", "1")
+    path = snapshot.current_dir(tmp_path)
+    assert len(np.load(path / "embeddings.npy")) == 4
+    monkeypatch.setattr(retrieval, "USE_LEXICON", corpus.available())
+    retrieval._build_index()
+    if corpus.available():
+        assert isinstance(retrieval._paras, lexicon.ParagraphRows)  # aliases came back from lex.json
+    items = retrieval.hybrid_search("princess pink software freelance", k=5)
+    assert [i["text"] for i in items].count(about) == 1
+    assert items[0]["url"] == "/" and items[0]["aliases"] == ["/#work", "/#contact"]
+    assert dense.search_dense(about, k=1)[0][0]["aliases"] == ["/#work", "/#contact"]
@@ -15,6 +15,8 @@ from django.utils.cache import patch_cache_control
 from django.utils.text import get_valid_filename
 from django.views.decorators.csrf import csrf_exempt
 
+from . import warmup
+
 try:
     from openai import OpenAI
 except Exception:
@@ -98,6 +100,15 @@ def _sse(event: str, data: Dict[str, Any] | str) -> bytes:
     return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
 
 
+# --- /readyz (retriever warm-up status) ---------------------------------------
+def readyz(_request: HttpRequest):
+    info = warmup.readiness()
+    status = 503 if info["state"] in ("cold", "warming") else 200
+    resp = JsonResponse(info, status=status)
+    patch_cache_control(resp, no_cache=True)
+    return resp
+
+
 # --- /api/copilot/upload (optional files before chat) ------------------------
 @csrf_exempt
 def upload(request: HttpRequest):
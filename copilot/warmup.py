@@ -0,0 +1,129 @@
+"""
+Eager warm-up of the copilot retrievers.
+
+Opt in with COPILOT_WARMUP=1: CopilotConfig.ready() starts it in a background
+thread, and with `gunicorn --preload` also add to gunicorn.conf.py
+
+    from copilot.warmup import post_fork  # noqa: F401
+
+so every forked worker warms itself. A fork waits for the warm-up thread of
+the forking process, so a preloading master hands its workers no lock that
+thread held. /readyz reports "warming" until done.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+log = logging.getLogger("app")
+
+ENABLED = str(getattr(settings, "COPILOT_WARMUP", os.getenv("COPILOT_WARMUP", "0"))) == "1"
+DUMMY_QUERY = "what is bambicim"
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_state: Dict[str, Any] = {"state": "cold", "pid": None, "phases": {}, "total_ms": 0.0}
+
+
+def _import_encoder() -> None:
+    import sentence_transformers  # noqa: F401
+
+
+def _load_model() -> None:
+    from copilot import dense
+    dense._load_model()
+
+
+def _load_dense() -> None:
+    from copilot import dense
+    dense._current()
+
+
+def _build_bm25() -> None:
+    from copilot import retrieval
+    retrieval._build_index()  # mem-maps the snapshot's lexicon when it has one
+
+
+def _dummy_query() -> None:
+    from copilot import retrieval
+    retrieval.hybrid_search(DUMMY_QUERY, k=3)
+
+
+PHASES: list[tuple[str, Callable[[], None]]] = [
+    ("import_encoder", _import_encoder),
+    ("load_model", _load_model),
+    ("load_dense_index", _load_dense),
+    ("build_bm25", _build_bm25),
+    ("dummy_query", _dummy_query),
+]
+
+
+def warm_up() -> Dict[str, Any]:
+    """
+    Run every phase in order, timing each one. A failing phase is recorded and
+    skipped (e.g. no dense index yet): the site still serves what it can.
+    """
+    t_start = time.perf_counter()
+    for name, fn in PHASES:
+        t0 = time.perf_counter()
+        entry: Dict[str, Any] = {}
+        try:
+            fn()
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            log.warning("copilot warm-up: %s failed: %s", name, e)
+        entry["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        _state["phases"][name] = entry
+    _state["total_ms"] = round((time.perf_counter() - t_start) * 1000, 1)
+    _state["state"] = "ready"
+    log.info("copilot warm-up done in %.0f ms: %s", _state["total_ms"], _state["phases"])
+    return readiness()
+
+
+def start(background: bool = True) -> None:
+    """Kick off warm-up once per process (safe to call from every hook)."""
+    global _thread
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return
+        _state.update(state="warming", pid=os.getpid(), phases={}, total_ms=0.0)
+    if background:
+        _thread = threading.Thread(target=warm_up, name="copilot-warmup", daemon=True)
+        _thread.start()
+    else:
+        warm_up()
+
+
+def _finish_before_fork() -> None:
+    # a lock the warm-up thread holds at fork time (dense._snap_lock, the import lock of torch, ...) stays
+    # held in the child, whose own warm-up and first query then hang: `--preload` forks a warm master instead
+    t = _thread
+    if t is not None and t.is_alive() and t is not threading.current_thread():
+        t.join()
+
+
+if hasattr(os, "register_at_fork"):  # POSIX
+    os.register_at_fork(before=_finish_before_fork)
+
+
+def readiness() -> Dict[str, Any]:
+    """
+    {"state": "disabled" | "cold" | "warming" | "ready", "phases": {...}, "total_ms": ...}
+    A worker forked from a warming/warmed master starts its own warm-up here.
+    """
+    if not ENABLED:
+        return {"state": "disabled", "phases": {}, "total_ms": 0.0}
+    if _state["pid"] != os.getpid():
+        start()
+    return {"state": _state["state"], "phases": dict(_state["phases"]), "total_ms": _state["total_ms"]}
+
+
+def post_fork(server, worker) -> None:
+    """gunicorn hook: warm each worker right after fork."""
+    if ENABLED:
+        start()
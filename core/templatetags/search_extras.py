@@ -1,5 +1,6 @@
 # core/templatetags/search_extras.py
 import re
+from functools import lru_cache
 
 from django import template
 from django.utils.html import escape
@@ -8,6 +9,12 @@ from django.utils.safestring import mark_safe
 register = template.Library()
 
 
+@lru_cache(maxsize=256)
+def _pattern(tokens: tuple) -> re.Pattern:
+    # one alternation for the whole query, longest first so "bambicim" wins over "bambi"
+    return re.compile(r"\b(?:" + "|".join(re.escape(t) for t in tokens) + r")\b", re.I)
+
+
 @register.filter
 def highlight(text: str, query_or_tokens):
     if not text:
@@ -19,11 +26,11 @@ def highlight(text: str, query_or_tokens):
     if not tokens:
         return escape(text)
 
-    def repl(m):
-        return f"<mark>{m.group(0)}</mark>"
-
-    out = escape(text)
-    # Replace each token case-insensitively; keep it simple and safe
-    for t in sorted(set(tokens), key=len, reverse=True):
-        out = re.sub(rf"(?i)\b{re.escape(t)}\b", repl, out)
-    return mark_safe(out)
+    # match on the raw text and escape around the hits: one pass, and "amp" never matches inside "&amp;"
+    out, pos = [], 0
+    for m in _pattern(tuple(sorted({t.lower() for t in tokens}, key=lambda t: (-len(t), t)))).finditer(text):
+        out.append(escape(text[pos:m.start()]))
+        out.append(f"<mark>{escape(m.group(0))}</mark>")
+        pos = m.end()
+    out.append(escape(text[pos:]))
+    return mark_safe("".join(out))
@@ -32,3 +32,11 @@ def test_contact_rate_limit_and_validation(client, settings):
         "message": "Hello again!"
     })
     assert resp.status_code == 302
+
+
+def test_highlight_filter_marks_whole_tokens_and_escapes():
+    from core.templatetags.search_extras import highlight
+
+    out = highlight("Bambi & bambicim <b>game</b>", "bambi game &amp")
+    assert out == "<mark>Bambi</mark> &amp; bambicim &lt;b&gt;<mark>game</mark>&lt;/b&gt;"
+    assert highlight("Bambicim rocks", ["bambi", "bambicim"]) == "<mark>Bambicim</mark> rocks"